@@ -142,6 +142,11 @@ MEDIA_ROOT = BASE_DIR / 'media'
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB max
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760   # 10MB max
 
+# Largest decoded image accepted (width x height), checked from the header
+# before any pixels are decoded. A small compressed file can still decode
+# to a huge buffer.
+MAX_IMAGE_PIXELS = int(os.environ.get('MAX_IMAGE_PIXELS', 10000 * 10000))
+
 # Allowed file extensions for uploads
 ALLOWED_IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tiff']
 ALLOWED_UPLOAD_EXTENSIONS = ALLOWED_IMAGE_EXTENSIONS + ['.pdf', '.mp4', '.avi', '.mov']
@@ -206,4 +211,264 @@ CSRF_TRUSTED_ORIGINS = [
 ]
 
 # CORS Settings (if needed)
-SECURE_CROSS_ORIGIN_OPENER_POLICY = None
\ No newline at end of file
+SECURE_CROSS_ORIGIN_OPENER_POLICY = None
+
+# ============================================
+# BACKGROUND SEGMENTATION (rembg)
+# ============================================
+# Sessions are loaded once per worker and reused across requests.
+# Thread counts of 0 let ONNX Runtime pick its own defaults.
+SEGMENTATION = {
+    'model': os.environ.get('SEGMENTATION_MODEL', 'u2net'),
+    'prewarm': os.environ.get('SEGMENTATION_PREWARM', 'True') == 'True',
+    'prewarm_models': [m.strip() for m in os.environ.get('SEGMENTATION_PREWARM_MODELS', 'u2net').split(',') if m.strip()],
+    'intra_op_threads': int(os.environ.get('SEGMENTATION_INTRA_OP_THREADS', 0)),
+    'inter_op_threads': int(os.environ.get('SEGMENTATION_INTER_OP_THREADS', 0)),
+
+    # Masks are computed on a copy no larger than working_size (longest
+    # side) and upsampled to the original. refine_edges switches the
+    # upsampling to an edge-aware guided filter.
+    'working_size': int(os.environ.get('SEGMENTATION_WORKING_SIZE', 1024)),
+    'refine_edges': os.environ.get('SEGMENTATION_REFINE_EDGES', 'False') == 'True',
+    'refine_radius': int(os.environ.get('SEGMENTATION_REFINE_RADIUS', 4)),
+    'refine_eps': float(os.environ.get('SEGMENTATION_REFINE_EPS', 1e-3)),
+
+    # Shared inference service (python manage.py segmentation_server).
+    # Leave pool_socket empty to run the model inside each web worker.
+    'pool_socket': os.environ.get('SEGMENTATION_POOL_SOCKET', ''),
+    'pool_authkey': os.environ.get('SEGMENTATION_POOL_AUTHKEY', SECRET_KEY),
+    'pool_workers': int(os.environ.get('SEGMENTATION_POOL_WORKERS', 2)),
+    'pool_timeout': int(os.environ.get('SEGMENTATION_POOL_TIMEOUT', 60)),
+    'pool_fallback': os.environ.get('SEGMENTATION_POOL_FALLBACK', 'True') == 'True',
+    'batch_size': int(os.environ.get('SEGMENTATION_BATCH_SIZE', 4)),
+    'batch_window_ms': int(os.environ.get('SEGMENTATION_BATCH_WINDOW_MS', 10)),
+}
+
+
+# ============================================
+# ALPHA MASK CACHE
+# ============================================
+# Segmentation masks keyed by a hash of the decoded image, so trying
+# several background colours on one photo runs inference only once.
+# Set MASK_CACHE_DIR to add a disk tier shared by all workers.
+MASK_CACHE = {
+    'enabled': os.environ.get('MASK_CACHE_ENABLED', 'True') == 'True',
+    'memory_bytes': int(os.environ.get('MASK_CACHE_MEMORY_MB', 64)) * 1024 * 1024,
+    'disk_dir': os.environ.get('MASK_CACHE_DIR', ''),
+    'disk_bytes': int(os.environ.get('MASK_CACHE_DISK_MB', 512)) * 1024 * 1024,
+}
+
+
+# ============================================
+# BACKGROUND CHANGER (manual mode)
+# ============================================
+# The colour-tolerance mask is computed in bands of band_rows rows.
+# workers=0 uses up to 4 threads; numba is used when installed.
+TOLERANCE_MASK = {
+    'band_rows': int(os.environ.get('TOLERANCE_MASK_BAND_ROWS', 256)),
+    'workers': int(os.environ.get('TOLERANCE_MASK_WORKERS', 0)),
+    'use_numba': os.environ.get('TOLERANCE_MASK_USE_NUMBA', 'True') == 'True',
+}
+
+
+# ============================================
+# PIXEL BUDGET (admission control)
+# ============================================
+# Decoded-image memory shared by all workers on this host. Requests that
+# don't fit wait up to wait_seconds, then get 503 + Retry-After. Batch
+# conversions and PDFs reserve one image at a time; an image of a batch
+# that is already streaming waits up to stream_wait_seconds.
+PIXEL_BUDGET = {
+    'enabled': os.environ.get('PIXEL_BUDGET_ENABLED', 'True') == 'True',
+    'max_bytes': int(os.environ.get('PIXEL_BUDGET_MB', 1024)) * 1024 * 1024,
+    'state_file': os.environ.get('PIXEL_BUDGET_STATE_FILE', ''),
+    'wait_seconds': float(os.environ.get('PIXEL_BUDGET_WAIT_SECONDS', 2)),
+    'stream_wait_seconds': float(os.environ.get('PIXEL_BUDGET_STREAM_WAIT_SECONDS', 30)),
+    'retry_after': int(os.environ.get('PIXEL_BUDGET_RETRY_AFTER', 10)),
+}
+
+
+# ============================================
+# PDF EXPORT (image_to_pdf)
+# ============================================
+# Unrotated JPEG uploads are embedded in the PDF unchanged; other pages are
+# re-encoded as JPEG at jpeg_quality. The PDF is built in memory up to
+# spool_bytes and in a temporary file beyond that. Pages are rendered on a
+# pool of `workers` processes (0 = up to 4, based on CPU count; 1 = serial).
+PDF_EXPORT = {
+    'jpeg_passthrough': os.environ.get('PDF_EXPORT_JPEG_PASSTHROUGH', 'True') == 'True',
+    'jpeg_quality': int(os.environ.get('PDF_EXPORT_JPEG_QUALITY', 90)),
+    'spool_bytes': int(os.environ.get('PDF_EXPORT_SPOOL_MB', 8)) * 1024 * 1024,
+    'workers': int(os.environ.get('PDF_EXPORT_WORKERS', 0)),
+}
+
+
+# ============================================
+# RESULT CACHE (tool responses)
+# ============================================
+# Finished responses keyed by a hash of the upload bytes and form fields.
+# Memory tier per worker; set RESULT_CACHE_DIR for a tier shared by all
+# workers, evicted by size and by max_age (seconds since last use).
+# Identical requests in flight at the same time are computed once; the
+# others wait up to coalesce_timeout seconds (across workers via lock
+# files in lock_dir, only with the shared disk tier). Streamed file
+# responses (PDFs, animations) are cached only up to max_streamed_bytes,
+# since caching reads them back into memory; 0 = never.
+RESULT_CACHE = {
+    'enabled': os.environ.get('RESULT_CACHE_ENABLED', 'True') == 'True',
+    'memory_bytes': int(os.environ.get('RESULT_CACHE_MEMORY_MB', 64)) * 1024 * 1024,
+    'disk_dir': os.environ.get('RESULT_CACHE_DIR', ''),
+    'disk_bytes': int(os.environ.get('RESULT_CACHE_DISK_MB', 1024)) * 1024 * 1024,
+    'max_age': int(os.environ.get('RESULT_CACHE_MAX_AGE', 7 * 24 * 3600)),
+    'coalesce': os.environ.get('RESULT_CACHE_COALESCE', 'True') == 'True',
+    'coalesce_timeout': float(os.environ.get('RESULT_CACHE_COALESCE_TIMEOUT', 60)),
+    'lock_dir': os.environ.get('RESULT_CACHE_LOCK_DIR', ''),
+    'max_streamed_bytes': int(os.environ.get('RESULT_CACHE_MAX_STREAMED_KB', 1024)) * 1024,
+    'tools': {
+        tool: os.environ.get(f'RESULT_CACHE_{tool.upper()}', 'True') == 'True'
+        for tool in (
+            'format_converter', 'id_photo_resizer', 'qr_generator', 'image_to_pdf',
+            'background_remover', 'image_compressor',
+        )
+    },
+}
+
+
+# ============================================
+# BATCH FORMAT CONVERSION
+# ============================================
+# format_converter's batch mode: up to max_files uploads converted on
+# `workers` threads (0 = up to 4, based on CPU count) and streamed as a ZIP.
+BATCH_CONVERT = {
+    'max_files': int(os.environ.get('BATCH_CONVERT_MAX_FILES', 50)),
+    'workers': int(os.environ.get('BATCH_CONVERT_WORKERS', 0)),
+}
+
+
+# ============================================
+# ANIMATED FORMAT CONVERSION
+# ============================================
+# Animated GIF/WebP/APNG uploads converted to GIF, WEBP or PNG keep their
+# frames. Output is written frame by frame to a temp file that stays in
+# memory up to spool_bytes.
+ANIMATION = {
+    'enabled': os.environ.get('ANIMATION_ENABLED', 'True') == 'True',
+    'spool_bytes': int(os.environ.get('ANIMATION_SPOOL_MB', 8)) * 1024 * 1024,
+}
+
+
+# ============================================
+# TARGET-SIZE COMPRESSION
+# ============================================
+# image_compressor's "under N KB" mode bisects quality between min_quality
+# and max_quality, then the downscale factor. Probes are encoded on a proxy
+# of about proxy_pixels; at most `attempts` encodes are made at full size.
+COMPRESSOR = {
+    'proxy_pixels': int(os.environ.get('COMPRESSOR_PROXY_PIXELS', 500_000)),
+    'min_quality': int(os.environ.get('COMPRESSOR_MIN_QUALITY', 30)),
+    'max_quality': int(os.environ.get('COMPRESSOR_MAX_QUALITY', 95)),
+    'attempts': int(os.environ.get('COMPRESSOR_ATTEMPTS', 8)),
+}
+
+
+# ============================================
+# QR CODE RENDERING
+# ============================================
+# Rendered QR PNGs are kept in a per-process LRU of cache_bytes, keyed by
+# (data, size, error correction level).
+QR_RENDER = {
+    'cache_bytes': int(os.environ.get('QR_RENDER_CACHE_MB', 8)) * 1024 * 1024,
+}
+
+
+# ============================================
+# BULK QR CODES
+# ============================================
+# qr_generator's bulk mode: up to max_rows codes from a CSV or list of at
+# most max_bytes, rendered batch_size rows at a time on `workers`
+# processes (0 = up to 4, based on CPU count; 1 = in the request thread)
+# and streamed as a ZIP.
+QR_BULK = {
+    'max_rows': int(os.environ.get('QR_BULK_MAX_ROWS', 5000)),
+    'max_bytes': int(os.environ.get('QR_BULK_MAX_KB', 2048)) * 1024,
+    'workers': int(os.environ.get('QR_BULK_WORKERS', 0)),
+    'batch_size': int(os.environ.get('QR_BULK_BATCH_SIZE', 32)),
+}
+
+
+# ============================================
+# SHARED LINK VIEW COUNTS
+# ============================================
+# mode: 'buffered' (per process), 'cache' (shared Django cache, so CACHES
+# must point at Redis/Memcached/database rather than LocMemCache; also run
+# `manage.py flush_view_counts` from cron) or 'direct' (one atomic UPDATE
+# per view). Buffered views are written every flush_interval seconds or
+# once max_pending views are waiting. In cache mode a link's counter
+# expires key_timeout seconds after it was created or last flushed.
+VIEW_COUNTER = {
+    'mode': os.environ.get('VIEW_COUNTER_MODE', 'buffered'),
+    'flush_interval': int(os.environ.get('VIEW_COUNTER_FLUSH_INTERVAL', 10)),
+    'max_pending': int(os.environ.get('VIEW_COUNTER_MAX_PENDING', 1000)),
+    'key_timeout': int(os.environ.get('VIEW_COUNTER_KEY_TIMEOUT', 24 * 3600)),
+}
+
+
+# ============================================
+# EXPIRED LINK REAPER
+# ============================================
+# `manage.py reap_expired_links` (or, in processes started with
+# REAPER_BACKGROUND=True such as the web workers, a background thread every
+# `interval` seconds; 0 = off) deletes expired links chunk_size rows
+# at a time with `workers` file-deleting threads, then removes files in
+# temp_images/ older than orphan_min_age seconds that have no link.
+REAPER = {
+    'background': os.environ.get('REAPER_BACKGROUND', 'False') == 'True',
+    'interval': int(os.environ.get('REAPER_INTERVAL', 0)),
+    'chunk_size': int(os.environ.get('REAPER_CHUNK_SIZE', 500)),
+    'workers': int(os.environ.get('REAPER_WORKERS', 8)),
+    'sweep_orphans': os.environ.get('REAPER_SWEEP_ORPHANS', 'True') == 'True',
+    'orphan_min_age': int(os.environ.get('REAPER_ORPHAN_MIN_AGE', 3600)),
+    'lock_file': os.environ.get('REAPER_LOCK_FILE', ''),
+}
+
+
+# ============================================
+# SHARED IMAGE FILE SERVING
+# ============================================
+# Shared images are served by the shared_image_file view (ETag, 304s,
+# byte ranges, cache lifetime up to the link's expiry). Behind a proxy,
+# offload the transfer itself:
+#   'x-accel-redirect' - nginx; accel_prefix must be an `internal`
+#                        location aliased to MEDIA_ROOT
+#   'x-sendfile'       - Apache mod_xsendfile / lighttpd
+MEDIA_SERVING = {
+    'offload': os.environ.get('MEDIA_SERVING_OFFLOAD', ''),
+    'accel_prefix': os.environ.get('MEDIA_SERVING_ACCEL_PREFIX', '/protected-media/'),
+}
+
+
+# ============================================
+# SHARED IMAGE RENDITIONS
+# ============================================
+# Downscaled WebP/JPEG copies offered to the share page through srcset.
+# Made on first request (one encoder per rendition across the host's
+# workers, via lock files in lock_dir; other requests wait up to
+# lock_timeout seconds) within PIXEL_BUDGET, and stored next to the
+# original.
+RENDITIONS = {
+    'widths': tuple(int(w) for w in os.environ.get('RENDITION_WIDTHS', '320,800,1600').split(',')),
+    'quality': int(os.environ.get('RENDITION_QUALITY', 80)),
+    'lock_timeout': int(os.environ.get('RENDITION_LOCK_TIMEOUT', 30)),
+    'lock_dir': os.environ.get('RENDITION_LOCK_DIR', ''),
+}
+
+
+# ============================================
+# SHARED IMAGE BLOB STORE
+# ============================================
+# Identical uploads are stored once, named by an HMAC of their content.
+# key: HMAC key (empty = derived from SECRET_KEY). Changing it only stops
+# new uploads from deduplicating against files stored under the old key.
+BLOB_STORE = {
+    'key': os.environ.get('BLOB_STORE_KEY', ''),
+}
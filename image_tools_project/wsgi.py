@@ -7,6 +7,7 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 """
 
+import logging
 import os
 
 from django.core.wsgi import get_wsgi_application
@@ -14,3 +15,19 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'image_tools_project.settings')
 
 application = get_wsgi_application()
+
+# Load the background-removal model when the worker boots instead of on
+# the first request it serves. Not needed when a shared inference service
+# owns the model. A model that fails to load (download error, corrupt
+# ONNX file, onnxruntime error) must not stop the worker from booting and
+# take every other tool down with it; it is loaded again on first use.
+from django.conf import settings
+
+if settings.SEGMENTATION.get('prewarm') and not settings.SEGMENTATION.get('pool_socket'):
+    try:
+        from tools.services.segmentation import SegmentationService
+        SegmentationService.prewarm()
+    except ImportError:
+        pass
+    except Exception:
+        logging.getLogger(__name__).exception('Could not prewarm the segmentation models')
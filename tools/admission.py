@@ -0,0 +1,277 @@
+"""
+Admission control for image processing views.
+
+A small compressed upload can decode to a very large pixel buffer, so the
+upload size limit alone doesn't stop a handful of concurrent requests
+from exhausting memory. Before a view runs, the decoded size of its
+uploads is estimated from the image headers (width x height x bytes per
+pixel) and
+reserved from a memory budget shared by every worker process on the
+host. When the budget is used up the request waits briefly and is then
+turned away with 503 + Retry-After.
+
+Views that take many files (batch conversion, PDF export) only decode a
+few of them at a time, so reserving the whole upload up front would
+need most of the budget idle. Their multi-file fields are left to the
+view, which reserves each image with ``reserved()`` while it decodes it.
+
+The shared state is a small file guarded by ``fcntl.flock``; each
+reservation records the owning process id, so reservations held by a
+worker that crashed are dropped automatically. On platforms without
+``fcntl`` the budget is per process.
+"""
+
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import partial, wraps
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.http import JsonResponse
+
+from .security import validate_image_file
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class PixelBudget:
+    """Decoded-bytes budget shared between the worker processes of a host."""
+
+    def __init__(self, max_bytes, state_file):
+        self.max_bytes = max_bytes
+        self.state_file = str(state_file)
+        self._local = {}
+        self._local_lock = threading.Lock()
+
+    def _read(self, f):
+        f.seek(0)
+        reservations = {}
+        for line in f.read().splitlines():
+            try:
+                token, pid, nbytes = line.split()
+                reservations[token] = (int(pid), int(nbytes))
+            except ValueError:
+                continue
+        return reservations
+
+    def _write(self, f, reservations):
+        f.seek(0)
+        f.truncate()
+        f.write(''.join(f'{token} {pid} {nbytes}\n' for token, (pid, nbytes) in reservations.items()))
+        f.flush()
+
+    def _update(self, change):
+        """Run ``change(reservations)`` under the host-wide lock."""
+        if fcntl is None:
+            with self._local_lock:
+                return change(self._local)
+
+        with open(self.state_file, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                reservations = self._read(f)
+                live = {t: r for t, r in reservations.items() if _pid_alive(r[0])}
+                result = change(live)
+                self._write(f, live)
+                return result
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def in_use(self):
+        """Total bytes currently reserved."""
+        return self._update(lambda reservations: sum(n for _, n in reservations.values()))
+
+    def try_reserve(self, nbytes):
+        """
+        Reserve ``nbytes`` if the budget allows it.
+
+        A request larger than the whole budget is capped at the budget, so
+        it is admitted once nothing else is running instead of never.
+
+        Returns:
+            Reservation token, or None if the budget is exhausted
+        """
+        nbytes = min(nbytes, self.max_bytes)
+
+        def change(reservations):
+            in_use = sum(n for _, n in reservations.values())
+            if in_use + nbytes > self.max_bytes:
+                return None
+            token = uuid.uuid4().hex
+            reservations[token] = (os.getpid(), nbytes)
+            return token
+
+        return self._update(change)
+
+    def reserve(self, nbytes, wait=0.0, poll_interval=0.05):
+        """
+        Reserve ``nbytes``, waiting up to ``wait`` seconds for room.
+
+        Returns:
+            Reservation token, or None if no room became available
+        """
+        deadline = time.monotonic() + wait
+        while True:
+            token = self.try_reserve(nbytes)
+            if token is not None or time.monotonic() >= deadline:
+                return token
+            time.sleep(poll_interval)
+
+    def release(self, token):
+        """Return a reservation to the budget."""
+        self._update(lambda reservations: reservations.pop(token, None))
+
+
+_budget = None
+
+
+def get_pixel_budget():
+    """Get the host-wide budget configured in settings.PIXEL_BUDGET."""
+    global _budget
+
+    if _budget is None:
+        config = getattr(settings, 'PIXEL_BUDGET', {})
+        _budget = PixelBudget(
+            config.get('max_bytes', 1024 * 1024 * 1024),
+            config.get('state_file') or os.path.join(tempfile.gettempdir(), 'pixcraft-pixel-budget'),
+        )
+    return _budget
+
+
+def estimate_decoded_bytes(files):
+    """
+    Estimate the decoded size of uploaded images from their headers.
+
+    Files that aren't valid images are skipped; the view rejects them
+    during its own validation.
+    """
+    total = 0
+    for file in files:
+        try:
+            upload = validate_image_file(file)
+        except ValidationError:
+            continue
+        total += upload.decoded_bytes
+    return total
+
+
+class PixelBudgetExceeded(Exception):
+    """Raised when work that is already under way can't get budget for its next image."""
+    pass
+
+
+def busy_response():
+    """503 with Retry-After, for requests the budget can't take now."""
+    config = getattr(settings, 'PIXEL_BUDGET', {})
+    response = JsonResponse({'error': 'Server is busy. Please try again shortly.'}, status=503)
+    response['Retry-After'] = str(config.get('retry_after', 10))
+    return response
+
+
+@contextmanager
+def reserved(nbytes, wait=None):
+    """
+    Hold a reservation of ``nbytes`` for the duration of the block.
+
+    For work not tied to an upload up front, e.g. decoding a stored image
+    or one image of a batch.
+
+    Args:
+        nbytes: Decoded bytes to reserve
+        wait: Seconds to wait for room (defaults to PIXEL_BUDGET['wait_seconds'])
+
+    Yields:
+        True when admitted (or the budget is disabled), False when the
+        budget stayed full for ``wait`` seconds
+    """
+    config = getattr(settings, 'PIXEL_BUDGET', {})
+    if not config.get('enabled', True) or not nbytes:
+        yield True
+        return
+
+    budget = get_pixel_budget()
+    token = budget.reserve(nbytes, wait=config.get('wait_seconds', 2) if wait is None else wait)
+    if token is None:
+        yield False
+        return
+    try:
+        yield True
+    finally:
+        budget.release(token)
+
+
+def _release_on_close(response, release):
+    """Release the reservation when the server closes a streaming response."""
+    close = response.close
+
+    def close_and_release():
+        try:
+            close()
+        finally:
+            release()
+
+    response.close = close_and_release
+
+
+def pixel_budget_admission(view_func=None, *, per_file=()):
+    """
+    Reserve decoded-image memory for a POST before running the view.
+
+    Rejected requests get 503 with a Retry-After header. The reservation
+    is released when the response has been produced, or for streaming
+    responses when the response is closed.
+
+    Args:
+        per_file: Upload fields the view reserves for itself, one image
+            at a time, as it decodes them (``reserved()``)
+    """
+    if view_func is None:
+        return partial(pixel_budget_admission, per_file=per_file)
+
+    @wraps(view_func)
+    def wrapper(request, *args, **kwargs):
+        config = getattr(settings, 'PIXEL_BUDGET', {})
+        if (request.method != 'POST' or not config.get('enabled', True)
+                or getattr(request, 'limited', False) or not request.FILES):
+            return view_func(request, *args, **kwargs)
+
+        files = [f for name in request.FILES if name not in per_file for f in request.FILES.getlist(name)]
+        nbytes = estimate_decoded_bytes(files)
+        if not nbytes:
+            return view_func(request, *args, **kwargs)
+
+        budget = get_pixel_budget()
+        token = budget.reserve(nbytes, wait=config.get('wait_seconds', 2))
+        if token is None:
+            return busy_response()
+
+        try:
+            response = view_func(request, *args, **kwargs)
+        except BaseException:
+            budget.release(token)
+            raise
+
+        if getattr(response, 'streaming', False):
+            _release_on_close(response, partial(budget.release, token))
+        else:
+            budget.release(token)
+        return response
+
+    return wrapper
@@ -4,3 +4,15 @@ from django.apps import AppConfig
 class ToolsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'tools'
+
+    def ready(self):
+        # Connects the ImageLink delete hooks that release stored files
+        from . import blob_store  # noqa: F401
+
+        # Registers the check that cache-mode view counting has a shared cache
+        from . import view_counter  # noqa: F401
+
+        # Periodic cleanup of expired links, in processes that opt in with
+        # REAPER['background']
+        from . import reaper
+        reaper.start_periodic()
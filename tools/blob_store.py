@@ -0,0 +1,223 @@
+"""
+Content-deduplicated storage for shared image uploads.
+
+Uploads used to get a fresh random name each, so the same image shared a
+hundred times was written and stored a hundred times. Uploads are now
+stored once per distinct content:
+
+* the file name is an HMAC-SHA256 of the content under a server-side key
+  (``settings.BLOB_STORE['key']``, derived from ``SECRET_KEY`` when
+  empty), so names are still unguessable and reveal nothing about the
+  content to someone who has a copy of it;
+* an ``ImageBlob`` row per file counts the links using it. A duplicate
+  upload only bumps the count; nothing is written to disk;
+* deleting a link drops the count, and the file (with its renditions)
+  is deleted when the last link goes. This happens in ``pre_delete`` /
+  ``post_delete`` hooks, so ``link.delete()``, queryset deletes and the
+  admin all release their references; the file itself is deleted once
+  the transaction commits.
+
+Links created before the blob store have no ``ImageBlob`` row; releasing
+one deletes its file straight away, as before.
+
+Counts are changed with the blob row locked (``select_for_update``).
+New files are written inside the same transaction, so an upload never
+lands on a file that a concurrent release is deleting.
+"""
+
+import hashlib
+import hmac
+import logging
+import os
+import tempfile
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+
+from .models import ImageBlob, ImageLink
+from .renditions import delete_renditions
+
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = 'temp_images'
+
+HASH_CHUNK = 1024 * 1024
+
+_local = threading.local()
+
+
+def _storage():
+    return ImageLink._meta.get_field('image').storage
+
+
+def _hash_key():
+    key = getattr(settings, 'BLOB_STORE', {}).get('key')
+    if key:
+        return key.encode()
+    # Same derivation as django.utils.crypto.salted_hmac
+    return hashlib.sha256(f'tools.blob_store{settings.SECRET_KEY}'.encode()).digest()
+
+
+def content_key(file):
+    """
+    Keyed hash of an uploaded file's content.
+
+    Args:
+        file: Django UploadedFile / File object; read from the start and
+            rewound afterwards
+
+    Returns:
+        Hex digest string
+    """
+    digest = hmac.new(_hash_key(), digestmod=hashlib.sha256)
+    file.seek(0)
+    for chunk in file.chunks(HASH_CHUNK):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def _write(storage, name, file):
+    """Write a file under its final name via a temporary file and rename."""
+    path = storage.path(name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            file.seek(0)
+            for chunk in file.chunks(HASH_CHUNK):
+                f.write(chunk)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def store(file):
+    """
+    Add a reference to an upload's content, writing it only if it's new.
+
+    Call inside the transaction that creates the ImageLink, so a failed
+    insert doesn't leave the count too high.
+
+    Args:
+        file: Django UploadedFile (already validated)
+
+    Returns:
+        Storage name to put in ImageLink.image
+    """
+    key = content_key(file)
+    extension = os.path.splitext(file.name or '')[1].lower()
+    storage = _storage()
+
+    with transaction.atomic():
+        blob, created = ImageBlob.objects.select_for_update().get_or_create(
+            key=key,
+            defaults={'name': f'{UPLOAD_DIR}/{key}{extension}', 'size': file.size},
+        )
+        if created:
+            _write(storage, blob.name, file)
+        else:
+            ImageBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') + 1)
+            if not storage.exists(blob.name):
+                # Lost to a crash or a manual cleanup; put it back
+                _write(storage, blob.name, file)
+    return blob.name
+
+
+def release(names):
+    """
+    Drop one reference per name (a name may repeat).
+
+    Call inside the transaction that deletes the links and delete the
+    returned files once it commits.
+
+    Returns:
+        Names no link refers to any more, whose files should be deleted
+    """
+    counts = Counter(name for name in names if name)
+    if not counts:
+        return []
+
+    unreferenced = []
+    dead = []
+    with transaction.atomic():
+        blobs = {
+            blob.name: blob
+            for blob in ImageBlob.objects.select_for_update().filter(name__in=list(counts))
+        }
+        for name, count in counts.items():
+            blob = blobs.get(name)
+            if blob is None:
+                # Stored before deduplication: the file is this link's alone
+                unreferenced.append(name)
+            elif blob.refcount <= count:
+                unreferenced.append(name)
+                dead.append(blob.pk)
+            else:
+                ImageBlob.objects.filter(pk=blob.pk).update(refcount=F('refcount') - count)
+        if dead:
+            ImageBlob.objects.filter(pk__in=dead).delete()
+    return unreferenced
+
+
+def delete_file(storage, name):
+    """Delete a stored file and its renditions."""
+    storage.delete(name)
+    delete_renditions(storage, name)
+
+
+def _delete_files_logged(storage, names):
+    for name in names:
+        try:
+            delete_file(storage, name)
+        except OSError:
+            # The reaper's orphan sweep retries it
+            logger.warning('Could not delete %s', name, exc_info=True)
+
+
+@contextmanager
+def manual_release():
+    """
+    Turn off the delete hooks in this thread, for callers (the reaper) that
+    release the references of the rows they delete in one batch.
+    """
+    _local.manual = True
+    try:
+        yield
+    finally:
+        _local.manual = False
+
+
+@receiver(pre_delete, sender=ImageLink)
+def _lock_deleted_link(sender, instance, **kwargs):
+    if getattr(_local, 'manual', False):
+        return
+    # Two requests can delete the same loaded link; Django sends
+    # post_delete to both even though only one DELETE removes the row.
+    # Lock the row (inside the delete's transaction) and remember whether
+    # it was still there, so only that request releases the reference
+    instance._owns_blob_reference = (
+        ImageLink.objects.select_for_update().filter(pk=instance.pk).exists()
+    )
+
+
+@receiver(post_delete, sender=ImageLink)
+def _release_deleted_link(sender, instance, **kwargs):
+    if not getattr(instance, '_owns_blob_reference', False) or not instance.image:
+        return
+    instance._owns_blob_reference = False
+
+    storage = instance.image.storage
+    unreferenced = release([instance.image.name])
+    if unreferenced:
+        transaction.on_commit(partial(_delete_files_logged, storage, unreferenced))
@@ -0,0 +1,204 @@
+"""
+Serving of stored image files over HTTP.
+
+``serve_file`` streams a file with ``FileResponse`` (which lets the WSGI
+server use ``sendfile``) and adds what ``django.views.static`` leaves out:
+
+* a strong ``ETag`` from the SHA-256 of the content, remembered in the
+  Django cache per (path, size, mtime) so each file is hashed once;
+* ``Last-Modified``, and 304 answers to ``If-None-Match`` and
+  ``If-Modified-Since``;
+* ``Cache-Control``/``Expires`` that run out when the link does;
+* single byte ranges (``Range``/``If-Range``), with 206 and 416 answers;
+* optional hand-off of the transfer to a front proxy with
+  ``X-Accel-Redirect`` (nginx) or ``X-Sendfile`` (Apache, lighttpd),
+  configured in ``settings.MEDIA_SERVING``.
+"""
+
+import hashlib
+import os
+import re
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import FileResponse, HttpResponse
+from django.utils import timezone
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+from .services.image_processor import ImageProcessor
+
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+HASH_CHUNK = 1024 * 1024
+
+
+def content_hash(path, stat=None):
+    """
+    SHA-256 hex digest of a file, cached by path, size and mtime.
+
+    Args:
+        path: Absolute file path
+        stat: ``os.stat`` result for the file, if already known
+    """
+    stat = stat or os.stat(path)
+    key = f'file-hash:{hashlib.sha256(path.encode()).hexdigest()}:{stat.st_size}:{stat.st_mtime_ns}'
+    digest = cache.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        cache.set(key, digest, timeout=None)
+    return digest
+
+
+def content_type_for(path):
+    """Image content type from the file extension."""
+    extension = os.path.splitext(path)[1].lstrip('.').upper()
+    if extension == 'JPG':
+        extension = 'JPEG'
+    elif extension == 'TIF':
+        extension = 'TIFF'
+    return ImageProcessor.CONTENT_TYPES.get(extension, 'application/octet-stream')
+
+
+def parse_range(header, size):
+    """
+    Parse a single-range ``Range`` header.
+
+    Returns:
+        (start, end) inclusive, None to send the whole file (no header,
+        several ranges or a unit other than bytes), or False when the
+        range can't be satisfied
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None
+
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if not length:
+            return False
+        return max(0, size - length), size - 1
+
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        return False
+    return start, end
+
+
+def _if_range_matches(request, etag, last_modified):
+    """Whether a Range request may be answered with a partial response."""
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if not if_range:
+        return True
+    if if_range.startswith(('"', 'W/')):
+        # Only a strong comparison counts for If-Range
+        return if_range == etag
+    date = parse_http_date_safe(if_range)
+    return date is not None and int(last_modified) <= date
+
+
+class _RangeFile:
+    """Read-only view of ``length`` bytes of a file from ``start``."""
+
+    def __init__(self, f, start, length):
+        self._file = f
+        self._remaining = length
+        f.seek(start)
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+    def close(self):
+        self._file.close()
+
+
+def _cache_headers(response, etag, last_modified, expires_at):
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if expires_at is not None:
+        remaining = max(0, int((expires_at - timezone.now()).total_seconds()))
+        response['Cache-Control'] = f'public, max-age={remaining}'
+        response['Expires'] = http_date(expires_at.timestamp())
+    return response
+
+
+def serve_file(request, name, path, expires_at=None, filename=None, as_attachment=False):
+    """
+    Respond with a stored file.
+
+    Args:
+        request: Django request (GET or HEAD)
+        name: Storage name of the file (e.g. ``temp_images/abc.png``),
+            used for the proxy hand-off
+        path: Absolute file path
+        expires_at: When the file stops being available; sets the cache
+            lifetime
+        filename: Download filename for Content-Disposition
+        as_attachment: Ask the browser to download instead of display
+
+    Returns:
+        HttpResponse (200, 206, 304, 412 or 416)
+
+    Raises:
+        FileNotFoundError: If the file doesn't exist
+    """
+    stat = os.stat(path)
+    size = stat.st_size
+    last_modified = stat.st_mtime
+    etag = quote_etag(content_hash(path, stat))
+    content_type = content_type_for(path)
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=int(last_modified))
+    if not_modified is not None:
+        return _cache_headers(not_modified, etag, last_modified, expires_at)
+
+    config = getattr(settings, 'MEDIA_SERVING', {})
+    offload = config.get('offload')
+    if offload in ('x-accel-redirect', 'x-sendfile'):
+        # The proxy sends the body (ranges included); only headers go out here
+        response = HttpResponse(content_type=content_type)
+        if offload == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = config.get('accel_prefix', '/protected-media/') + name
+        else:
+            response['X-Sendfile'] = path
+    else:
+        byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        if byte_range is not None and not _if_range_matches(request, etag, last_modified):
+            byte_range = None
+
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        if byte_range is None:
+            response = FileResponse(open(path, 'rb'), content_type=content_type)
+        else:
+            start, end = byte_range
+            length = end - start + 1
+            response = FileResponse(_RangeFile(open(path, 'rb'), start, length), content_type=content_type, status=206)
+            response['Content-Length'] = str(length)
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Accept-Ranges'] = 'bytes'
+
+    if filename:
+        disposition = 'attachment' if as_attachment else 'inline'
+        # The original name was sanitised on upload; keep it ASCII here
+        safe_name = filename.encode('ascii', 'ignore').decode().replace('"', '') or 'image'
+        response['Content-Disposition'] = f'{disposition}; filename="{safe_name}"'
+    response['X-Content-Type-Options'] = 'nosniff'
+    return _cache_headers(response, etag, last_modified, expires_at)
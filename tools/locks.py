@@ -0,0 +1,81 @@
+"""
+Host-wide locks on lock files.
+
+``file_lock`` takes an exclusive ``fcntl.flock`` on one file per key, so
+worker processes on the same host wait for each other. The file is
+removed when the lock is released, so lock files don't pile up for keys
+that are never used again. A waiter that opened the file before it was
+removed notices that its file is no longer the one at the path and
+opens the new one.
+
+Without ``fcntl`` the lock is a no-op; callers must tolerate duplicate
+work.
+"""
+
+import hashlib
+import os
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+def lock_path(lock_dir, key):
+    """Lock file for ``key`` in ``lock_dir`` (created if missing)."""
+    os.makedirs(lock_dir, exist_ok=True)
+    return os.path.join(lock_dir, hashlib.sha256(key.encode()).hexdigest() + '.lock')
+
+
+def _open_locked(path, deadline, poll_interval):
+    while True:
+        f = open(path, 'a+')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            f.close()
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(poll_interval)
+            continue
+
+        # The previous holder may have removed the file after we opened it
+        try:
+            current = os.stat(path).st_ino == os.fstat(f.fileno()).st_ino
+        except FileNotFoundError:
+            current = False
+        if current:
+            return f
+        f.close()
+
+
+@contextmanager
+def file_lock(path, timeout, poll_interval=0.05):
+    """
+    Hold an exclusive lock on ``path``, waiting up to ``timeout`` seconds.
+
+    Yields:
+        True while the lock is held, False if it timed out
+    """
+    if fcntl is None:
+        yield True
+        return
+
+    handle = _open_locked(path, time.monotonic() + timeout, poll_interval)
+    if handle is None:
+        yield False
+        return
+
+    try:
+        yield True
+    finally:
+        # Unlink before unlocking so a waiter never locks a file that's
+        # about to disappear without noticing
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+        fcntl.flock(handle, fcntl.LOCK_UN)
+        handle.close()
@@ -0,0 +1,59 @@
+"""Benchmark the encoder profiles against a reference corpus."""
+
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+
+from tools.services.encoder_profiles import (
+    DEFAULT_PROFILES, PROFILES, benchmark, recommend_profiles, reference_corpus,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure encode time and output size of each encoder profile and '
+        'suggest per-format defaults for encoder_profiles.DEFAULT_PROFILES.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corpus', help='Directory of images to use instead of the bundled reference corpus')
+        parser.add_argument('--formats', nargs='+', help='Formats to measure (default: all)')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument('--tolerance', type=float, default=0.03,
+                            help='Size overhead allowed when picking the cheaper profile')
+
+    def load_corpus(self, directory):
+        images = []
+        for name in sorted(os.listdir(directory)):
+            try:
+                with Image.open(os.path.join(directory, name)) as img:
+                    images.append((name, img.convert('RGB')))
+            except OSError:
+                continue
+        if not images:
+            raise CommandError(f'No readable images in {directory}')
+        return images
+
+    def handle(self, *args, **options):
+        images = self.load_corpus(options['corpus']) if options['corpus'] else reference_corpus()
+        formats = [f.upper() for f in options['formats']] if options['formats'] else None
+
+        results = benchmark(images, formats=formats, repeat=options['repeat'])
+        recommended = recommend_profiles(results, options['tolerance'])
+
+        self.stdout.write(f"{'format':<8}{'profile':<10}{'ms':>10}{'KiB':>10}")
+        for output_format, by_profile in results.items():
+            for profile in PROFILES:
+                result = by_profile[profile]
+                marker = ' *' if recommended[output_format] == profile else ''
+                self.stdout.write(
+                    f"{output_format:<8}{profile:<10}{result['seconds'] * 1000:>10.1f}"
+                    f"{result['bytes'] / 1024:>10.1f}{marker}"
+                )
+
+        self.stdout.write('')
+        for output_format, profile in recommended.items():
+            current = DEFAULT_PROFILES.get(output_format)
+            note = '' if current == profile else f' (currently {current})'
+            self.stdout.write(f"{output_format}: {profile}{note}")
@@ -0,0 +1,27 @@
+"""Write buffered shared-link view counts to the database."""
+
+from django.core.management.base import BaseCommand
+
+from tools import view_counter
+from tools.models import ImageLink
+
+
+class Command(BaseCommand):
+    help = (
+        'Flush view counts collected in the shared cache (VIEW_COUNTER mode '
+        '"cache") to the database. Run it from cron so links that stop '
+        'getting views are still flushed.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk', type=int, default=1000, help='Links read from the cache at a time')
+
+    def handle(self, *args, **options):
+        link_ids = list(ImageLink.objects.values_list('link_id', flat=True))
+        written = 0
+        for start in range(0, len(link_ids), options['chunk']):
+            written += view_counter.flush(link_ids[start:start + options['chunk']])
+        if not link_ids:
+            written = view_counter.flush()
+
+        self.stdout.write(self.style.SUCCESS(f'Flushed {written} views of {len(link_ids)} links'))
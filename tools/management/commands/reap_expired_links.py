@@ -0,0 +1,48 @@
+"""Delete expired shared image links, their files and orphaned uploads."""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from tools import reaper
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete expired ImageLink rows and their files in chunks, then remove '
+        'files in temp_images/ that no link refers to.'
+    )
+
+    def add_arguments(self, parser):
+        config = getattr(settings, 'REAPER', {})
+        parser.add_argument('--chunk-size', type=int, default=config.get('chunk_size', 500))
+        parser.add_argument('--workers', type=int, default=config.get('workers', 8),
+                            help='Threads deleting files')
+        parser.add_argument('--orphan-min-age', type=int, default=config.get('orphan_min_age', 3600),
+                            help='Only remove orphaned files older than this many seconds')
+        parser.add_argument('--no-orphans', action='store_true', help='Skip the orphan sweep')
+
+    def report(self, stats):
+        summary = stats.as_dict()
+        self.stdout.write(
+            f"  chunk {summary['chunks']}: {summary['rows']} rows, {summary['files']} files "
+            f"({summary['rows_per_second']} rows/s)"
+        )
+
+    def handle(self, *args, **options):
+        stats = reaper.run(
+            chunk_size=options['chunk_size'],
+            workers=options['workers'],
+            orphan_min_age=options['orphan_min_age'],
+            orphans=not options['no_orphans'],
+            progress=self.report if options['verbosity'] > 1 else None,
+        )
+        if stats is None:
+            self.stdout.write(self.style.WARNING('Another process is already reaping; nothing to do.'))
+            return
+
+        summary = stats.as_dict()
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {summary['rows']} expired links and {summary['files']} files, "
+            f"{summary['orphans']} orphaned files ({summary['file_errors']} errors) "
+            f"in {summary['seconds']}s, {summary['rows_per_second']} rows/s"
+        ))
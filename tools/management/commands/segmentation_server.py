@@ -0,0 +1,46 @@
+"""Run the shared background-segmentation inference service."""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tools.services.segmentation_pool import SegmentationServer
+
+
+class Command(BaseCommand):
+    help = (
+        'Start the local segmentation inference service. Web workers send '
+        'mask requests to it over SEGMENTATION["pool_socket"].'
+    )
+
+    def add_arguments(self, parser):
+        config = settings.SEGMENTATION
+        parser.add_argument('--socket', default=config.get('pool_socket'), help='Unix socket path')
+        parser.add_argument('--workers', type=int, default=config.get('pool_workers', 2))
+        parser.add_argument('--batch-size', type=int, default=config.get('batch_size', 4))
+        parser.add_argument('--batch-window-ms', type=int, default=config.get('batch_window_ms', 10))
+
+    def handle(self, *args, **options):
+        config = settings.SEGMENTATION
+        if not options['socket']:
+            raise CommandError('No socket path given. Set SEGMENTATION_POOL_SOCKET or pass --socket.')
+
+        server = SegmentationServer(
+            options['socket'],
+            config.get('pool_authkey', settings.SECRET_KEY).encode(),
+            workers=options['workers'],
+            batch_size=options['batch_size'],
+            batch_window=options['batch_window_ms'] / 1000,
+            request_timeout=config.get('pool_timeout', 60),
+        )
+        server.start_workers(models=config.get('prewarm_models', []))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Segmentation service listening on {options['socket']} "
+            f"({options['workers']} workers, batch size {options['batch_size']})"
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.stop()
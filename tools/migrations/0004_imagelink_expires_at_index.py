@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 21:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tools', '0003_alter_imagelink_image'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='imagelink',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True),
+        ),
+    ]
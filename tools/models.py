@@ -46,7 +46,8 @@ class ImageLink(models.Model):
     
     # Timestamps
     created_at = models.DateTimeField(auto_now_add=True)
-    expires_at = models.DateTimeField()
+    # Indexed for the reaper, which scans for expired links
+    expires_at = models.DateTimeField(db_index=True)
     
     # View count (optional - track how many times link was accessed)
     view_count = models.IntegerField(default=0)
@@ -64,11 +65,27 @@ class ImageLink(models.Model):
     def get_share_url(self):
         """Get the shareable URL"""
         return f"/view-image/{self.link_id}/"
+
+
+
+class ImageBlob(models.Model):
+    """A stored upload shared by every ImageLink with the same content"""
+    
+    # Keyed hash (HMAC-SHA256) of the content; also the file name
+    key = models.CharField(max_length=64, unique=True)
+    
+    # Storage name, as stored in ImageLink.image
+    name = models.CharField(max_length=255, unique=True)
     
-    def delete_image_file(self):
-        """Delete the actual image file from storage"""
-        if self.image and os.path.isfile(self.image.path):
-            os.remove(self.image.path)
+    size = models.BigIntegerField()
+    
+    # Number of ImageLink rows using this file
+    refcount = models.PositiveIntegerField(default=1)
+    
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    def __str__(self):
+        return f"{self.name} ({self.refcount} link{'s' if self.refcount != 1 else ''})"
 
 
 # ============================================
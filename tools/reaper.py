@@ -0,0 +1,328 @@
+"""
+Cleanup of expired shared image links.
+
+Expired links used to be removed only when somebody opened them again,
+so most of them stayed in the table and in ``temp_images/`` for good.
+The reaper removes them in chunks:
+
+1. take the next ``chunk_size`` expired rows through the ``expires_at``
+   index (only the primary key and file name are loaded);
+2. lock them, delete the rows still there with a single
+   ``DELETE ... WHERE id IN (...)`` and release their blob references
+   in one batch (see ``blob_store``);
+3. delete the files no link uses any more, renditions included, on a
+   thread pool.
+
+Afterwards it sweeps ``temp_images/`` for files without a row (left
+behind by failed deletes or crashes), and renditions whose original has
+no row. Files younger than ``orphan_min_age`` are skipped because an
+upload writes its file just before its row.
+
+It runs as ``manage.py reap_expired_links`` or, with
+``settings.REAPER['background']`` and ``['interval']`` set, on a
+background thread in each web worker. A lock file makes sure only one process on the host reaps at a
+time.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from . import blob_store, renditions
+from .models import ImageLink
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_DIR = 'temp_images'
+
+_thread = None
+_thread_lock = threading.Lock()
+
+
+class ReapStats:
+    """Counters for one reaper run."""
+
+    def __init__(self):
+        self.rows = 0
+        self.files = 0
+        self.file_errors = 0
+        self.orphans = 0
+        self.chunks = 0
+        self.started = time.monotonic()
+
+    @property
+    def seconds(self):
+        return time.monotonic() - self.started
+
+    def as_dict(self):
+        seconds = self.seconds
+        return {
+            'rows': self.rows,
+            'files': self.files,
+            'file_errors': self.file_errors,
+            'orphans': self.orphans,
+            'chunks': self.chunks,
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(self.rows / seconds, 1) if seconds else 0.0,
+        }
+
+
+def _storage():
+    return ImageLink._meta.get_field('image').storage
+
+
+def _delete_files(names, workers):
+    """
+    Delete stored files in parallel.
+
+    Returns:
+        (deleted, failed) counts
+    """
+    storage = _storage()
+
+    def delete(name):
+        try:
+            blob_store.delete_file(storage, name)
+            return True
+        except OSError:
+            logger.warning('Could not delete %s', name, exc_info=True)
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(delete, names))
+    return results.count(True), results.count(False)
+
+
+def _delete_unreferenced(names, workers, stats):
+    deleted, failed = _delete_files(names, workers)
+    stats.files += deleted
+    stats.file_errors += failed
+
+
+def reap_expired(now=None, chunk_size=500, workers=8, progress=None, stats=None):
+    """
+    Delete expired links and their files.
+
+    Args:
+        now: Expiry cutoff (defaults to the current time)
+        chunk_size: Rows handled per chunk
+        workers: File-deleting threads
+        progress: Called with the ReapStats after each chunk
+        stats: ReapStats to add to (a new one if not given)
+
+    Returns:
+        ReapStats object
+    """
+    now = now or timezone.now()
+    stats = stats or ReapStats()
+
+    while True:
+        chunk = list(
+            ImageLink.objects.filter(expires_at__lte=now)
+            .order_by('expires_at')
+            .values_list('pk', 'image')[:chunk_size]
+        )
+        if not chunk:
+            break
+
+        with transaction.atomic(), blob_store.manual_release():
+            # Re-read locked: a view may have deleted some of these rows
+            # (and released their references) since they were selected
+            rows = list(
+                ImageLink.objects.select_for_update()
+                .filter(pk__in=[pk for pk, _ in chunk], expires_at__lte=now)
+                .values_list('pk', 'image')
+            )
+            pks = [pk for pk, _ in rows]
+            ImageLink.objects.filter(pk__in=pks).delete()
+            # Files still shared with live links stay
+            unreferenced = blob_store.release([name for _, name in rows if name])
+            # Files go only once the rows are gone for good; if a delete
+            # fails, the orphan sweep retries the file later
+            transaction.on_commit(partial(_delete_unreferenced, unreferenced, workers, stats))
+
+        stats.rows += len(pks)
+        stats.chunks += 1
+        if progress:
+            progress(stats)
+
+    return stats
+
+
+def sweep_orphans(min_age=3600, chunk_size=500, workers=8, stats=None):
+    """
+    Delete files in the upload directory that no link refers to.
+
+    Args:
+        min_age: Skip files modified less than this many seconds ago
+        chunk_size: File names checked against the table per query
+        workers: File-deleting threads
+        stats: ReapStats to add to (a new one if not given)
+
+    Returns:
+        ReapStats object
+    """
+    stats = stats or ReapStats()
+    storage = _storage()
+    try:
+        directory = storage.path(UPLOAD_DIR)
+    except NotImplementedError:
+        # Remote storage: listing every object is too costly here
+        return stats
+
+    cutoff = time.time() - min_age
+    try:
+        entries = os.scandir(directory)
+    except FileNotFoundError:
+        return stats
+
+    def old_files():
+        with entries:
+            for entry in entries:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    yield f'{UPLOAD_DIR}/{entry.name}'
+
+    batch = []
+    for name in old_files():
+        batch.append(name)
+        if len(batch) >= chunk_size:
+            _sweep_batch(batch, workers, stats)
+            batch = []
+    if batch:
+        _sweep_batch(batch, workers, stats)
+    return stats
+
+
+def _sweep_batch(names, workers, stats):
+    known = set(ImageLink.objects.filter(image__in=names).values_list('image', flat=True))
+    # A rendition is kept while its original still has a link
+    stems = {name: renditions.source_stem(name) for name in names}
+    rendition_stems = {stem for stem in stems.values() if stem}
+    known_stems = set()
+    if rendition_stems:
+        query = Q()
+        for stem in rendition_stems:
+            query |= Q(image__startswith=f'{stem}.')
+        known_stems = {
+            os.path.splitext(image)[0]
+            for image in ImageLink.objects.filter(query).values_list('image', flat=True)
+        }
+    orphans = [
+        name for name in names
+        if name not in known and not (stems[name] and stems[name] in known_stems)
+    ]
+    if orphans:
+        deleted, failed = _delete_files(orphans, workers)
+        stats.orphans += deleted
+        stats.file_errors += failed
+
+
+def _lock_file():
+    """
+    Take the host-wide reaper lock without waiting.
+
+    Returns:
+        Open file holding the lock, True without fcntl, or None if another
+        process holds it
+    """
+    if fcntl is None:
+        return True
+
+    config = getattr(settings, 'REAPER', {})
+    path = config.get('lock_file') or os.path.join(tempfile.gettempdir(), 'pixcraft-reaper.lock')
+    f = open(path, 'a+')
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        f.close()
+        return None
+    return f
+
+
+def run(chunk_size=None, workers=None, orphan_min_age=None, orphans=True, progress=None):
+    """
+    One full reaper pass; options not given come from settings.REAPER.
+
+    Returns:
+        ReapStats object, or None if another process is already reaping
+    """
+    config = getattr(settings, 'REAPER', {})
+    chunk_size = chunk_size or config.get('chunk_size', 500)
+    workers = workers or config.get('workers', 8)
+    if orphan_min_age is None:
+        orphan_min_age = config.get('orphan_min_age', 3600)
+
+    handle = _lock_file()
+    if handle is None:
+        return None
+
+    try:
+        stats = reap_expired(chunk_size=chunk_size, workers=workers, progress=progress)
+        if orphans and config.get('sweep_orphans', True):
+            sweep_orphans(min_age=orphan_min_age, chunk_size=chunk_size, workers=workers, stats=stats)
+    finally:
+        if handle is not True:
+            fcntl.flock(handle, fcntl.LOCK_UN)
+            handle.close()
+
+    if stats.rows or stats.orphans or stats.file_errors:
+        logger.info('Reaped expired links: %s', stats.as_dict())
+    return stats
+
+
+def _loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            run()
+        except Exception:
+            logger.exception('Reaper run failed')
+        finally:
+            close_old_connections()
+
+
+def start_periodic(interval=None):
+    """
+    Start the background reaper thread once per process.
+
+    Args:
+        interval: Seconds between runs; when not given the thread only
+            starts if settings.REAPER['background'] is set, every
+            REAPER['interval'] seconds
+
+    Returns:
+        True if a thread was started
+    """
+    global _thread
+
+    config = getattr(settings, 'REAPER', {})
+    if interval is None:
+        # Only processes that opt in (the web workers) run the thread, not
+        # every manage.py command, migration or test run
+        if not config.get('background'):
+            return False
+        interval = config.get('interval', 0)
+    if not interval:
+        return False
+
+    with _thread_lock:
+        if _thread is not None:
+            return False
+        _thread = threading.Thread(target=_loop, args=(interval,), name='link-reaper', daemon=True)
+        _thread.start()
+    return True
@@ -0,0 +1,231 @@
+"""
+Downscaled renditions of shared images.
+
+The share page used to send every viewer the original upload (up to
+5 MB). It now offers ``srcset`` candidates at the widths in
+``settings.RENDITIONS`` (WebP, with JPEG for browsers without WebP), so a
+phone downloads a 320 or 800 pixel image instead.
+
+Renditions are made lazily, the first time a browser asks for one, and
+stored next to the original as ``<original stem>.w<width>.<ext>``:
+
+    temp_images/3f2a...c1.png
+    temp_images/3f2a...c1.w320.webp
+    temp_images/3f2a...c1.w320.jpg
+
+The source is decoded at reduced size (JPEG DCT scaling through
+``ImageProcessor.open_for_target_size``), so making a 320 pixel rendition
+of a 12 megapixel photo never decodes the full image. A lock file per
+rendition (``tools.locks``) makes concurrent requests for it, from any
+worker process on the host, wait for one encoder instead of each running
+their own, and files are written under a temporary name and renamed so
+a reader never sees half a file. The view reserves the decode from the
+pixel budget (``tools.admission``) first.
+
+Renditions are deleted together with the original (see ``blob_store``)
+and by the reaper's orphan sweep.
+"""
+
+import io
+import os
+import re
+import tempfile
+
+from django.conf import settings
+from django.core.cache import cache
+from PIL import Image, ImageOps
+
+from .locks import file_lock, lock_path
+from .services.image_processor import ImageProcessor
+
+
+FORMATS = {
+    'webp': ('WEBP', 'image/webp'),
+    'jpg': ('JPEG', 'image/jpeg'),
+}
+
+RENDITION_RE = re.compile(r'^(?P<stem>.+)\.w(?P<width>\d+)\.(?P<ext>webp|jpg)$')
+
+# EXIF orientations that swap width and height
+TRANSPOSED_ORIENTATIONS = (5, 6, 7, 8)
+
+SIZE_PREFIX = 'rendition-source-size:'
+
+
+def _config():
+    return getattr(settings, 'RENDITIONS', {})
+
+
+def widths():
+    return tuple(sorted(_config().get('widths', (320, 800, 1600))))
+
+
+def rendition_name(name, width, ext):
+    """Storage name of a rendition of the file ``name``."""
+    return f'{os.path.splitext(name)[0]}.w{width}.{ext}'
+
+
+def rendition_names(name):
+    """Every rendition name the current settings can produce for ``name``."""
+    return [rendition_name(name, width, ext) for width in widths() for ext in FORMATS]
+
+
+def source_stem(name):
+    """Stem of the original a rendition belongs to, or None for other files."""
+    match = RENDITION_RE.match(name)
+    return match.group('stem') if match else None
+
+
+def source_size(storage, name):
+    """
+    Displayed (width, height) of a stored image, EXIF rotation included.
+
+    Only the header is read; the result is cached since stored files never
+    change. Animated images come back as None: a still rendition would
+    lose the animation.
+    """
+    key = SIZE_PREFIX + name
+    size = cache.get(key)
+    if size is None:
+        with storage.open(name, 'rb') as f:
+            img = Image.open(f)
+            if getattr(img, 'is_animated', False):
+                size = ()
+            else:
+                size = img.size
+                if img.getexif().get(0x0112) in TRANSPOSED_ORIENTATIONS:
+                    size = size[::-1]
+        cache.set(key, tuple(size), timeout=None)
+    return tuple(size) or None
+
+
+def available_widths(storage, name):
+    """Configured widths smaller than the original; never upscale."""
+    try:
+        size = source_size(storage, name)
+    except (OSError, Image.DecompressionBombError):
+        return ()
+    if not size:
+        return ()
+    return tuple(width for width in widths() if width < size[0])
+
+
+def render(fp, width, output_format, quality=80):
+    """
+    Downscale an image to ``width`` pixels wide.
+
+    Args:
+        fp: File object of the source image
+        width: Output width in pixels
+        output_format: 'WEBP' or 'JPEG'
+        quality: Encoder quality
+
+    Returns:
+        Bytes of the encoded rendition
+    """
+    img = Image.open(fp)
+    transposed = img.getexif().get(0x0112) in TRANSPOSED_ORIENTATIONS
+    # Target size in the stored (unrotated) orientation
+    source_width, source_height = img.size[::-1] if transposed else img.size
+    height = max(1, round(source_height * width / source_width))
+    target = (height, width) if transposed else (width, height)
+
+    img = ImageProcessor.open_for_target_size(img, target)
+    if img.mode not in ('RGB', 'RGBA'):
+        # Palette and 16-bit modes can't be resampled with LANCZOS
+        img = img.convert('RGBA' if 'transparency' in img.info or img.mode in ('LA', 'PA') else 'RGB')
+    img = img.resize(target, Image.Resampling.LANCZOS)
+    img = ImageOps.exif_transpose(img)
+    img = ImageProcessor.prepare_for_format(img, output_format)
+
+    buffer = io.BytesIO()
+    if output_format == 'JPEG':
+        img.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+    else:
+        img.save(buffer, format='WEBP', quality=quality, method=4)
+    return buffer.getvalue()
+
+
+def _write_atomic(path, data):
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.rendition-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def ensure_rendition(storage, name, width, ext):
+    """
+    Get a rendition of a stored image, making it if needed.
+
+    Args:
+        storage: Storage holding the original (file system only)
+        name: Storage name of the original
+        width: One of the widths available for the original
+        ext: 'webp' or 'jpg'
+
+    Returns:
+        Storage name of the rendition
+
+    Raises:
+        ValueError: If the width or format isn't offered for this image
+    """
+    if ext not in FORMATS or width not in available_widths(storage, name):
+        raise ValueError(f'No {width}px {ext} rendition for this image')
+
+    target = rendition_name(name, width, ext)
+    path = storage.path(target)
+    if os.path.exists(path):
+        return target
+
+    config = _config()
+    lock_dir = config.get('lock_dir') or os.path.join(tempfile.gettempdir(), 'pixcraft-rendition-locks')
+    # On timeout the holder is probably stuck; render anyway, the rename
+    # makes a duplicate harmless
+    with file_lock(lock_path(lock_dir, target), config.get('lock_timeout', 30)):
+        if not os.path.exists(path):
+            with storage.open(name, 'rb') as f:
+                data = render(f, width, FORMATS[ext][0], config.get('quality', 80))
+            _write_atomic(path, data)
+    return target
+
+
+def rendition_exists(storage, name, width, ext):
+    """Whether a rendition has already been made."""
+    return storage.exists(rendition_name(name, width, ext))
+
+
+def srcsets(storage, name, original_url, url_for):
+    """
+    ``srcset`` attribute values for a stored image.
+
+    Args:
+        storage: Storage holding the original
+        name: Storage name of the original
+        original_url: URL of the original, listed as the largest candidate
+        url_for: Called with (width, ext) to get a rendition's URL
+
+    Returns:
+        Dict of 'webp' and 'jpg' srcset strings, empty when the image has
+        no renditions
+    """
+    available = available_widths(storage, name)
+    if not available:
+        return {}
+
+    original = f'{original_url} {source_size(storage, name)[0]}w'
+    return {
+        ext: ', '.join([f'{url_for(width, ext)} {width}w' for width in available] + [original])
+        for ext in FORMATS
+    }
+
+
+def delete_renditions(storage, name):
+    """Delete every rendition of ``name``; missing ones are skipped."""
+    for rendition in rendition_names(name):
+        storage.delete(rendition)
+    cache.delete(SIZE_PREFIX + name)
@@ -0,0 +1,308 @@
+"""
+Result cache for the image tool views.
+
+Every tool is a pure function of its uploaded bytes and form fields, so a
+finished response can be reused for an identical request. The key is a
+SHA-256 of the tool name, the sorted form fields and the bytes of every
+upload, and it is computed before anything is decoded. Responses are kept
+in a TieredCache: a per-process LRU in memory and an optional directory
+shared by every worker, evicted by total size and by age.
+
+Concurrent identical requests are coalesced: the first one computes the
+response while the others wait for it and are then served from the cache.
+Threads wait on a per-key lock. With the shared disk tier (``disk_dir``)
+worker processes on the same host also wait on a per-key lock file
+(``tools.locks``) and pick the result up from disk; without it another
+worker couldn't see the result, so workers don't wait for each other.
+When the response turns out not to be cacheable (an error, or a streamed
+file over ``max_streamed_bytes``) the waiters are let go at once and
+compute their own instead of queueing behind each other.
+
+Hits and misses are counted per tool (``stats()``) and reported on each
+response in an ``X-Cache`` header.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.http import HttpResponse
+
+from .locks import file_lock, lock_path
+from .services.cache import TieredCache
+
+
+# Response headers stored along with the body
+CACHED_HEADERS = (
+    'Content-Disposition', 'X-Original-Size', 'X-Compressed-Size',
+    'X-Compress-Quality', 'X-Compress-Scale', 'X-Compress-Probes', 'X-Compress-Time-Ms',
+)
+
+# Default for RESULT_CACHE['max_streamed_bytes']: largest streamed file
+# response that is read back into the cache. Streamed responses exist to
+# keep large outputs out of memory, so only small ones are cached.
+MAX_STREAMED_BYTES = 1024 * 1024
+
+_cache = None
+_cache_lock = threading.Lock()
+_stats = Counter()
+_stats_lock = threading.Lock()
+_flights = {}  # key -> [lock, number of requests using it]
+_flights_lock = threading.Lock()
+
+
+def get_result_cache():
+    """Get the cache configured in settings.RESULT_CACHE."""
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            config = getattr(settings, 'RESULT_CACHE', {})
+            _cache = TieredCache(
+                config.get('memory_bytes', 64 * 1024 * 1024),
+                config.get('disk_dir') or None,
+                config.get('disk_bytes', 0),
+                config.get('max_age') or None,
+            )
+        return _cache
+
+
+def reset_result_cache():
+    """Drop the cache and counters (used after settings change and in tests)."""
+    global _cache
+
+    with _cache_lock:
+        _cache = None
+    with _stats_lock:
+        _stats.clear()
+
+
+def _count(tool, outcome):
+    with _stats_lock:
+        _stats[(tool, outcome)] += 1
+
+
+def stats():
+    """
+    Hit and miss counts for this process.
+
+    ``coalesced`` counts the hits that were served after waiting for a
+    concurrent identical request.
+
+    Returns:
+        Dict of tool name -> {'hits': int, 'misses': int, 'coalesced': int}
+    """
+    with _stats_lock:
+        tools = {tool for tool, _ in _stats}
+        return {
+            tool: {
+                'hits': _stats[(tool, 'hit')],
+                'misses': _stats[(tool, 'miss')],
+                'coalesced': _stats[(tool, 'coalesced')],
+            }
+            for tool in sorted(tools)
+        }
+
+
+def request_key(tool, request):
+    """
+    Build the cache key for a POST from its form fields and upload bytes.
+
+    Args:
+        tool: Tool name, part of the key
+        request: Django request
+
+    Returns:
+        Hex digest string
+    """
+    params = sorted(
+        (name, values) for name, values in request.POST.lists()
+        if name != 'csrfmiddlewaretoken'
+    )
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps([tool, params]).encode())
+    for name in sorted(request.FILES):
+        for file in request.FILES.getlist(name):
+            digest.update(f'\0{name}\0{file.size}\0'.encode())
+            for chunk in file.chunks():
+                digest.update(chunk)
+            file.seek(0)
+    return digest.hexdigest()
+
+
+def _lock_dir():
+    config = getattr(settings, 'RESULT_CACHE', {})
+    return config.get('lock_dir') or os.path.join(tempfile.gettempdir(), 'pixcraft-result-locks')
+
+
+class _Flight:
+    """A request's place in the queue for one key."""
+
+    def __init__(self):
+        # True if another request held the key first
+        self.waited = False
+        self._held = ExitStack()
+
+    def release(self):
+        """Let the next waiter go before this request is done."""
+        self._held.close()
+
+
+@contextmanager
+def single_flight(key, timeout, shared=False):
+    """
+    Let one request at a time compute the response for ``key``.
+
+    Waits up to ``timeout`` seconds for a request already computing it in
+    this process, and with ``shared`` in other processes as well. On
+    timeout the caller goes ahead anyway.
+
+    Yields:
+        _Flight object
+    """
+    deadline = time.monotonic() + timeout
+
+    with _flights_lock:
+        entry = _flights.setdefault(key, [threading.Lock(), 0])
+        entry[1] += 1
+    lock = entry[0]
+
+    flight = _Flight()
+    try:
+        acquired = lock.acquire(blocking=False)
+        if not acquired:
+            flight.waited = True
+            acquired = lock.acquire(timeout=timeout)
+        if acquired:
+            flight._held.callback(lock.release)
+            if shared:
+                # One lock file per key, so only identical requests wait
+                path = lock_path(_lock_dir(), key)
+                if not flight._held.enter_context(file_lock(path, 0)):
+                    flight.waited = True
+                    flight._held.enter_context(file_lock(path, max(0.0, deadline - time.monotonic())))
+        yield flight
+    finally:
+        flight.release()
+        with _flights_lock:
+            entry[1] -= 1
+            if not entry[1]:
+                del _flights[key]
+
+
+def _pack(response, body):
+    """Serialise a response as a JSON header line followed by the body."""
+    header = {
+        'content_type': response['Content-Type'],
+        'headers': {name: response[name] for name in CACHED_HEADERS if response.has_header(name)},
+    }
+    return json.dumps(header).encode() + b'\n' + body
+
+
+def _unpack(value):
+    """Rebuild a response from a packed cache value."""
+    header, body = value.split(b'\n', 1)
+    header = json.loads(header)
+
+    response = HttpResponse(body, content_type=header['content_type'])
+    for name, header_value in header['headers'].items():
+        response[name] = header_value
+    return response
+
+
+def _response_body(response):
+    """
+    Get the body of a successful response, if it should be cached.
+
+    Streamed file responses are read back and rewound only when they are
+    no larger than ``RESULT_CACHE['max_streamed_bytes']`` (0 never caches
+    them); larger ones keep streaming from their file untouched.
+    """
+    if not getattr(response, 'streaming', False):
+        return response.content
+
+    limit = getattr(settings, 'RESULT_CACHE', {}).get('max_streamed_bytes', MAX_STREAMED_BYTES)
+    file = getattr(response, 'file_to_stream', None)
+    if not limit or file is None or not hasattr(file, 'seek'):
+        return None
+
+    file.seek(0, 2)
+    size = file.tell()
+    file.seek(0)
+    if size > limit:
+        return None
+
+    body = file.read()
+    file.seek(0)
+    return body
+
+
+def _compute(tool, cache, key, view_func, request, *args, **kwargs):
+    """Run the view and store a successful response."""
+    _count(tool, 'miss')
+    response = view_func(request, *args, **kwargs)
+    if response.status_code == 200:
+        body = _response_body(response)
+        if body is not None:
+            cache.set(key, _pack(response, body))
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+def cached_result(tool):
+    """
+    Serve repeated POSTs to a tool view from the result cache.
+
+    Put it below ``@ratelimit`` and above ``@pixel_budget_admission`` so a
+    hit neither reserves decode memory nor touches the image.
+    """
+    def decorator(view_func):
+        @wraps(view_func)
+        def wrapper(request, *args, **kwargs):
+            config = getattr(settings, 'RESULT_CACHE', {})
+            if (request.method != 'POST' or not config.get('enabled', True)
+                    or not config.get('tools', {}).get(tool, True)
+                    or getattr(request, 'limited', False)):
+                return view_func(request, *args, **kwargs)
+
+            cache = get_result_cache()
+            key = f'result-{request_key(tool, request)}'
+
+            value = cache.get(key)
+            if value is not None:
+                _count(tool, 'hit')
+                response = _unpack(value)
+                response['X-Cache'] = 'HIT'
+                return response
+
+            if not config.get('coalesce', True):
+                return _compute(tool, cache, key, view_func, request, *args, **kwargs)
+
+            # Other workers can only pick the result up from the disk tier
+            shared = cache.disk is not None
+            with single_flight(key, config.get('coalesce_timeout', 60), shared) as flight:
+                # Another request may have produced it while we waited
+                value = cache.get(key)
+                if value is not None:
+                    _count(tool, 'hit')
+                    _count(tool, 'coalesced')
+                    response = _unpack(value)
+                    response['X-Cache'] = 'HIT'
+                    return response
+
+                if flight.waited:
+                    # The request we waited for couldn't be cached, so
+                    # ours won't be either; don't hold up the rest
+                    flight.release()
+                return _compute(tool, cache, key, view_func, request, *args, **kwargs)
+
+        return wrapper
+    return decorator
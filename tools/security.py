@@ -7,6 +7,20 @@ from django.core.exceptions import ValidationError
 from PIL import Image
 
 
+# Bytes per pixel of Pillow's decoded buffer, for modes that don't use
+# the usual 4. Pillow stores RGB, LA and the other 2-3 band modes padded
+# to 32 bits, and I and F are 32-bit too. Palette images count as 4 as
+# well, since the tools expand them to RGB/RGBA before working on them.
+BYTES_PER_PIXEL = {
+    '1': 1,
+    'L': 1,
+    'I;16': 2,
+    'I;16L': 2,
+    'I;16B': 2,
+    'I;16N': 2,
+}
+
+
 def validate_file_extension(file):
     """Only check if extension is in allowed list"""
     ext = os.path.splitext(file.name)[1].lower()
@@ -17,23 +31,77 @@ def validate_file_extension(file):
     return True
 
 
+class ValidatedImage:
+    """
+    An upload that passed validation, with its already-parsed header.
+
+    Views take the image from here instead of calling Image.open again.
+    Pixels are only decoded when the view needs them, so callers can still
+    use draft mode / reduced decoding on ``image``.
+    """
+
+    def __init__(self, file, image):
+        self.file = file
+        self.image = image
+        self.format = image.format
+        self.mode = image.mode
+        self.width, self.height = image.size
+
+    @property
+    def size(self):
+        return (self.width, self.height)
+
+    @property
+    def pixel_count(self):
+        return self.width * self.height
+
+    @property
+    def decoded_bytes(self):
+        """Approximate size of the decoded pixel buffer."""
+        return self.pixel_count * BYTES_PER_PIXEL.get(self.mode, 4)
+
+    def load(self):
+        """Decode the pixels and return the PIL Image."""
+        self.image.load()
+        return self.image
+
+
 def validate_image_file(file):
     """
     Minimal check - just verify it can be opened as an image
     If PIL can open it, it's a real image (not a virus)
+
+    Only the header is parsed. Images with more pixels than
+    settings.MAX_IMAGE_PIXELS are rejected before anything is decoded.
+
+    The result is remembered on the file object, so validating the same
+    upload again (e.g. in admission control and then in the view) only
+    parses it once.
+
+    Returns:
+        ValidatedImage wrapping the opened image
     """
+    validated = getattr(file, 'validated_image', None)
+    if validated is not None:
+        return validated
+
     try:
         # If PIL can open it, it's a valid image
-        Image.open(file)
-        
+        image = Image.open(file)
+
         # Reset file pointer
         file.seek(0)
-        
-        return True
-        
+
     except Exception:
         raise ValidationError('Could not process image. Please try another file.')
 
+    max_pixels = getattr(settings, 'MAX_IMAGE_PIXELS', None)
+    if max_pixels and image.width * image.height > max_pixels:
+        raise ValidationError(f'Image dimensions too large ({image.width}x{image.height}). Please upload a smaller image.')
+
+    file.validated_image = ValidatedImage(file, image)
+    return file.validated_image
+
 
 def validate_file_size(file, max_size_mb=10):
     """Only check file size"""
@@ -66,6 +134,9 @@ def validate_upload(file, max_size_mb=10, image_only=True):
     1. Check file size (prevent crashes)
     2. Check if it's a real image (prevent viruses)
     3. That's it - allow everything else!
+
+    Returns:
+        ValidatedImage if image_only, otherwise True
     """
     try:
         # Sanitize filename
@@ -76,10 +147,9 @@ def validate_upload(file, max_size_mb=10, image_only=True):
         
         # Check if real image (minimal check)
         if image_only:
-            validate_image_file(file)
-        else:
-            validate_file_extension(file)
-        
+            return validate_image_file(file)
+
+        validate_file_extension(file)
         return True
         
     except ValidationError:
@@ -1,5 +1,7 @@
 """Services package for business logic."""
 
 from .image_processor import ImageProcessor
+from .segmentation import SegmentationService
+from .tolerance_mask import replace_background_color
 
-__all__ = ['ImageProcessor']
+__all__ = ['ImageProcessor', 'SegmentationService', 'replace_background_color']
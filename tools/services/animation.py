@@ -0,0 +1,371 @@
+"""
+Frame-streaming conversion of animated images (GIF, WebP, APNG).
+
+Frames are read one at a time with ``seek`` and only the previous and the
+pending frame are kept, so memory depends on the frame size rather than
+the number of frames. Pillow hands back every frame already composited
+onto the canvas, so the source's disposal methods are honoured there; the
+writers then work out what changed between consecutive canvases:
+
+* identical frames are merged into one, adding up their durations;
+* GIF and APNG frames only encode the bounding box of the changed pixels,
+  and pixels inside it that didn't change are written as transparent so
+  they compress to almost nothing;
+* GIF frames switch to "restore to background" disposal when the next
+  frame needs pixels cleared;
+* WebP output goes through Pillow's public ``save_all`` API, which feeds
+  the source frames to libwebp's animation encoder one by one; libwebp
+  merges identical frames and does its own sub-frame diffing.
+
+GIF and APNG frames are written to the output as soon as the next frame
+is known. libwebp only assembles the file at the end, so for WebP the
+encoded (compressed) frames are held until then.
+"""
+
+import io
+import struct
+import zlib
+
+import numpy as np
+from PIL import Image, features
+
+from .encoder_profiles import encoder_options
+
+
+# Output formats that can keep the animation
+ANIMATED_FORMATS = ('GIF', 'WEBP', 'PNG')
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def is_animated(image):
+    """Check whether an opened image has more than one frame."""
+    return getattr(image, 'is_animated', False) and getattr(image, 'n_frames', 1) > 1
+
+
+def iter_frames(image):
+    """
+    Yield the frames of an animated image one at a time.
+
+    Yields:
+        (RGBA numpy array, duration in ms) tuples
+    """
+    index = 0
+    while True:
+        try:
+            image.seek(index)
+        except EOFError:
+            break
+        yield np.asarray(image.convert('RGBA')), int(image.info.get('duration', 0) or 0)
+        index += 1
+
+
+def _bounding_box(mask):
+    """Bounding box (left, top, right, bottom) of the True cells, or None."""
+    rows = np.flatnonzero(mask.any(axis=1))
+    if not len(rows):
+        return None
+    cols = np.flatnonzero(mask.any(axis=0))
+    return int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1
+
+
+class _FrameWriter:
+    """
+    Base class for the frame-diffing writers.
+
+    ``add_frame`` merges identical frames and keeps one frame pending so
+    ``_write_frame`` can see the frame that follows it.
+    """
+
+    def __init__(self, fp, size, loop=0):
+        self.fp = fp
+        self.size = size
+        self.loop = loop
+        self.frame_count = 0
+        self._pending = None
+        self._pending_duration = 0
+
+    def _normalize(self, frame):
+        return frame
+
+    def add_frame(self, frame, duration):
+        """Add one RGBA frame (numpy array) shown for ``duration`` ms."""
+        frame = self._normalize(frame)
+        if self._pending is not None and np.array_equal(frame, self._pending):
+            self._pending_duration += duration
+            return
+
+        if self._pending is not None:
+            self._write_frame(self._pending, self._pending_duration, frame)
+            self.frame_count += 1
+        self._pending = frame
+        self._pending_duration = duration
+
+    def close(self):
+        """Write the last frame and finish the file."""
+        if self._pending is not None:
+            self._write_frame(self._pending, self._pending_duration, None)
+            self.frame_count += 1
+            self._pending = None
+        self._finish()
+
+    def _write_frame(self, frame, duration, next_frame):
+        raise NotImplementedError
+
+    def _finish(self):
+        raise NotImplementedError
+
+
+def _parse_gif_frame(data):
+    """
+    Pull the colour table, transparency index, interlace flag and LZW data
+    out of a single-frame GIF written by Pillow.
+    """
+    packed = data[10]
+    pos = 13
+    table = b''
+    if packed & 0x80:
+        length = 3 * 2 ** ((packed & 7) + 1)
+        table = data[pos:pos + length]
+        pos += length
+
+    transparency = None
+    while True:
+        block = data[pos]
+        if block == 0x21:
+            if data[pos + 1] == 0xF9 and data[pos + 3] & 1:
+                transparency = data[pos + 6]
+            pos += 2
+            while data[pos]:
+                pos += data[pos] + 1
+            pos += 1
+        elif block == 0x2C:
+            local_packed = data[pos + 9]
+            interlace = local_packed & 0x40
+            pos += 10
+            if local_packed & 0x80:
+                length = 3 * 2 ** ((local_packed & 7) + 1)
+                table = data[pos:pos + length]
+                pos += length
+            start = pos
+            pos += 1  # LZW minimum code size
+            while data[pos]:
+                pos += data[pos] + 1
+            return table, transparency, interlace, data[start:pos + 1]
+        else:
+            raise ValueError('Unexpected GIF block')
+
+
+class GifWriter(_FrameWriter):
+    """Animated GIF writer with a local colour table per frame."""
+
+    def __init__(self, fp, size, loop=0):
+        super().__init__(fp, size, loop)
+        # What a decoder shows before the pending frame is drawn; None
+        # means the canvas is fully transparent
+        self._canvas = None
+
+        width, height = size
+        # No global colour table; colour resolution 8 bits
+        fp.write(b'GIF89a' + struct.pack('<HHBBB', width, height, 0x70, 0, 0))
+        fp.write(b'!\xff\x0bNETSCAPE2.0\x03\x01' + struct.pack('<H', loop) + b'\x00')
+
+    def _normalize(self, frame):
+        # GIF transparency is on/off; clear the colour of transparent
+        # pixels so they compare equal
+        frame = frame.copy()
+        opaque = frame[..., 3] >= 128
+        frame[~opaque] = 0
+        frame[opaque, 3] = 255
+        return frame
+
+    def _write_frame(self, frame, duration, next_frame):
+        height, width = frame.shape[:2]
+        opaque = frame[..., 3] == 255
+
+        # Pixels that are opaque now but transparent in the next frame can
+        # only be cleared through disposal, so clear the whole canvas
+        clears = next_frame is not None and bool((opaque & (next_frame[..., 3] == 0)).any())
+
+        if self._canvas is None or clears:
+            box = (0, 0, width, height)
+            keep = np.zeros(opaque.shape, dtype=bool)
+        else:
+            changed = (frame != self._canvas).any(axis=2)
+            box = _bounding_box(changed) or (0, 0, 1, 1)
+            keep = ~changed
+
+        left, top, right, bottom = box
+        crop = frame[top:bottom, left:right]
+        transparent = ~opaque[top:bottom, left:right] | keep[top:bottom, left:right]
+
+        quantized = Image.fromarray(np.ascontiguousarray(crop[..., :3]), 'RGB').quantize(255)
+        index = min(len(quantized.getpalette()) // 3, 255)
+        quantized.paste(index, mask=Image.fromarray((transparent * 255).astype(np.uint8), 'L'))
+
+        buffer = io.BytesIO()
+        quantized.save(buffer, format='GIF', transparency=index, optimize=False, interlace=False)
+        table, transparency, interlace, image_data = _parse_gif_frame(buffer.getvalue())
+
+        disposal = 2 if clears else 1
+        flags = (disposal << 2) | (1 if transparency is not None else 0)
+        delay = min(round(duration / 10), 0xFFFF)
+        self.fp.write(b'!\xf9\x04' + struct.pack('<BHB', flags, delay, transparency or 0) + b'\x00')
+
+        table_bits = max(len(table) // 3, 2).bit_length() - 2
+        self.fp.write(b',' + struct.pack('<HHHHB', left, top, right - left, bottom - top, 0x80 | interlace | table_bits))
+        self.fp.write(table)
+        self.fp.write(image_data)
+
+        self._canvas = None if clears else frame
+
+    def _finish(self):
+        self.fp.write(b';')
+
+
+def _png_chunk(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + struct.pack('>I', zlib.crc32(chunk_type + data))
+
+
+def _png_image_data(data):
+    """Concatenated IDAT payload of a PNG file."""
+    pos = len(PNG_SIGNATURE)
+    payload = []
+    while pos < len(data):
+        length, chunk_type = struct.unpack('>I4s', data[pos:pos + 8])
+        if chunk_type == b'IDAT':
+            payload.append(data[pos + 8:pos + 8 + length])
+        pos += 12 + length
+    return b''.join(payload)
+
+
+class ApngWriter(_FrameWriter):
+    """
+    Animated PNG writer.
+
+    The frame count in the acTL chunk is only known at the end, so the
+    output file must be seekable.
+    """
+
+    def __init__(self, fp, size, loop=0, compress_level=6):
+        super().__init__(fp, size, loop)
+        self.compress_level = compress_level
+        self._previous = None
+        self._sequence = 0
+
+        width, height = size
+        fp.write(PNG_SIGNATURE)
+        fp.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0)))
+        self._actl_position = fp.tell()
+        fp.write(_png_chunk(b'acTL', struct.pack('>II', 0, loop)))
+
+    def _write_frame(self, frame, duration, next_frame):
+        height, width = frame.shape[:2]
+        blend_op = 0  # APNG_BLEND_OP_SOURCE
+
+        if self._previous is None:
+            box = (0, 0, width, height)
+            crop = frame
+        else:
+            changed = (frame != self._previous).any(axis=2)
+            box = _bounding_box(changed) or (0, 0, 1, 1)
+            left, top, right, bottom = box
+            crop = frame[top:bottom, left:right]
+
+            # When every changed pixel is opaque, blend the box over the
+            # previous frame and leave the unchanged pixels transparent
+            changed = changed[top:bottom, left:right]
+            if (crop[changed][:, 3] == 255).all():
+                crop = crop.copy()
+                crop[~changed] = 0
+                blend_op = 1  # APNG_BLEND_OP_OVER
+
+        # Delay as a fraction of a second; fall back to centiseconds for
+        # merged frames too long for milliseconds in 16 bits
+        delay = (duration, 1000) if duration <= 0xFFFF else (min(round(duration / 10), 0xFFFF), 100)
+
+        left, top, right, bottom = box
+        self.fp.write(_png_chunk(b'fcTL', struct.pack(
+            '>IIIIIHHBB', self._sequence, right - left, bottom - top, left, top,
+            *delay, 0, blend_op,
+        )))
+        self._sequence += 1
+
+        buffer = io.BytesIO()
+        Image.fromarray(np.ascontiguousarray(crop), 'RGBA').save(buffer, format='PNG', compress_level=self.compress_level)
+        image_data = _png_image_data(buffer.getvalue())
+
+        if self._previous is None:
+            self.fp.write(_png_chunk(b'IDAT', image_data))
+        else:
+            self.fp.write(_png_chunk(b'fdAT', struct.pack('>I', self._sequence) + image_data))
+            self._sequence += 1
+
+        self._previous = frame
+
+    def _finish(self):
+        self.fp.write(_png_chunk(b'IEND', b''))
+
+        end = self.fp.tell()
+        self.fp.seek(self._actl_position)
+        self.fp.write(_png_chunk(b'acTL', struct.pack('>II', self.frame_count, self.loop)))
+        self.fp.seek(end)
+
+
+def _save_webp(image, fp, loop, quality, method):
+    """
+    Write animated WebP with Pillow's encoder.
+
+    Pillow seeks through the source itself and hands libwebp one frame at
+    a time; only the durations are read up front. libwebp merges identical
+    frames and diffs the rest on its own.
+
+    Returns:
+        Number of source frames
+    """
+    durations = []
+    for index in range(image.n_frames):
+        image.seek(index)
+        durations.append(int(image.info.get('duration', 0) or 0))
+    image.seek(0)
+
+    image.save(
+        fp, format='WEBP', save_all=True, duration=durations, loop=loop,
+        quality=quality, method=method, background=(0, 0, 0, 0),
+    )
+    return len(durations)
+
+
+def convert_animation(image, output_format, fp, profile=None):
+    """
+    Convert an animated image frame by frame.
+
+    Args:
+        image: Animated PIL Image object (not loaded)
+        output_format: 'GIF', 'WEBP' or 'PNG' (animated PNG)
+        fp: Seekable binary file to write to
+        profile: Encoder profile name, or None for the format's default
+
+    Returns:
+        Number of frames written
+    """
+    output_format = output_format.upper()
+    if output_format not in ANIMATED_FORMATS:
+        raise ValueError(f'{output_format} cannot store animation')
+
+    options = encoder_options(output_format, profile)
+    loop = image.info.get('loop', 0)
+
+    if output_format == 'GIF':
+        writer = GifWriter(fp, image.size, loop)
+    elif output_format == 'PNG':
+        writer = ApngWriter(fp, image.size, loop, options.get('compress_level', 6))
+    else:
+        if not features.check('webp'):
+            raise ValueError('Animated WebP is not supported by this Pillow build')
+        return _save_webp(image, fp, loop, options.get('quality', 80), options.get('method', 4))
+
+    for frame, duration in iter_frames(image):
+        writer.add_frame(frame, duration)
+    writer.close()
+    return writer.frame_count
@@ -0,0 +1,108 @@
+"""
+Batch format conversion streamed as a ZIP archive.
+
+Uploads are converted on a small thread pool (Pillow releases the GIL
+while decoding and encoding) and each converted file is written to the
+archive as soon as it is ready, in completion order. The archive is
+produced as a sequence of chunks for a streaming response, so only the
+files currently being converted are held in memory. Each conversion
+reserves its image's decoded size from the pixel budget while it runs,
+waiting up to ``PIXEL_BUDGET['stream_wait_seconds']`` for room; a file
+that still doesn't fit is listed as failed.
+"""
+
+import io
+import os
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from django.conf import settings
+
+from ..admission import PixelBudgetExceeded, reserved
+from . import animation
+from .batching import ChunkSink, unique_name
+from .image_processor import ImageProcessor
+
+
+def _entry_name(filename, extension, used):
+    """Archive name for a converted file, unique within the archive."""
+    stem = os.path.splitext(os.path.basename(filename))[0] or 'image'
+    return unique_name(stem, extension, used)
+
+
+def stream_zip(uploads, output_format, profile=None, workers=4, keep_animation=True):
+    """
+    Convert uploads to one format and stream them as a ZIP archive.
+
+    Files that fail to convert are left out and listed in ``errors.txt``
+    at the end of the archive.
+
+    Args:
+        uploads: List of ValidatedImage objects
+        output_format: Target format (PNG, JPG, WEBP, etc.)
+        profile: Encoder profile name, or None for the format's default
+        workers: Number of conversion threads
+        keep_animation: Convert animated uploads frame by frame when the
+            target format can store animation
+
+    Yields:
+        Chunks of the ZIP file as bytes
+    """
+    extension = output_format.lower()
+    remaining = iter(uploads)
+    pending = {}
+    used_names = set()
+    errors = []
+
+    budget_wait = getattr(settings, 'PIXEL_BUDGET', {}).get('stream_wait_seconds', 30)
+
+    def convert(upload):
+        with reserved(upload.decoded_bytes, budget_wait) as admitted:
+            if not admitted:
+                upload.image.close()
+                raise PixelBudgetExceeded()
+            return convert_reserved(upload)
+
+    def convert_reserved(upload):
+        try:
+            if (keep_animation and output_format in animation.ANIMATED_FORMATS
+                    and animation.is_animated(upload.image)):
+                buffer = io.BytesIO()
+                animation.convert_animation(upload.image, output_format, buffer, profile)
+                return buffer.getvalue()
+            return ImageProcessor.convert_format(upload.image, output_format, profile)
+        finally:
+            # Drop the decoded pixels as soon as the file is encoded
+            upload.image.close()
+
+    sink = ChunkSink()
+    with ThreadPoolExecutor(max_workers=workers) as executor, \
+            zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+
+        def submit_next():
+            upload = next(remaining, None)
+            if upload is not None:
+                pending[executor.submit(convert, upload)] = upload
+
+        # Keep at most ``workers`` conversions in flight
+        for _ in range(workers):
+            submit_next()
+
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                upload = pending.pop(future)
+                submit_next()
+                try:
+                    data = future.result()
+                except Exception:
+                    errors.append(os.path.basename(upload.file.name))
+                    continue
+
+                archive.writestr(_entry_name(upload.file.name, extension, used_names), data)
+                yield sink.take()
+
+        if errors:
+            archive.writestr('errors.txt', 'Could not convert:\n' + '\n'.join(errors) + '\n')
+
+    yield sink.take()
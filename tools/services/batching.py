@@ -0,0 +1,83 @@
+"""
+Helpers shared by the batch tools (batch conversion, PDF export and bulk
+QR codes): a sink for streaming ZIP archives, unique archive entry
+names, a process pool shared by the requests of a worker, and the
+multiprocessing context for starting worker processes safely from a
+threaded process.
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+class ChunkSink:
+    """Write-only, non-seekable file that collects what zipfile writes."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        """Return and forget everything written since the last call."""
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def unique_name(stem, extension, used):
+    """Archive entry name ``stem.extension``, numbered if already in ``used``."""
+    name = f'{stem}.{extension}'
+    counter = 1
+    while name in used:
+        name = f'{stem} ({counter}).{extension}'
+        counter += 1
+    used.add(name)
+    return name
+
+
+def mp_context():
+    """Multiprocessing context for worker processes started by a threaded server."""
+    # Forking a threaded server process copies whatever locks other request
+    # threads held at that moment, which can deadlock the child. Start
+    # workers from a clean forkserver (or spawn where there is none)
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class ProcessPool:
+    """
+    Process pool created on first use and shared by all requests in this worker.
+
+    Workers are started with forkserver or spawn, never fork, so tasks must
+    be top-level functions with picklable arguments.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def get(self, workers):
+        """Get the pool, starting it with ``workers`` processes if needed."""
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=workers, mp_context=mp_context())
+            return self._executor
+
+    def reset(self):
+        """Drop a pool whose processes died so the next request starts a new one."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
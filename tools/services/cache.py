@@ -0,0 +1,152 @@
+"""Byte-size bounded caches with an in-memory tier and an optional disk tier."""
+
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class MemoryCache:
+    """LRU cache of bytes values, evicting by total byte size."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+
+            self._entries[key] = value
+            self.size += len(value)
+
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class DiskCache:
+    """
+    Directory of cache files, evicting least recently used files by total size.
+
+    Recency is tracked through file modification times, so several worker
+    processes can share the same directory. With ``max_age`` set, files
+    that haven't been used for that many seconds are treated as missing
+    and removed on the next eviction pass.
+    """
+
+    def __init__(self, directory, max_bytes, max_age=None):
+        self.directory = str(directory)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._written = 0
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.max_age and os.stat(path).st_mtime < time.time() - self.max_age:
+                return None
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)
+            return value
+        except OSError:
+            return None
+
+    def set(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+
+        # Write to a temp file and rename so readers never see partial data
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, self._path(key))
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            self._written += len(value)
+            # Only rescan the directory after roughly 10% of the budget has
+            # been written since the last scan
+            if self._written < self.max_bytes // 10:
+                return
+            self._written = 0
+        self.evict()
+
+    def evict(self):
+        """Delete expired files, then least recently used ones until under the size limit."""
+        cutoff = time.time() - self.max_age if self.max_age else None
+        entries = []
+        total = 0
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith('.tmp-'):
+                continue
+            try:
+                stat = entry.stat()
+                if cutoff is not None and stat.st_mtime < cutoff:
+                    os.remove(entry.path)
+                    continue
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class TieredCache:
+    """Memory cache backed by an optional shared disk cache."""
+
+    def __init__(self, memory_bytes, disk_dir=None, disk_bytes=0, disk_max_age=None):
+        self.memory = MemoryCache(memory_bytes)
+        self.disk = DiskCache(disk_dir, disk_bytes, disk_max_age) if disk_dir else None
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                self.memory.set(key, value)
+        return value
+
+    def set(self, key, value):
+        self.memory.set(key, value)
+        if self.disk is not None:
+            self.disk.set(key, value)
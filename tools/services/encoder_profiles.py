@@ -0,0 +1,199 @@
+"""
+Named encoder profiles for saving images.
+
+Each profile trades encode time for output size without changing what the
+image looks like: JPEG and WebP keep the converter's quality of 95, and
+everything else is lossless. Only the encoder effort changes:
+
+    fast      - least CPU, largest files
+    balanced  - Pillow's usual effort
+    smallest  - most CPU, smallest files
+
+``DEFAULT_PROFILES`` picks a profile per format. It was chosen with
+``manage.py benchmark_encoders`` on the bundled reference corpus (photo,
+flat graphic and screenshot-like images at 1600x1200). The default is the
+lowest-effort profile whose output is within 3% of the smallest one.
+Re-run the benchmark when upgrading Pillow or its codecs.
+
+Measured with Pillow 12 (total over the corpus):
+
+    JPEG  fast 20 ms / 1221 KiB   balanced 48 ms / 1102 KiB   smallest 100 ms / 1039 KiB
+    PNG   fast 369 ms / 4134 KiB  balanced 529 ms / 3773 KiB  smallest 692 ms / 3624 KiB
+    WEBP  fast 198 ms / 956 KiB   balanced 528 ms / 971 KiB   smallest 1559 ms / 958 KiB
+    TIFF  fast 8 ms / 16875 KiB   balanced 177 ms / 7767 KiB  smallest 199 ms / 5477 KiB
+    GIF and BMP come out the same size with every profile.
+"""
+
+import io
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+
+PROFILES = ('fast', 'balanced', 'smallest')
+
+ENCODER_PROFILES = {
+    'fast': {
+        'JPEG': {'quality': 95, 'optimize': False, 'progressive': False, 'subsampling': '4:2:0'},
+        'PNG': {'compress_level': 1},
+        'WEBP': {'quality': 95, 'method': 0},
+        'GIF': {'optimize': False},
+        'TIFF': {'compression': 'raw'},
+        'BMP': {},
+    },
+    'balanced': {
+        'JPEG': {'quality': 95, 'optimize': True, 'progressive': False, 'subsampling': '4:2:0'},
+        'PNG': {'compress_level': 6},
+        'WEBP': {'quality': 95, 'method': 4},
+        'GIF': {'optimize': True},
+        'TIFF': {'compression': 'tiff_lzw'},
+        'BMP': {},
+    },
+    'smallest': {
+        'JPEG': {'quality': 95, 'optimize': True, 'progressive': True, 'subsampling': '4:2:0'},
+        'PNG': {'compress_level': 9, 'optimize': True},
+        'WEBP': {'quality': 95, 'method': 6},
+        'GIF': {'optimize': True},
+        'TIFF': {'compression': 'tiff_adobe_deflate'},
+        'BMP': {},
+    },
+}
+
+DEFAULT_PROFILES = {
+    'JPEG': 'smallest',
+    'PNG': 'smallest',
+    'WEBP': 'fast',
+    'GIF': 'fast',
+    'TIFF': 'smallest',
+    'BMP': 'fast',
+}
+
+
+def normalize_format(output_format):
+    """Map a format name to the name Pillow saves it under."""
+    output_format = output_format.upper()
+    return 'JPEG' if output_format == 'JPG' else output_format
+
+
+def encoder_options(output_format, profile=None):
+    """
+    Get the ``Image.save`` keyword arguments for a format and profile.
+
+    Args:
+        output_format: Target format (PNG, JPG, WEBP, etc.)
+        profile: 'fast', 'balanced' or 'smallest'; the format's benchmarked
+            default if not given
+
+    Returns:
+        Dict of save options (empty for formats without a profile)
+
+    Raises:
+        ValueError: If the profile name is unknown
+    """
+    output_format = normalize_format(output_format)
+    if not profile:
+        profile = DEFAULT_PROFILES.get(output_format, 'balanced')
+    if profile not in ENCODER_PROFILES:
+        raise ValueError(f'Unknown encoder profile: {profile}')
+    return dict(ENCODER_PROFILES[profile].get(output_format, {}))
+
+
+def reference_corpus(size=(1600, 1200), seed=0):
+    """
+    Generate the benchmark's reference images.
+
+    Returns:
+        List of (name, RGB PIL Image) tuples
+    """
+    width, height = size
+    rng = np.random.default_rng(seed)
+
+    # Photo-like: smooth gradients plus sensor noise
+    y, x = np.mgrid[0:height, 0:width]
+    base = np.stack([
+        128 + 100 * np.sin(x / 97.0) * np.cos(y / 131.0),
+        128 + 90 * np.sin((x + y) / 173.0),
+        128 + 80 * np.cos(x / 59.0 - y / 211.0),
+    ], axis=-1)
+    photo = np.clip(base + rng.normal(0, 6, base.shape), 0, 255).astype(np.uint8)
+
+    # Flat graphic: a few solid shapes
+    graphic = Image.new('RGB', size, (240, 240, 235))
+    draw = ImageDraw.Draw(graphic)
+    for _ in range(40):
+        x0, y0 = rng.integers(0, width - 100), rng.integers(0, height - 100)
+        color = tuple(int(c) for c in rng.integers(0, 256, 3))
+        draw.rectangle((x0, y0, x0 + rng.integers(20, 300), y0 + rng.integers(20, 300)), fill=color)
+
+    # Screenshot-like: lines of text on a light background
+    screenshot = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(screenshot)
+    for row, top in enumerate(range(10, height - 20, 18)):
+        draw.text((12 + (row % 3) * 20, top), 'PixCraft encoder benchmark line %d ' % row * 3, fill=(30, 30, 30))
+
+    return [('photo', Image.fromarray(photo, 'RGB')), ('graphic', graphic), ('screenshot', screenshot)]
+
+
+def benchmark(images, formats=None, repeat=3):
+    """
+    Measure encode time and output size of every profile.
+
+    Args:
+        images: List of (name, PIL Image) tuples
+        formats: Formats to measure (defaults to every profiled format)
+        repeat: Encodes per measurement; the fastest is kept
+
+    Returns:
+        Dict of format -> profile -> {'seconds': float, 'bytes': int},
+        summed over the images
+    """
+    formats = formats or list(ENCODER_PROFILES['balanced'])
+    results = {}
+
+    for output_format in formats:
+        results[output_format] = {}
+        for profile in PROFILES:
+            options = encoder_options(output_format, profile)
+            total_seconds = 0.0
+            total_bytes = 0
+            for _, image in images:
+                if output_format == 'GIF':
+                    image = image.quantize(256)
+                best = None
+                for _ in range(repeat):
+                    buffer = io.BytesIO()
+                    start = time.perf_counter()
+                    image.save(buffer, format=output_format, **options)
+                    elapsed = time.perf_counter() - start
+                    best = elapsed if best is None else min(best, elapsed)
+                total_seconds += best
+                total_bytes += buffer.tell()
+            results[output_format][profile] = {'seconds': total_seconds, 'bytes': total_bytes}
+
+    return results
+
+
+def recommend_profiles(results, tolerance=0.03):
+    """
+    Pick the lowest-effort profile per format that is close to the smallest output.
+
+    Profiles are tried in order of effort rather than by measured time, so
+    formats where every profile gives the same output don't flip between
+    runs because of timing noise.
+
+    Args:
+        results: Output of benchmark()
+        tolerance: Allowed size overhead relative to the smallest profile
+
+    Returns:
+        Dict of format -> profile name
+    """
+    recommended = {}
+    for output_format, by_profile in results.items():
+        smallest = min(r['bytes'] for r in by_profile.values())
+        recommended[output_format] = next(
+            profile for profile in PROFILES
+            if by_profile[profile]['bytes'] <= smallest * (1 + tolerance)
+        )
+    return recommended
@@ -1,14 +1,32 @@
 """Core image processing service."""
 
 import io
+import math
 from PIL import Image
 from django.core.exceptions import ValidationError
 
+from .encoder_profiles import encoder_options
+from .png_optimizer import optimize_png
+
+
+# Modes supported by Image.reduce()
+REDUCIBLE_MODES = ('L', 'LA', 'RGB', 'RGBA', 'RGBX', 'CMYK', 'YCbCr', 'I', 'F')
+
 
 class ImageProcessor:
     """Service for image processing operations."""
     
-    SUPPORTED_FORMATS = ['PNG', 'JPG', 'JPEG', 'WEBP', 'BMP', 'TIFF', 'GIF']
+    SUPPORTED_FORMATS = ['PNG', 'JPG', 'JPEG', 'WEBP', 'BMP', 'TIFF', 'GIF', 'ICO']
+    
+    CONTENT_TYPES = {
+        'PNG': 'image/png',
+        'JPEG': 'image/jpeg',
+        'WEBP': 'image/webp',
+        'BMP': 'image/bmp',
+        'TIFF': 'image/tiff',
+        'GIF': 'image/gif',
+        'ICO': 'image/x-icon'
+    }
     
     @staticmethod
     def open_image(file):
@@ -28,6 +46,41 @@ class ImageProcessor:
         except Exception as e:
             raise ValidationError(f'Failed to open image: {str(e)}')
     
+    @staticmethod
+    def open_for_target_size(source, size, reducing_gap=2.0):
+        """
+        Open an image decoded at roughly the resolution it will be used at.
+
+        JPEGs are decoded with DCT scaling (``Image.draft``) and other formats
+        are shrunk with ``Image.reduce``, stopping at ``reducing_gap`` times
+        the target size so the final high-quality resample still has enough
+        pixels to work with.
+
+        Args:
+            source: Django UploadedFile / file object, or a PIL Image that
+                has not been loaded yet
+            size: Smallest (width, height) the caller will resample to
+            reducing_gap: Keep at least this many times the target size
+
+        Returns:
+            PIL Image object, no smaller than ``size`` in either dimension
+            unless the source itself is smaller
+        """
+        img = source if isinstance(source, Image.Image) else Image.open(source)
+
+        target_width = max(1, math.ceil(size[0] * reducing_gap))
+        target_height = max(1, math.ceil(size[1] * reducing_gap))
+
+        if img.format == 'JPEG':
+            # No-op if the pixels have already been decoded
+            img.draft(img.mode, (target_width, target_height))
+
+        factor = min(img.width // target_width, img.height // target_height)
+        if factor > 1 and img.mode in REDUCIBLE_MODES:
+            img = img.reduce(factor)
+
+        return img
+
     @staticmethod
     def resize_image(image, width, height, maintain_aspect=True):
         """
@@ -43,19 +96,49 @@ class ImageProcessor:
             Resized PIL Image object
         """
         if maintain_aspect:
+            scale = min(width / image.width, height / image.height, 1)
+            image = ImageProcessor.open_for_target_size(image, (image.width * scale, image.height * scale))
             image.thumbnail((width, height), Image.Resampling.LANCZOS)
         else:
+            image = ImageProcessor.open_for_target_size(image, (width, height))
             image = image.resize((width, height), Image.Resampling.LANCZOS)
         return image
     
     @staticmethod
-    def convert_format(image, output_format):
+    def prepare_for_format(image, output_format):
+        """
+        Convert an image to a mode the output format can store.
+
+        Transparent images saved as JPEG are flattened onto white.
+
+        Args:
+            image: PIL Image object
+            output_format: Target format, already normalised (JPEG, not JPG)
+
+        Returns:
+            PIL Image object
+        """
+        # Handle transparency for JPG
+        if output_format == 'JPEG' and image.mode in ('RGBA', 'LA', 'P'):
+            background = Image.new('RGB', image.size, (255, 255, 255))
+            if image.mode == 'P':
+                image = image.convert('RGBA')
+            background.paste(image, mask=image.split()[-1] if image.mode in ('RGBA', 'LA') else None)
+            return background
+        if image.mode != 'RGB' and output_format not in ('PNG', 'WEBP'):
+            return image.convert('RGB')
+        return image
+    
+    @staticmethod
+    def convert_format(image, output_format, profile=None):
         """
         Convert image to different format.
         
         Args:
             image: PIL Image object
             output_format: Target format (PNG, JPG, WEBP, etc.)
+            profile: Encoder profile ('fast', 'balanced', 'smallest');
+                the format's default if not given
         
         Returns:
             Bytes object of converted image
@@ -68,33 +151,43 @@ class ImageProcessor:
         if output_format == 'JPG':
             output_format = 'JPEG'
         
-        if image.mode in ('RGBA', 'LA', 'P') and output_format == 'JPEG':
-            image = image.convert('RGB')
+        try:
+            options = encoder_options(output_format, profile)
+        except ValueError as e:
+            raise ValidationError(str(e))
+        
+        image = ImageProcessor.prepare_for_format(image, output_format)
         
         buffer = io.BytesIO()
-        image.save(buffer, format=output_format, quality=95)
+        image.save(buffer, format=output_format, **options)
         buffer.seek(0)
         
         return buffer.getvalue()
     
     @staticmethod
-    def compress_image(image, quality=85):
+    def compress_image(image, quality=85, output_format=None, png_options=None):
         """
         Compress image by reducing quality.
         
+        PNGs stay PNGs and go through the PNG optimiser instead, which
+        keeps transparency; ``quality`` doesn't apply to them.
+        
         Args:
             image: PIL Image object
             quality: Compression quality (1-100)
+            output_format: Format to encode as; defaults to the image's own
+                format
+            png_options: Keyword arguments for png_optimizer.optimize_png
+                (palette, colors, method, dither)
         
         Returns:
             Bytes object of compressed image
         """
         quality = max(1, min(100, int(quality)))
         
-        output_format = image.format or 'JPEG'
+        output_format = output_format or image.format or 'JPEG'
         if output_format == 'PNG':
-            image = image.convert('RGB')
-            output_format = 'JPEG'
+            return optimize_png(image, **(png_options or {}))
         
         buffer = io.BytesIO()
         image.save(buffer, format=output_format, quality=quality, optimize=True)
@@ -0,0 +1,400 @@
+"""
+Page-at-a-time PDF output for image_to_pdf.
+
+Each page is decoded, transformed and encoded on its own and written to
+the output file straight away, so memory use doesn't grow with the number
+of pages. Every page image is stored as a JPEG (DCTDecode) stream:
+JPEG uploads that need no rotation are embedded byte for byte, without
+being decoded, and everything else is re-encoded at
+``PDF_EXPORT['jpeg_quality']``.
+
+Decoding and resampling run on a small process pool when several pages
+need it; the rendered pages are written back in upload order. Each page
+that is decoded holds a pixel-budget reservation for its image until it
+has been rendered, so only the pages in flight count against the budget.
+"""
+
+import io
+import os
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from PIL import Image
+
+from ..admission import PixelBudgetExceeded, reserved
+from ..security import ValidatedImage
+from .batching import ProcessPool
+from .image_processor import ImageProcessor
+
+# Colour modes a PDF viewer renders correctly from a raw DCT stream
+PASSTHROUGH_MODES = ('RGB', 'L')
+
+COLOR_SPACES = {'RGB': b'/DeviceRGB', 'L': b'/DeviceGray'}
+
+
+def fit_image_to_page(img_width, img_height, page_size_option, page_width, page_height):
+    """Size an image is scaled to on an image_to_pdf page."""
+    if page_size_option == 'fit-width':
+        # Fit to page width, maintain aspect ratio
+        aspect_ratio = img_height / img_width
+
+        # Use 90% of page width (leave margins)
+        new_width = int(page_width * 0.9)
+        new_height = int(new_width * aspect_ratio)
+
+        # If height exceeds page, scale down
+        if new_height > page_height * 0.9:
+            new_height = int(page_height * 0.9)
+            new_width = int(new_height / aspect_ratio)
+
+        return new_width, new_height
+
+    # A4 or Letter - fit to page, maintain aspect ratio
+    aspect_ratio = img_width / img_height
+
+    # Calculate dimensions to fit page (with margins)
+    max_width = page_width * 0.9
+    max_height = page_height * 0.9
+
+    if aspect_ratio > 1:
+        # Landscape image - fit to width
+        new_width = int(max_width)
+        new_height = int(new_width / aspect_ratio)
+    else:
+        # Portrait image - fit to height
+        new_height = int(max_height)
+        new_width = int(new_height * aspect_ratio)
+
+    # Make sure it doesn't exceed page
+    if new_width > max_width:
+        new_width = int(max_width)
+        new_height = int(new_width / aspect_ratio)
+
+    if new_height > max_height:
+        new_height = int(max_height)
+        new_width = int(new_height * aspect_ratio)
+
+    return new_width, new_height
+
+
+def passthrough_jpeg(upload, rotate_val=0):
+    """
+    Get the original bytes of an upload that can be embedded unchanged.
+
+    Args:
+        upload: ValidatedImage for the page
+        rotate_val: Requested rotation in degrees
+
+    Returns:
+        JPEG bytes, or None if the page has to be re-encoded
+    """
+    config = getattr(settings, 'PDF_EXPORT', {})
+    if not config.get('jpeg_passthrough', True):
+        return None
+    if rotate_val % 360 != 0 or upload.format != 'JPEG' or upload.mode not in PASSTHROUGH_MODES:
+        return None
+
+    upload.file.seek(0)
+    data = upload.file.read()
+    upload.file.seek(0)
+    return data
+
+
+def encode_page(img, quality=None):
+    """
+    Encode a resampled page image as JPEG.
+
+    Args:
+        img: RGB PIL Image object
+        quality: JPEG quality (defaults to PDF_EXPORT['jpeg_quality'])
+
+    Returns:
+        JPEG bytes
+    """
+    if quality is None:
+        quality = getattr(settings, 'PDF_EXPORT', {}).get('jpeg_quality', 90)
+
+    buffer = io.BytesIO()
+    img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+class PdfPage:
+    """One encoded page, ready to be written by PdfWriter."""
+
+    def __init__(self, data, mode, image_size, page_size, draw_size):
+        self.data = data
+        self.mode = mode
+        self.image_size = image_size
+        self.page_size = page_size
+        self.draw_size = draw_size
+
+
+def passthrough_page(upload, rotate_val, page_size_option, page_size):
+    """
+    Build the page for an upload that can be embedded without decoding.
+
+    Returns:
+        PdfPage object, or None if the image has to be rendered
+    """
+    data = passthrough_jpeg(upload, rotate_val)
+    if data is None:
+        return None
+
+    if page_size_option == 'original':
+        return PdfPage(data, upload.mode, upload.size, upload.size, upload.size)
+
+    # Scaled to the page by the viewer
+    new_size = fit_image_to_page(upload.width, upload.height, page_size_option, *page_size)
+    return PdfPage(data, upload.mode, upload.size, page_size, new_size)
+
+
+def render_page(upload, rotate_val, page_size_option, page_size):
+    """
+    Decode, rotate, fit and encode one uploaded image.
+
+    Args:
+        upload: ValidatedImage for the page
+        rotate_val: Clockwise rotation in degrees
+        page_size_option: 'original', 'a4', 'letter' or 'fit-width'
+        page_size: (width, height) of the page in points
+
+    Returns:
+        PdfPage object
+    """
+    # Unrotated JPEGs go into the PDF as-is, without being decoded at all
+    page = passthrough_page(upload, rotate_val, page_size_option, page_size)
+    if page is not None:
+        return page
+
+    img = upload.image
+    page_width, page_height = page_size
+
+    # Work out the final size from the header so the image can be decoded
+    # at reduced resolution (right angles only)
+    new_size = None
+    if page_size_option != 'original' and rotate_val % 90 == 0:
+        img_width, img_height = img.size
+        if rotate_val % 180 != 0:
+            img_width, img_height = img_height, img_width
+        new_size = fit_image_to_page(img_width, img_height, page_size_option, page_width, page_height)
+
+        draft_size = new_size if rotate_val % 180 == 0 else new_size[::-1]
+        img = ImageProcessor.open_for_target_size(img, draft_size)
+
+    if rotate_val != 0:
+        img = img.rotate(-rotate_val, expand=True)
+
+    # Convert to RGB for PDF
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    if page_size_option == 'original':
+        # Original size - one image pixel per point
+        return PdfPage(encode_page(img), 'RGB', img.size, img.size, img.size)
+
+    # A4, Letter, or Fit-width - resample to the fitted size
+    if new_size is None:
+        new_size = fit_image_to_page(img.width, img.height, page_size_option, page_width, page_height)
+    img = img.resize(new_size, Image.Resampling.LANCZOS)
+    return PdfPage(encode_page(img), 'RGB', img.size, page_size, new_size)
+
+
+def _render_page_data(data, rotate_val, page_size_option, page_size):
+    """Pool worker entry point: render a page from the raw upload bytes."""
+    buffer = io.BytesIO(data)
+    with Image.open(buffer) as image:
+        return render_page(ValidatedImage(buffer, image), rotate_val, page_size_option, page_size)
+
+
+_pool = ProcessPool()
+
+
+def _reserve(upload, stack, wait=None):
+    """Reserve a page's decoded size on ``stack``; False if there was no room."""
+    return stack.enter_context(reserved(upload.decoded_bytes, wait))
+
+
+def render_pages(uploads, rotations, page_size_option, page_size):
+    """
+    Render several pages, in parallel when a process pool is configured.
+
+    Pages that can be passed through are built here; everything else is
+    sent to the pool as raw upload bytes. Only a window of
+    ``2 * workers`` pages is in flight at once, and pages are yielded in
+    upload order.
+
+    Args:
+        uploads: List of ValidatedImage objects
+        rotations: Clockwise rotation in degrees for each upload
+        page_size_option: 'original', 'a4', 'letter' or 'fit-width'
+        page_size: (width, height) of the page in points
+
+    Yields:
+        PdfPage objects
+
+    Raises:
+        PixelBudgetExceeded: If the budget has no room for a page's image
+    """
+    config = getattr(settings, 'PDF_EXPORT', {})
+    workers = config.get('workers') or min(4, os.cpu_count() or 1)
+
+    if workers <= 1 or len(uploads) <= 1:
+        for upload, rotate_val in zip(uploads, rotations):
+            with ExitStack() as stack:
+                page = passthrough_page(upload, rotate_val, page_size_option, page_size)
+                if page is None:
+                    if not _reserve(upload, stack):
+                        raise PixelBudgetExceeded()
+                    page = render_page(upload, rotate_val, page_size_option, page_size)
+            yield page
+        return
+
+    executor = _pool.get(workers)
+    window = 2 * workers
+    # (page or Future, reservation) pairs
+    pending = deque()
+
+    def next_page():
+        item, stack = pending.popleft()
+        with stack:
+            if not isinstance(item, Future):
+                return item
+            try:
+                return item.result()
+            except BrokenProcessPool:
+                _pool.reset()
+                raise
+
+    try:
+        for upload, rotate_val in zip(uploads, rotations):
+            stack = ExitStack()
+            page = passthrough_page(upload, rotate_val, page_size_option, page_size)
+            if page is None:
+                # Finish our own pages first rather than wait for them
+                admitted = False
+                while pending and not admitted:
+                    admitted = _reserve(upload, stack, wait=0)
+                    if not admitted:
+                        yield next_page()
+                if not admitted and not _reserve(upload, stack):
+                    stack.close()
+                    raise PixelBudgetExceeded()
+                upload.file.seek(0)
+                page = executor.submit(_render_page_data, upload.file.read(), rotate_val, page_size_option, page_size)
+            pending.append((page, stack))
+
+            while len(pending) >= window:
+                yield next_page()
+
+        while pending:
+            yield next_page()
+    finally:
+        # Stopped early: give back what the remaining pages reserved
+        for _, stack in pending:
+            stack.close()
+
+
+def _num(value):
+    """Format a number for a PDF content stream."""
+    return (b'%.4f' % value).rstrip(b'0').rstrip(b'.')
+
+
+class PdfWriter:
+    """
+    Minimal PDF writer that emits each page as soon as it is added.
+
+    Only the byte offsets of the objects written so far are kept; the page
+    tree, cross-reference table and trailer are written by ``close()``.
+    """
+
+    CATALOG_ID = 1
+    PAGES_ID = 2
+
+    def __init__(self, fp):
+        self.fp = fp
+        self._position = 0
+        self._offsets = [None, None]
+        self._page_ids = []
+        self._write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def _write(self, data):
+        self.fp.write(data)
+        self._position += len(data)
+
+    def _next_id(self):
+        self._offsets.append(None)
+        return len(self._offsets)
+
+    def _write_object(self, obj_id, body, stream=None):
+        self._offsets[obj_id - 1] = self._position
+        self._write(b'%d 0 obj\n' % obj_id + body)
+        if stream is not None:
+            self._write(b'\nstream\n')
+            self._write(stream)
+            self._write(b'\nendstream')
+        self._write(b'\nendobj\n')
+
+    def add_page(self, page):
+        """
+        Write one page with its image centred on it.
+
+        Args:
+            page: PdfPage object
+        """
+        image_id = self._next_id()
+        contents_id = self._next_id()
+        page_id = self._next_id()
+
+        width, height = page.image_size
+        self._write_object(
+            image_id,
+            b'<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s '
+            b'/BitsPerComponent 8 /Filter /DCTDecode /Length %d >>'
+            % (width, height, COLOR_SPACES[page.mode], len(page.data)),
+            page.data,
+        )
+
+        page_width, page_height = page.page_size
+        draw_width, draw_height = page.draw_size
+        x = (page_width - draw_width) / 2
+        y = (page_height - draw_height) / 2
+        contents = b'q %s 0 0 %s %s %s cm /Im0 Do Q' % (
+            _num(draw_width), _num(draw_height), _num(x), _num(y),
+        )
+        self._write_object(contents_id, b'<< /Length %d >>' % len(contents), contents)
+
+        self._write_object(
+            page_id,
+            b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %s %s] '
+            b'/Resources << /XObject << /Im0 %d 0 R >> /ProcSet [/PDF /ImageC /ImageB] >> '
+            b'/Contents %d 0 R >>'
+            % (self.PAGES_ID, _num(page_width), _num(page_height), image_id, contents_id),
+        )
+        self._page_ids.append(page_id)
+
+    @property
+    def page_count(self):
+        return len(self._page_ids)
+
+    def close(self):
+        """Write the page tree, cross-reference table and trailer."""
+        kids = b' '.join(b'%d 0 R' % page_id for page_id in self._page_ids)
+        self._write_object(
+            self.PAGES_ID,
+            b'<< /Type /Pages /Kids [%s] /Count %d >>' % (kids, len(self._page_ids)),
+        )
+        self._write_object(self.CATALOG_ID, b'<< /Type /Catalog /Pages %d 0 R >>' % self.PAGES_ID)
+
+        xref_position = self._position
+        size = len(self._offsets) + 1
+        self._write(b'xref\n0 %d\n0000000000 65535 f \n' % size)
+        for offset in self._offsets:
+            self._write(b'%010d 00000 n \n' % offset)
+        self._write(
+            b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n'
+            % (size, self.CATALOG_ID, xref_position)
+        )
@@ -0,0 +1,178 @@
+"""
+PNG optimisation that keeps the output a PNG.
+
+The image is first reduced losslessly:
+
+* metadata (text chunks, EXIF, timestamps) is dropped; an ICC profile is
+  kept because removing it can change the colours;
+* 16-bit greyscale whose samples fit in 8 bits is stored as 8-bit;
+* an alpha channel that is fully opaque is dropped;
+* colour images whose pixels are all grey become greyscale;
+* images with at most 256 distinct colours (alpha included) become an
+  exact palette image, which Pillow stores with 1, 2, 4 or 8 bits per
+  pixel depending on the palette size.
+
+When palette quantisation is requested, a quantised version (lossy, but
+usually invisible for screenshots and graphics) is added as another
+candidate. The smallest candidate is then deflated with each zlib
+strategy and the smallest file wins. Transparency survives every step.
+"""
+
+import io
+
+import numpy as np
+from PIL import Image, features
+
+
+# zlib strategies: default, Z_FILTERED, Z_RLE, Z_HUFFMAN_ONLY
+ZLIB_STRATEGIES = (0, 1, 3, 2)
+
+QUANTIZE_METHODS = {
+    'median_cut': Image.Quantize.MEDIANCUT,
+    'max_coverage': Image.Quantize.MAXCOVERAGE,
+    'fast_octree': Image.Quantize.FASTOCTREE,
+    'libimagequant': Image.Quantize.LIBIMAGEQUANT,
+}
+
+# Methods Pillow can apply to images with an alpha channel
+ALPHA_QUANTIZE_METHODS = ('fast_octree', 'libimagequant')
+
+
+def available_quantize_methods():
+    """Quantisation methods this Pillow build supports."""
+    return [
+        name for name in QUANTIZE_METHODS
+        if name != 'libimagequant' or features.check('libimagequant')
+    ]
+
+
+def _exact_palette(image, max_colors=256):
+    """
+    Convert an image with at most ``max_colors`` colours to mode P exactly.
+
+    Returns:
+        (P image, transparency bytes or None), or None if there are too
+        many colours
+    """
+    pixels = np.asarray(image.convert('RGBA'))
+    packed = pixels.view(np.uint32).reshape(pixels.shape[:2])
+    colors, indices = np.unique(packed, return_inverse=True)
+    if len(colors) > max_colors:
+        return None
+
+    table = colors.view(np.uint8).reshape(-1, 4)
+    # Opaque entries go last so the tRNS chunk can stop before them
+    order = np.argsort(table[:, 3] == 255, kind='stable')
+    remap = np.empty_like(order)
+    remap[order] = np.arange(len(order))
+    table = table[order]
+
+    palette = Image.fromarray(remap[indices].reshape(packed.shape).astype(np.uint8), 'L')
+    palette = palette.convert('P')
+    palette.putpalette(table[:, :3].tobytes())
+
+    alpha = table[:, 3]
+    translucent = int(np.count_nonzero(alpha < 255))
+    return palette, (alpha[:translucent].tobytes() if translucent else None)
+
+
+def reduce_losslessly(image):
+    """
+    Reduce an image to the smallest PNG colour type and bit depth that
+    holds it without changing any pixel.
+
+    Returns:
+        (PIL Image, save options) tuple
+    """
+    if image.mode == 'I;16' or (image.mode == 'I' and image.getextrema()[1] < 65536):
+        samples = np.asarray(image).astype(np.uint32)
+        if samples.min() >= 0 and not (samples % 257).any():
+            image = Image.fromarray((samples // 257).astype(np.uint8), 'L')
+        else:
+            return image, {}
+
+    if image.mode == 'P':
+        image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+    elif image.mode == '1':
+        return image, {}
+    elif image.mode not in ('L', 'LA', 'RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    if image.mode in ('LA', 'RGBA') and image.getchannel('A').getextrema()[0] == 255:
+        image = image.convert(image.mode[:-1])
+
+    if image.mode in ('RGB', 'RGBA'):
+        pixels = np.asarray(image)
+        if (pixels[..., 0] == pixels[..., 1]).all() and (pixels[..., 1] == pixels[..., 2]).all():
+            image = image.convert('LA' if image.mode == 'RGBA' else 'L')
+
+    # Greyscale is already 8 bits per pixel, so a palette only helps when
+    # it fits in 4 bits or fewer
+    max_colors = 16 if image.mode == 'L' else 256
+    if image.mode in ('L', 'LA', 'RGB', 'RGBA'):
+        exact = _exact_palette(image, max_colors)
+        if exact is not None:
+            palette, transparency = exact
+            return palette, ({'transparency': transparency} if transparency else {})
+
+    return image, {}
+
+
+def quantize(image, colors=256, method='fast_octree', dither=True):
+    """
+    Quantise an image to a palette, keeping its alpha channel.
+
+    Methods that can't handle alpha fall back to the fast octree.
+
+    Returns:
+        PIL Image in mode P
+    """
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+    image = image.convert('RGBA' if has_alpha else 'RGB')
+    if method not in available_quantize_methods() or (has_alpha and method not in ALPHA_QUANTIZE_METHODS):
+        method = 'fast_octree'
+
+    return image.quantize(
+        colors=max(2, min(256, int(colors))),
+        method=QUANTIZE_METHODS[method],
+        dither=Image.Dither.FLOYDSTEINBERG if dither else Image.Dither.NONE,
+    )
+
+
+def optimize_png(image, palette=False, colors=256, method='fast_octree', dither=True,
+                 strategies=ZLIB_STRATEGIES):
+    """
+    Encode an image as the smallest PNG found.
+
+    Args:
+        image: PIL Image object
+        palette: Also try a quantised palette version (lossy)
+        colors: Palette size for quantisation (2-256)
+        method: Quantisation method, one of QUANTIZE_METHODS
+        dither: Use Floyd-Steinberg dithering when quantising
+        strategies: zlib strategies to try
+
+    Returns:
+        Bytes object of the PNG
+    """
+    icc_profile = image.info.get('icc_profile')
+    candidates = [reduce_losslessly(image)]
+    if palette:
+        candidates.append((quantize(image, colors, method, dither), {}))
+
+    def encode(candidate, options, strategy):
+        if icc_profile:
+            options = dict(options, icc_profile=icc_profile)
+        buffer = io.BytesIO()
+        candidate.save(buffer, format='PNG', compress_level=9, compress_type=strategy, **options)
+        return buffer.getvalue()
+
+    # Pick the candidate with the first strategy, then try the others on it
+    results = [(encode(candidate, options, strategies[0]), candidate, options) for candidate, options in candidates]
+    best, candidate, options = min(results, key=lambda result: len(result[0]))
+    for strategy in strategies[1:]:
+        data = encode(candidate, options, strategy)
+        if len(data) < len(best):
+            best = data
+
+    return best
@@ -0,0 +1,214 @@
+"""
+Bulk QR code generation streamed as a ZIP archive.
+
+The input is either a CSV with a header row (``id``, ``data`` and the
+optional ``size`` and ``error_correction`` columns) or a plain list with
+one payload per line. Codes are rendered on a process pool in batches of
+rows, written to the archive in input order and named by row id. Rows
+that can't be rendered don't stop the batch; every row's outcome is
+listed in ``manifest.csv`` at the end of the archive.
+"""
+
+import csv
+import io
+import itertools
+import re
+import zipfile
+from collections import deque
+from concurrent.futures.process import BrokenProcessPool
+
+from .batching import ChunkSink, ProcessPool, unique_name
+from .qr_render import ERROR_CORRECTION_LEVELS, encode_qr
+
+
+MAX_DATA_LENGTH = 2000
+MIN_SIZE = 100
+MAX_SIZE = 1000
+
+CSV_COLUMNS = ('id', 'data', 'size', 'error_correction')
+
+
+class QrRow:
+    """One requested code; ``error`` is set when the row is invalid."""
+
+    def __init__(self, number, row_id, data, size, error_correction, error=None):
+        self.number = number
+        self.row_id = row_id
+        self.data = data
+        self.size = size
+        self.error_correction = error_correction
+        self.error = error
+
+
+def _make_row(number, row_id, data, size, error_correction, default_size, default_error_correction):
+    row_id = (row_id or '').strip() or str(number)
+    data = (data or '').strip()
+    error_correction = (error_correction or '').strip().upper() or default_error_correction
+    row = QrRow(number, row_id, data, default_size, error_correction)
+
+    try:
+        row.size = int(size) if str(size or '').strip() else default_size
+    except ValueError:
+        row.error = f'Invalid size: {size}'
+        return row
+
+    if not data:
+        row.error = 'No data'
+    elif len(data) > MAX_DATA_LENGTH:
+        row.error = f'Text too long (max {MAX_DATA_LENGTH} characters)'
+    elif not MIN_SIZE <= row.size <= MAX_SIZE:
+        row.error = f'Invalid size ({MIN_SIZE}-{MAX_SIZE} pixels)'
+    elif error_correction not in ERROR_CORRECTION_LEVELS:
+        row.error = f'Invalid error correction level: {error_correction}'
+    return row
+
+
+def parse_rows(text, default_size=300, default_error_correction='H', max_rows=None):
+    """
+    Parse a CSV or newline-separated list of payloads.
+
+    A first line that names a ``data`` column makes the input a CSV;
+    otherwise every non-empty line is one payload, commas included.
+
+    Args:
+        text: The CSV or list
+        default_size: Size for rows without one
+        default_error_correction: Level for rows without one
+        max_rows: Stop parsing after ``max_rows + 1`` rows, enough for the
+            caller to tell the limit was exceeded
+
+    Returns:
+        List of QrRow objects, numbered from 1
+    """
+    lines = iter(text.splitlines())
+    first = next((line for line in lines if line.strip()), None)
+    if first is None:
+        return []
+
+    def full():
+        return max_rows is not None and len(rows) > max_rows
+
+    rows = []
+    header = [name.strip().lower() for name in next(csv.reader([first]))]
+    if 'data' not in header:
+        number = 0
+        for line in itertools.chain([first], lines):
+            if full():
+                break
+            if line.strip():
+                number += 1
+                rows.append(_make_row(number, None, line, None, None, default_size, default_error_correction))
+        return rows
+
+    reader = csv.DictReader(lines, fieldnames=header)
+    for number, record in enumerate(reader, 1):
+        if full():
+            break
+        if not any((value or '').strip() for value in record.values() if isinstance(value, str)):
+            continue
+        rows.append(_make_row(
+            number, record.get('id'), record.get('data'), record.get('size'),
+            record.get('error_correction'), default_size, default_error_correction,
+        ))
+    return rows
+
+
+def _entry_name(row_id, used):
+    """Archive name for a row, unique within the archive."""
+    stem = re.sub(r'[^A-Za-z0-9._-]+', '_', row_id).strip('._') or 'qr'
+    return unique_name(stem, 'png', used)
+
+
+def _render_batch(items):
+    """
+    Pool worker entry point: render (data, size, level) tuples.
+
+    Returns:
+        List of (png bytes, None) or (None, error message) tuples
+    """
+    results = []
+    for data, size, error_correction in items:
+        try:
+            results.append((encode_qr(data, size, error_correction), None))
+        except Exception as e:
+            results.append((None, str(e) or 'QR generation error'))
+    return results
+
+
+_pool = ProcessPool()
+
+
+def _rendered(rows, workers, batch_size):
+    """
+    Yield (row, png or None, error or None) in input order.
+
+    Valid rows are sent to the pool ``batch_size`` at a time, with at most
+    ``2 * workers`` batches in flight.
+    """
+    batches = [rows[start:start + batch_size] for start in range(0, len(rows), batch_size)]
+
+    def items(batch):
+        return [(row.data, row.size, row.error_correction) for row in batch if row.error is None]
+
+    if workers <= 1 or len(batches) <= 1:
+        for batch in batches:
+            results = iter(_render_batch(items(batch)))
+            for row in batch:
+                yield (row, None, row.error) if row.error else (row, *next(results))
+        return
+
+    executor = _pool.get(workers)
+    window = 2 * workers
+    pending = deque()
+
+    def finish():
+        batch, future = pending.popleft()
+        try:
+            results = iter(future.result())
+        except BrokenProcessPool:
+            _pool.reset()
+            raise
+        for row in batch:
+            yield (row, None, row.error) if row.error else (row, *next(results))
+
+    for batch in batches:
+        pending.append((batch, executor.submit(_render_batch, items(batch))))
+        while len(pending) >= window:
+            yield from finish()
+
+    while pending:
+        yield from finish()
+
+
+def stream_zip(rows, workers=4, batch_size=32):
+    """
+    Render QR codes and stream them as a ZIP archive.
+
+    Args:
+        rows: List of QrRow objects from parse_rows()
+        workers: Number of rendering processes (1 renders in this process)
+        batch_size: Rows sent to a worker at a time
+
+    Yields:
+        Chunks of the ZIP file as bytes
+    """
+    used_names = set()
+    manifest = io.StringIO()
+    writer = csv.writer(manifest)
+    writer.writerow(['row', 'id', 'file', 'status', 'error'])
+
+    sink = ChunkSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for row, png, error in _rendered(rows, workers, batch_size):
+            if png is None:
+                writer.writerow([row.number, row.row_id, '', 'error', error])
+                continue
+
+            name = _entry_name(row.row_id, used_names)
+            archive.writestr(name, png)
+            writer.writerow([row.number, row.row_id, name, 'ok', ''])
+            yield sink.take()
+
+        archive.writestr('manifest.csv', manifest.getvalue())
+
+    yield sink.take()
@@ -0,0 +1,121 @@
+"""
+QR code rendering straight from the module matrix.
+
+The matrix from ``qrcode`` is scaled to the requested size in one NumPy
+pass: every module row and column is repeated as many times as needed to
+land exactly on ``size`` pixels. That gives the same result as resizing a
+box-rendered image with nearest-neighbour sampling, without an
+intermediate image. The bitmap is saved as a 1-bit PNG.
+
+The same links are generated again and again, so finished PNGs are kept
+in an in-memory LRU keyed by (data, size, error correction level).
+"""
+
+import io
+import threading
+
+import numpy as np
+import qrcode
+from django.conf import settings
+from PIL import Image
+
+from .cache import MemoryCache
+
+
+ERROR_CORRECTION_LEVELS = {
+    'L': qrcode.constants.ERROR_CORRECT_L,
+    'M': qrcode.constants.ERROR_CORRECT_M,
+    'Q': qrcode.constants.ERROR_CORRECT_Q,
+    'H': qrcode.constants.ERROR_CORRECT_H,
+}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_qr_cache():
+    """Get the LRU sized by settings.QR_RENDER['cache_bytes']."""
+    global _cache
+
+    with _cache_lock:
+        if _cache is None:
+            config = getattr(settings, 'QR_RENDER', {})
+            _cache = MemoryCache(config.get('cache_bytes', 8 * 1024 * 1024))
+        return _cache
+
+
+def reset_qr_cache():
+    """Drop the cache (used after settings change and in tests)."""
+    global _cache
+
+    with _cache_lock:
+        _cache = None
+
+
+def qr_matrix(data, error_correction='H', border=4):
+    """
+    Encode data as a QR module matrix.
+
+    Returns:
+        2D bool numpy array, True for dark modules, border included
+    """
+    qr = qrcode.QRCode(
+        version=None,
+        error_correction=ERROR_CORRECTION_LEVELS[error_correction],
+        border=border,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    return np.array(qr.get_matrix(), dtype=bool)
+
+
+def matrix_to_bitmap(matrix, size):
+    """
+    Scale a module matrix to exactly ``size`` x ``size`` pixels.
+
+    Module edges fall on ``round_down(i * size / modules)``, so modules
+    differ in width by at most one pixel.
+
+    Returns:
+        2D bool numpy array, True for white pixels
+    """
+    modules = matrix.shape[0]
+    edges = np.arange(modules + 1) * size // modules
+    counts = np.diff(edges)
+    return np.repeat(np.repeat(~matrix, counts, axis=0), counts, axis=1)
+
+
+def render_qr(data, size, error_correction='H'):
+    """
+    Render a QR code as a 1-bit PNG.
+
+    Args:
+        data: Text or URL to encode
+        size: Width and height of the image in pixels
+        error_correction: 'L', 'M', 'Q' or 'H'
+
+    Returns:
+        Bytes object of the PNG
+
+    Raises:
+        ValueError: If the error correction level is unknown
+    """
+    if error_correction not in ERROR_CORRECTION_LEVELS:
+        raise ValueError(f'Unknown error correction level: {error_correction}')
+
+    cache = get_qr_cache()
+    key = (data, size, error_correction)
+    png = cache.get(key)
+    if png is None:
+        png = encode_qr(data, size, error_correction)
+        cache.set(key, png)
+    return png
+
+
+def encode_qr(data, size, error_correction='H'):
+    """Render a QR code as a 1-bit PNG, without the cache."""
+    bitmap = matrix_to_bitmap(qr_matrix(data, error_correction), size)
+
+    buffer = io.BytesIO()
+    Image.fromarray(bitmap).save(buffer, format='PNG')
+    return buffer.getvalue()
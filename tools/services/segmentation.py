@@ -0,0 +1,324 @@
+"""Background segmentation service built on rembg."""
+
+import hashlib
+import io
+import logging
+import threading
+import numpy as np
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from core.constants import MB
+from .cache import TieredCache
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_MODEL = 'u2net'
+
+# Rows of the full-resolution mask produced per step by refine_mask_edges
+REFINE_BAND_ROWS = 512
+
+
+def _image_digest(image):
+    """SHA-256 of the decoded pixels, hashed in row bands to avoid a full copy."""
+    digest = hashlib.sha256(f'{image.mode}:{image.width}x{image.height}:'.encode())
+    for top in range(0, image.height, REFINE_BAND_ROWS):
+        band = image.crop((0, top, image.width, min(top + REFINE_BAND_ROWS, image.height)))
+        digest.update(band.tobytes())
+    return digest.hexdigest()
+
+
+def _box_filter(arr, radius):
+    """Mean over a (2r+1) x (2r+1) window, clamped at the borders."""
+    padded = np.pad(arr, radius + 1, mode='edge')
+    summed = padded.cumsum(axis=0).cumsum(axis=1)
+    size = 2 * radius + 1
+    window = (
+        summed[size:, size:] - summed[:-size, size:]
+        - summed[size:, :-size] + summed[:-size, :-size]
+    )
+    return window[:arr.shape[0], :arr.shape[1]] / (size * size)
+
+
+def refine_mask_edges(small_mask, small_image, image, radius=4, eps=1e-3):
+    """
+    Upsample a low-resolution mask with a fast guided filter.
+
+    The linear coefficients of the guided filter are fitted at low
+    resolution against the downscaled image, then upsampled and applied to
+    the full-resolution luminance, so mask edges snap to edges in the
+    original photo. The full-size output is produced in row bands to keep
+    peak memory low.
+
+    Args:
+        small_mask: L-mode mask at working resolution
+        small_image: Image the mask was computed from
+        image: Full-resolution PIL Image object
+        radius: Filter radius in working-resolution pixels
+        eps: Regularisation; larger values smooth more
+
+    Returns:
+        L-mode PIL Image mask at the full image size
+    """
+    guide = np.asarray(small_image.convert('L'), dtype=np.float64) / 255
+    target = np.asarray(small_mask, dtype=np.float64) / 255
+
+    mean_i = _box_filter(guide, radius)
+    mean_p = _box_filter(target, radius)
+    cov_ip = _box_filter(guide * target, radius) - mean_i * mean_p
+    var_i = _box_filter(guide * guide, radius) - mean_i * mean_i
+
+    a = cov_ip / (var_i + eps)
+    b = mean_p - a * mean_i
+    coeff_a = Image.fromarray(_box_filter(a, radius).astype(np.float32), mode='F')
+    coeff_b = Image.fromarray(_box_filter(b, radius).astype(np.float32), mode='F')
+
+    width, height = image.size
+    scale_y = small_mask.height / height
+    result = Image.new('L', image.size)
+
+    for top in range(0, height, REFINE_BAND_ROWS):
+        bottom = min(top + REFINE_BAND_ROWS, height)
+        box = (0, top * scale_y, small_mask.width, bottom * scale_y)
+        band_size = (width, bottom - top)
+
+        band_a = np.asarray(coeff_a.resize(band_size, Image.Resampling.BILINEAR, box=box))
+        band_b = np.asarray(coeff_b.resize(band_size, Image.Resampling.BILINEAR, box=box))
+        band_i = np.asarray(image.crop((0, top, width, bottom)).convert('L'), dtype=np.float32) / 255
+
+        band = np.clip(band_a * band_i + band_b, 0, 1) * 255
+        result.paste(Image.fromarray(band.astype(np.uint8), mode='L'), (0, top))
+
+    return result
+
+
+class SegmentationService:
+    """
+    Process-wide manager for rembg sessions.
+
+    Building a rembg session loads the ONNX weights from disk, which takes
+    seconds. Sessions are therefore created once per model per worker
+    process and reused by every request handled by that worker.
+    """
+
+    _sessions = {}
+    _lock = threading.Lock()
+    _mask_cache = None
+
+    @staticmethod
+    def _session_options():
+        """Build ONNX Runtime options from the SEGMENTATION settings."""
+        import onnxruntime as ort
+
+        config = getattr(settings, 'SEGMENTATION', {})
+        sess_opts = ort.SessionOptions()
+        sess_opts.intra_op_num_threads = int(config.get('intra_op_threads', 0))
+        sess_opts.inter_op_num_threads = int(config.get('inter_op_threads', 0))
+        return sess_opts
+
+    @staticmethod
+    def _create_session(model_name):
+        """
+        Create a new rembg session for a model.
+
+        The session class is instantiated directly (instead of through
+        ``rembg.new_session``) so our thread counts are used on every
+        rembg version, not only the ones that accept ``sess_opts``.
+        """
+        from rembg.sessions import sessions_class
+
+        for session_class in sessions_class:
+            if session_class.name() == model_name:
+                return session_class(model_name, SegmentationService._session_options())
+
+        raise ValueError(f'Unknown segmentation model: {model_name}')
+
+    @classmethod
+    def get_session(cls, model_name=None):
+        """
+        Get the shared session for a model, creating it on first use.
+
+        Args:
+            model_name: rembg model name (defaults to SEGMENTATION['model'])
+
+        Returns:
+            rembg session object
+        """
+        model_name = model_name or getattr(settings, 'SEGMENTATION', {}).get('model', DEFAULT_MODEL)
+
+        session = cls._sessions.get(model_name)
+        if session is None:
+            with cls._lock:
+                session = cls._sessions.get(model_name)
+                if session is None:
+                    session = cls._create_session(model_name)
+                    cls._sessions[model_name] = session
+        return session
+
+    @classmethod
+    def prewarm(cls, models=None):
+        """
+        Load sessions up front so the first request doesn't pay for it.
+
+        Args:
+            models: Model names to load (defaults to SEGMENTATION['prewarm_models'])
+        """
+        config = getattr(settings, 'SEGMENTATION', {})
+        if models is None:
+            models = config.get('prewarm_models', [config.get('model', DEFAULT_MODEL)])
+
+        for model_name in models:
+            cls.get_session(model_name)
+
+    @classmethod
+    def predict_mask(cls, image, model_name=None):
+        """
+        Compute the foreground alpha mask of an image.
+
+        When SEGMENTATION['pool_socket'] is set the mask is computed by the
+        shared inference service (see ``segmentation_pool``); otherwise by
+        this process's own session.
+
+        Args:
+            image: RGB PIL Image object
+            model_name: rembg model name
+
+        Returns:
+            L-mode PIL Image mask, same size as the image
+        """
+        config = getattr(settings, 'SEGMENTATION', {})
+        model_name = model_name or config.get('model', DEFAULT_MODEL)
+
+        if config.get('pool_socket'):
+            from .segmentation_pool import SegmentationPoolError, request_mask
+
+            try:
+                return request_mask(
+                    config['pool_socket'],
+                    config.get('pool_authkey', settings.SECRET_KEY).encode(),
+                    image,
+                    model_name,
+                    timeout=config.get('pool_timeout', 60),
+                )
+            except SegmentationPoolError:
+                if not config.get('pool_fallback', True):
+                    raise
+                logger.warning('Segmentation service unavailable, running in-process', exc_info=True)
+
+        return cls.get_session(model_name).predict(image)[0]
+
+    @classmethod
+    def compute_mask(cls, image, model_name=None, refine=None):
+        """
+        Compute a full-resolution alpha mask from a downscaled copy.
+
+        The segmentation network only looks at a small fixed-size input, so
+        inference runs on a copy no larger than SEGMENTATION['working_size']
+        and the resulting mask is upsampled back to the original size.
+
+        Args:
+            image: PIL Image object (already orientation-corrected)
+            model_name: rembg model name
+            refine: Use edge-aware upsampling (defaults to SEGMENTATION['refine_edges'])
+
+        Returns:
+            L-mode PIL Image mask, same size as the image
+        """
+        config = getattr(settings, 'SEGMENTATION', {})
+        if refine is None:
+            refine = config.get('refine_edges', False)
+        model_name = model_name or config.get('model', DEFAULT_MODEL)
+
+        if image.mode not in ('RGB', 'RGBA', 'L'):
+            image = image.convert('RGB')
+
+        working_size = config.get('working_size', 1024)
+        scale = working_size / max(image.size) if working_size else 1
+        if scale >= 1:
+            small = image.convert('RGB')
+        else:
+            small_size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+            small = image.resize(small_size, Image.Resampling.LANCZOS, reducing_gap=3.0).convert('RGB')
+
+        small_mask = None
+        cache = cls.mask_cache()
+        if cache is not None:
+            cache_key = f'mask-{model_name}-{working_size}-{_image_digest(image)}'
+            cached = cache.get(cache_key)
+            if cached is not None:
+                small_mask = Image.open(io.BytesIO(cached))
+                small_mask.load()
+
+        if small_mask is None:
+            small_mask = cls.predict_mask(small, model_name)
+            if cache is not None:
+                buffer = io.BytesIO()
+                small_mask.save(buffer, format='PNG')
+                cache.set(cache_key, buffer.getvalue())
+
+        if small_mask.size == image.size:
+            return small_mask
+        if refine:
+            return refine_mask_edges(
+                small_mask, small, image,
+                radius=config.get('refine_radius', 4),
+                eps=config.get('refine_eps', 1e-3),
+            )
+        return small_mask.resize(image.size, Image.Resampling.BICUBIC)
+
+    @classmethod
+    def mask_cache(cls):
+        """Get the process-wide mask cache, or None if disabled in MASK_CACHE."""
+        if cls._mask_cache is None:
+            config = getattr(settings, 'MASK_CACHE', {})
+            if not config.get('enabled', False):
+                return None
+            cls._mask_cache = TieredCache(
+                config.get('memory_bytes', 64 * MB),
+                disk_dir=config.get('disk_dir') or None,
+                disk_bytes=config.get('disk_bytes', 512 * MB),
+            )
+        return cls._mask_cache
+
+    @classmethod
+    def replace_background(cls, image, color, model_name=None):
+        """
+        Put the subject of an image on a solid colour background.
+
+        The mask comes from ``compute_mask``, so trying several colours on
+        the same photo only runs inference once when the mask cache is on.
+
+        Args:
+            image: PIL Image object
+            color: RGB tuple for the new background
+            model_name: rembg model name
+
+        Returns:
+            RGB PIL Image
+        """
+        image = ImageOps.exif_transpose(image)
+        mask = cls.compute_mask(image, model_name)
+
+        result = Image.new('RGB', image.size, color)
+        result.paste(image.convert('RGB'), (0, 0), mask)
+        return result
+
+    @classmethod
+    def remove_background(cls, image, model_name=None):
+        """
+        Cut the subject out of an image.
+
+        Args:
+            image: PIL Image object
+            model_name: rembg model name
+
+        Returns:
+            RGBA PIL Image with a transparent background
+        """
+        image = ImageOps.exif_transpose(image)
+        mask = cls.compute_mask(image, model_name)
+
+        empty = Image.new('RGBA', image.size, 0)
+        return Image.composite(image.convert('RGBA'), empty, mask)
@@ -0,0 +1,330 @@
+"""
+Local segmentation inference service.
+
+A small pool of worker processes owns the rembg models and answers mask
+requests from the web workers over a Unix socket. Model memory is then
+bounded by the pool size rather than by the number of gunicorn workers,
+and slow background-removal requests no longer tie up web workers that
+could be serving cheap endpoints.
+
+Concurrent requests for the same model are collected into a batch and,
+when the ONNX graph has a dynamic batch dimension, run as a single
+inference call.
+
+Every request is answered: a worker that dies is replaced and the
+requests it was working on get an error reply, and a request that isn't
+done within ``request_timeout`` seconds gets a timeout error.
+"""
+
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+import multiprocessing
+from multiprocessing.connection import Client, Listener, wait
+
+import numpy as np
+from PIL import Image
+
+from .batching import mp_context
+
+
+logger = logging.getLogger(__name__)
+
+
+# Preprocessing used by the U2-Net family of rembg sessions:
+# (mean, std, input size). Only these models are batched; every other
+# model falls back to one session.predict() call per image.
+BATCH_PROFILES = {
+    'u2net': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'u2netp': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'u2net_human_seg': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+    'silueta': ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225), (320, 320)),
+}
+
+
+class SegmentationPoolError(Exception):
+    """Raised when the inference service can't produce a mask."""
+    pass
+
+
+def _supports_batching(session):
+    """Check whether the session's first input has a dynamic batch dimension."""
+    batch_dim = session.inner_session.get_inputs()[0].shape[0]
+    return not isinstance(batch_dim, int)
+
+
+def predict_masks(session, model_name, images):
+    """
+    Predict alpha masks for several images with one session.
+
+    Args:
+        session: rembg session object
+        model_name: Name of the model the session was built for
+        images: List of RGB PIL Image objects
+
+    Returns:
+        List of L-mode mask images, one per input, at the input size
+    """
+    profile = BATCH_PROFILES.get(model_name)
+    if len(images) == 1 or profile is None or not _supports_batching(session):
+        return [session.predict(img)[0] for img in images]
+
+    mean, std, size = profile
+    inputs = [session.normalize(img, mean, std, size) for img in images]
+    input_name = next(iter(inputs[0]))
+    batch = np.concatenate([item[input_name] for item in inputs], axis=0)
+
+    preds = session.inner_session.run(None, {input_name: batch})[0][:, 0, :, :]
+
+    masks = []
+    for img, pred in zip(images, preds):
+        # Same per-image normalisation as rembg's U2netSession.predict
+        ma, mi = np.max(pred), np.min(pred)
+        pred = (pred - mi) / max(ma - mi, 1e-6)
+        mask = Image.fromarray((pred.clip(0, 1) * 255).astype('uint8'), mode='L')
+        masks.append(mask.resize(img.size, Image.Resampling.LANCZOS))
+    return masks
+
+
+def _worker_loop(tasks, results, batch_size, batch_window):
+    """Pull requests off the task queue in batches and run inference."""
+    from .segmentation import SegmentationService
+
+    running = True
+    while running:
+        task = tasks.get()
+        if task is None:
+            break
+
+        batch = [task]
+        deadline = time.monotonic() + batch_window
+        while len(batch) < batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                task = tasks.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if task is None:
+                running = False
+                break
+            batch.append(task)
+
+        # Tell the server which requests this worker holds, so it can fail
+        # them if the worker dies
+        for task in batch:
+            results.put((task[0], ('started', os.getpid())))
+
+        by_model = {}
+        for request_id, model_name, mode, size, data in batch:
+            image = Image.frombytes(mode, size, data).convert('RGB')
+            by_model.setdefault(model_name, []).append((request_id, image))
+
+        for model_name, items in by_model.items():
+            try:
+                session = SegmentationService.get_session(model_name)
+                masks = predict_masks(session, model_name, [image for _, image in items])
+            except Exception as e:
+                logger.exception('Segmentation batch failed for model %s', model_name)
+                for request_id, _ in items:
+                    results.put((request_id, ('error', str(e))))
+                continue
+
+            for (request_id, _), mask in zip(items, masks):
+                results.put((request_id, ('ok', mask.size, mask.tobytes())))
+
+
+class SegmentationServer:
+    """Unix socket front end feeding a pool of inference processes."""
+
+    def __init__(self, address, authkey, workers=2, batch_size=4, batch_window=0.01, request_timeout=60,
+                 context=None):
+        self.address = address
+        self.authkey = authkey
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.request_timeout = request_timeout
+        # Workers are restarted from the monitor thread while other threads
+        # hold locks, so they must not be forked from this process
+        self._context = context or mp_context()
+
+        self._tasks = self._context.Queue()
+        # SimpleQueue writes straight to the pipe, so a worker's 'started'
+        # notice isn't lost in a feeder thread if the worker then crashes
+        self._results = self._context.SimpleQueue()
+        self._processes = []
+        self._processes_lock = threading.Lock()
+        self._models = []
+        self._stopping = threading.Event()
+        self._pending = {}
+        # request id -> pid of the worker running it
+        self._in_flight = {}
+        self._pending_lock = threading.Lock()
+        self._ids = itertools.count()
+
+    def _spawn(self):
+        process = self._context.Process(
+            target=_prewarmed_worker,
+            args=(self._tasks, self._results, self.batch_size, self.batch_window, self._models),
+            daemon=True,
+        )
+        process.start()
+        return process
+
+    def start_workers(self, models=()):
+        """Start the inference processes, loading ``models`` in each first."""
+        self._models = list(models)
+        with self._processes_lock:
+            self._processes = [self._spawn() for _ in range(self.workers)]
+
+        threading.Thread(target=self._dispatch_results, daemon=True).start()
+        threading.Thread(target=self._monitor_workers, daemon=True).start()
+
+    def stop(self):
+        """Ask the worker processes to exit and wait for them."""
+        with self._processes_lock:
+            self._stopping.set()
+            processes, self._processes = self._processes, []
+        for _ in processes:
+            self._tasks.put(None)
+        for process in processes:
+            process.join(timeout=5)
+
+    def _monitor_workers(self, interval=1.0):
+        """Replace worker processes that died and fail their requests."""
+        while not self._stopping.is_set():
+            processes = list(self._processes)
+            wait([process.sentinel for process in processes], timeout=interval)
+            for process in processes:
+                if process.is_alive():
+                    continue
+                with self._processes_lock:
+                    # stop() may have run since the list was copied
+                    if self._stopping.is_set():
+                        return
+                    if process not in self._processes:
+                        continue
+                    logger.error('Segmentation worker %s exited with code %s; restarting it',
+                                 process.pid, process.exitcode)
+                    self._processes[self._processes.index(process)] = self._spawn()
+                self._fail_worker_requests(process.pid, 'Segmentation worker died')
+
+    def _fail_worker_requests(self, pid, message):
+        with self._pending_lock:
+            request_ids = [request_id for request_id, worker in self._in_flight.items() if worker == pid]
+            for request_id in request_ids:
+                del self._in_flight[request_id]
+                slot = self._pending.get(request_id)
+                if slot is not None:
+                    slot[1] = ('error', message)
+                    slot[0].set()
+
+    def _dispatch_results(self):
+        """Hand results from the workers back to the waiting connections."""
+        while True:
+            request_id, result = self._results.get()
+            with self._pending_lock:
+                if result[0] == 'started':
+                    self._in_flight[request_id] = result[1]
+                    continue
+                self._in_flight.pop(request_id, None)
+                slot = self._pending.get(request_id)
+            if slot is not None:
+                slot[1] = result
+                slot[0].set()
+
+    def _handle_connection(self, conn):
+        """Serve a single mask request."""
+        with conn:
+            try:
+                model_name, mode, size, data = conn.recv()
+            except (EOFError, OSError, ValueError):
+                return
+
+            request_id = next(self._ids)
+            slot = [threading.Event(), None]
+            with self._pending_lock:
+                self._pending[request_id] = slot
+
+            self._tasks.put((request_id, model_name, mode, size, data))
+            if not slot[0].wait(self.request_timeout):
+                slot[1] = ('error', 'Segmentation timed out')
+
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+                self._in_flight.pop(request_id, None)
+            try:
+                conn.send(slot[1])
+            except OSError:
+                pass
+
+    def serve_forever(self):
+        """Accept connections until interrupted."""
+        if os.path.exists(self.address):
+            os.remove(self.address)
+
+        with Listener(self.address, family='AF_UNIX', authkey=self.authkey) as listener:
+            os.chmod(self.address, 0o660)
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, multiprocessing.AuthenticationError):
+                    continue
+                threading.Thread(target=self._handle_connection, args=(conn,), daemon=True).start()
+
+
+def _prewarmed_worker(tasks, results, batch_size, batch_window, models):
+    """Worker process entry point."""
+    from .segmentation import SegmentationService
+
+    if models:
+        SegmentationService.prewarm(models)
+    _worker_loop(tasks, results, batch_size, batch_window)
+
+
+def request_mask(address, authkey, image, model_name, timeout=60):
+    """
+    Ask the inference service for an alpha mask.
+
+    Args:
+        address: Unix socket path of the service
+        authkey: Shared secret (bytes)
+        image: RGB PIL Image object
+        model_name: rembg model name
+        timeout: Seconds to wait for the result
+
+    Returns:
+        L-mode PIL Image mask at the image size
+
+    Raises:
+        SegmentationPoolError: If the service is unreachable or fails
+    """
+    # U2-Net style models only look at a fixed-size input, so resize here
+    # and keep the socket payload small.
+    profile = BATCH_PROFILES.get(model_name)
+    payload = image
+    if profile is not None:
+        payload = image.resize(profile[2], Image.Resampling.LANCZOS)
+
+    try:
+        with Client(address, family='AF_UNIX', authkey=authkey) as conn:
+            conn.send((model_name, payload.mode, payload.size, payload.tobytes()))
+            if not conn.poll(timeout):
+                raise SegmentationPoolError('Segmentation service timed out')
+            result = conn.recv()
+    except (OSError, EOFError, multiprocessing.AuthenticationError) as e:
+        raise SegmentationPoolError(f'Segmentation service unavailable: {e}')
+
+    if result[0] != 'ok':
+        raise SegmentationPoolError(result[1])
+
+    _, size, data = result
+    mask = Image.frombytes('L', size, data)
+    if mask.size != image.size:
+        mask = mask.resize(image.size, Image.Resampling.LANCZOS)
+    return mask
@@ -0,0 +1,274 @@
+"""
+Compress an image to fit a byte budget.
+
+Rather than asking for a quality number, the caller gives the largest
+file size it accepts. The highest JPEG/WebP quality that fits is found by
+bisection; when even the lowest allowed quality is too large, the image is
+also downscaled, again bisecting on the scale factor.
+
+Probe encodes run on a proxy: a copy of the image shrunk to about
+``proxy_pixels``. A proxy's size is scaled up by the pixel ratio to
+predict the full-size result, so only the final encode works on the full
+image. Small images are their own proxy and their probes are exact. The
+proxy's estimate can be off (detail is denser in a shrunk image), so when
+the full-size encode misses the budget or leaves much of it unused, the
+predictions are corrected by the measured error and the search runs
+again. Once one full-size encode fits and another doesn't (or the
+corrected predictions stop moving) while the result is still under
+``fill`` of the budget, the remaining full-size encodes bisect between
+the best setting that fits and the smallest one that doesn't. At most
+``attempts`` full-size encodes are made in all.
+"""
+
+import math
+import time
+
+from PIL import Image
+from django.core.exceptions import ValidationError
+
+from .image_processor import ImageProcessor
+
+
+# Formats the search can tune; everything else is compressed as JPEG
+LOSSY_FORMATS = ('JPEG', 'WEBP')
+
+
+class CompressionResult:
+    """
+    Output of compress_to_size and how it was found.
+
+    ``probes`` counts every encode made, on the proxy and at full size.
+    """
+
+    def __init__(self, data, output_format, quality, scale, size, probes, seconds):
+        self.data = data
+        self.output_format = output_format
+        self.quality = quality
+        self.scale = scale
+        self.size = size
+        self.probes = probes
+        self.seconds = seconds
+
+
+def _scaled_size(size, scale):
+    return max(1, round(size[0] * scale)), max(1, round(size[1] * scale))
+
+
+class _Search:
+    """Size predictions for (quality, scale) pairs, encoded on the proxy."""
+
+    def __init__(self, image, output_format, proxy_pixels):
+        self.image = image
+        self.output_format = output_format
+        self.proxy_pixels = proxy_pixels
+        self.correction = 1.0
+        # Encodes made, on the proxy and at full size
+        self.probes = 0
+        # Probes made at the final size, by (quality, size)
+        self.exact = {}
+        # Full-size estimates from the proxy, before correction
+        self.estimates = {}
+
+        proxy_scale = min(1.0, math.sqrt(proxy_pixels / (image.width * image.height)))
+        if proxy_scale < 1:
+            self.proxy = image.resize(
+                _scaled_size(image.size, proxy_scale), Image.Resampling.LANCZOS, reducing_gap=2.0,
+            )
+        else:
+            self.proxy = image
+
+    def predict(self, quality, scale):
+        """Predicted size in bytes of the full image at ``quality`` and ``scale``."""
+        key = (quality, _scaled_size(self.image.size, scale))
+        if key not in self.exact and key not in self.estimates:
+            self._probe(*key)
+        if key in self.exact:
+            return len(self.exact[key])
+        return self.estimates[key] * self.correction
+
+    def _probe(self, quality, size):
+        pixels = size[0] * size[1]
+        proxy_size = size
+        if pixels > self.proxy_pixels:
+            proxy_size = _scaled_size(size, math.sqrt(self.proxy_pixels / pixels))
+        proxy_size = (min(proxy_size[0], self.proxy.width), min(proxy_size[1], self.proxy.height))
+
+        proxy = self.proxy
+        if proxy_size != proxy.size:
+            proxy = proxy.resize(proxy_size, Image.Resampling.LANCZOS)
+
+        data = ImageProcessor.compress_image(proxy, quality, self.output_format)
+        self.probes += 1
+        if proxy_size == size:
+            self.exact[(quality, size)] = data
+        else:
+            self.estimates[(quality, size)] = len(data) * pixels / (proxy_size[0] * proxy_size[1])
+
+    def encode(self, quality, scale):
+        """Encode the full image, reusing an exact probe if there was one."""
+        size = _scaled_size(self.image.size, scale)
+        data = self.exact.get((quality, size))
+        if data is not None:
+            return data
+
+        image = self.image
+        if size != image.size:
+            image = image.resize(size, Image.Resampling.LANCZOS, reducing_gap=2.0)
+        data = ImageProcessor.compress_image(image, quality, self.output_format)
+        self.probes += 1
+        # Later predictions for this setting use the real size
+        self.exact[(quality, size)] = data
+        return data
+
+
+def _find_settings(search, max_bytes, min_quality, max_quality, min_scale, scale_precision):
+    """
+    Bisect for the best (quality, scale) predicted to fit ``max_bytes``.
+
+    Returns:
+        (quality, scale) tuple, or None if nothing fits
+    """
+    if search.predict(max_quality, 1.0) <= max_bytes:
+        return max_quality, 1.0
+
+    if search.predict(min_quality, 1.0) <= max_bytes:
+        # min_quality fits and max_quality doesn't
+        low, high = min_quality, max_quality
+        while high - low > 1:
+            middle = (low + high) // 2
+            if search.predict(middle, 1.0) <= max_bytes:
+                low = middle
+            else:
+                high = middle
+        return low, 1.0
+
+    if search.predict(min_quality, min_scale) > max_bytes:
+        return None
+
+    # Quality is at its floor; find the largest scale that fits
+    low, high = min_scale, 1.0
+    while high - low > scale_precision:
+        middle = (low + high) / 2
+        if search.predict(min_quality, middle) <= max_bytes:
+            low = middle
+        else:
+            high = middle
+    return min_quality, low
+
+
+def _order(setting):
+    """Sort key putting (quality, scale) settings in order of output size."""
+    quality, scale = setting
+    return scale, quality
+
+
+def _midpoint(fits, too_big, max_quality, scale_precision):
+    """
+    Setting halfway between one that fits and the next larger one that
+    doesn't (or the top of the range), on the axis ``fits`` is on.
+
+    Returns:
+        (quality, scale) tuple, or None if there is nothing in between
+    """
+    quality, scale = fits
+    if scale < 1.0:
+        # Quality is at its floor; see whether full size fits at all
+        # before moving the scale
+        if too_big is None or too_big[1] == 1.0 and too_big[0] > quality:
+            return quality, 1.0
+        if too_big[1] - scale <= scale_precision:
+            return None
+        return quality, (scale + too_big[1]) / 2
+
+    top = too_big[0] if too_big is not None else max_quality + 1
+    if top - quality <= 1:
+        return None
+    return (quality + top) // 2, 1.0
+
+
+def compress_to_size(image, max_bytes, output_format=None, proxy_pixels=500_000,
+                     min_quality=30, max_quality=95, min_scale=0.05,
+                     scale_precision=0.01, attempts=8, fill=0.9):
+    """
+    Compress an image to at most ``max_bytes``.
+
+    Args:
+        image: PIL Image object
+        max_bytes: Largest acceptable output size in bytes
+        output_format: 'JPEG' or 'WEBP'; defaults to WebP for WebP sources
+            and JPEG for everything else
+        proxy_pixels: Pixel count of the proxy the probes are encoded on
+        min_quality: Lowest quality tried before downscaling
+        max_quality: Highest quality tried
+        min_scale: Smallest downscale factor tried
+        scale_precision: Stop bisecting the scale once within this much
+        attempts: Full-size encodes allowed
+        fill: Stop once the output uses this fraction of the budget
+
+    Returns:
+        CompressionResult object
+
+    Raises:
+        ValidationError: If the image cannot be made small enough
+    """
+    start = time.perf_counter()
+
+    output_format = (output_format or image.format or 'JPEG').upper()
+    if output_format == 'JPG':
+        output_format = 'JPEG'
+    if output_format not in LOSSY_FORMATS:
+        output_format = 'JPEG'
+
+    image = ImageProcessor.prepare_for_format(image, output_format)
+    image.load()
+    search = _Search(image, output_format, proxy_pixels)
+
+    best = None
+    # Smallest (quality, scale) whose full-size encode was over budget
+    too_big = None
+    tried = set()
+
+    def record(quality, scale, data):
+        nonlocal best, too_big
+        tried.add((quality, scale))
+        if len(data) > max_bytes:
+            if too_big is None or _order((quality, scale)) < _order(too_big):
+                too_big = quality, scale
+        elif best is None or len(data) > len(best.data):
+            best = CompressionResult(
+                data, output_format, quality, scale, _scaled_size(image.size, scale), 0, 0,
+            )
+
+    def filled():
+        return best is not None and len(best.data) >= max_bytes * fill
+
+    # Correct the predictions until an encode fits and one doesn't
+    while len(tried) < attempts and not filled() and (best is None or too_big is None):
+        found = _find_settings(search, max_bytes, min_quality, max_quality, min_scale, scale_precision)
+        if found is None or found in tried:
+            break
+
+        quality, scale = found
+        predicted = search.predict(quality, scale)
+        data = search.encode(quality, scale)
+        record(quality, scale, data)
+
+        # Scale future predictions by how far the proxy was off, with a
+        # little margin so an overshoot lands under the budget next time
+        search.correction *= len(data) / predicted * (1.02 if len(data) > max_bytes else 1)
+
+    # Then bisect between the best setting that fits and the smallest one
+    # that doesn't on real encodes; the corrected predictions can settle
+    # well short of the budget or jump back and forth across it
+    while best is not None and len(tried) < attempts and not filled():
+        found = _midpoint((best.quality, best.scale), too_big, max_quality, scale_precision)
+        if found is None or found in tried:
+            break
+        record(*found, search.encode(*found))
+
+    if best is None:
+        raise ValidationError(f'Cannot compress this image below {max_bytes // 1024} KB')
+
+    best.probes = search.probes
+    best.seconds = time.perf_counter() - start
+    return best
@@ -0,0 +1,129 @@
+"""
+Colour-tolerance background replacement for background_changer's manual mode.
+
+Pixels whose colour is within ``tolerance`` (Euclidean RGB distance) of the
+average corner colour are painted with the new background colour. The
+image is processed in row bands and the squared distance is compared in
+integer arithmetic, so no full-frame temporaries are allocated and no
+square root is taken. Bands are processed on a thread pool (NumPy releases
+the GIL), or with a numba kernel when numba is installed.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.conf import settings
+from PIL import Image
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+_numba_kernel = None
+
+
+def _get_numba_kernel():
+    """Compile the numba kernel on first use."""
+    global _numba_kernel
+
+    if _numba_kernel is None:
+        @numba.njit(parallel=True, cache=True)
+        def kernel(band, ref_r, ref_g, ref_b, new_r, new_g, new_b, tol2):
+            for y in numba.prange(band.shape[0]):
+                for x in range(band.shape[1]):
+                    dr = np.int32(band[y, x, 0]) - ref_r
+                    dg = np.int32(band[y, x, 1]) - ref_g
+                    db = np.int32(band[y, x, 2]) - ref_b
+                    if dr * dr + dg * dg + db * db <= tol2:
+                        band[y, x, 0] = new_r
+                        band[y, x, 1] = new_g
+                        band[y, x, 2] = new_b
+
+        _numba_kernel = kernel
+    return _numba_kernel
+
+
+def _replace_band_numpy(band, reference, new_color, tol2):
+    """Replace matching pixels of one band in place using NumPy."""
+    diff = band.astype(np.int16)
+    diff -= reference
+    dist2 = np.square(diff, dtype=np.int32).sum(axis=2, dtype=np.int32)
+    band[dist2 <= tol2] = new_color
+    return band
+
+
+def estimate_background_color(image):
+    """
+    Estimate the background colour from the four corner pixels.
+
+    Args:
+        image: RGB PIL Image object
+
+    Returns:
+        Tuple (r, g, b) of ints
+    """
+    w, h = image.size
+    corners = [image.getpixel(xy) for xy in ((0, 0), (w - 1, 0), (0, h - 1), (w - 1, h - 1))]
+    return tuple(int(c) for c in np.mean(corners, axis=0).astype(int))
+
+
+def replace_background_color(image, new_color, tolerance, reference=None):
+    """
+    Paint every pixel close to the background colour with ``new_color``.
+
+    The image is modified in place.
+
+    Args:
+        image: RGB PIL Image object
+        new_color: RGB tuple for matching pixels
+        tolerance: Maximum Euclidean RGB distance from the background colour
+        reference: Background colour (defaults to the corner average)
+
+    Returns:
+        The same PIL Image object
+    """
+    if image.mode != 'RGB':
+        raise ValueError('replace_background_color expects an RGB image')
+    if tolerance < 0:
+        return image
+
+    config = getattr(settings, 'TOLERANCE_MASK', {})
+    band_rows = config.get('band_rows', 256)
+    workers = config.get('workers') or min(4, os.cpu_count() or 1)
+    use_numba = numba is not None and config.get('use_numba', True)
+
+    if reference is None:
+        reference = estimate_background_color(image)
+    tol2 = int(tolerance) ** 2
+    width, height = image.size
+
+    def process(top):
+        box = (0, top, width, min(top + band_rows, height))
+        band = np.array(image.crop(box))
+        if use_numba:
+            _get_numba_kernel()(band, *reference, *new_color, tol2)
+        else:
+            _replace_band_numpy(band, np.array(reference, dtype=np.int16), new_color, tol2)
+        return box, band
+
+    tops = list(range(0, height, band_rows))
+
+    # numba already spreads each band over all cores, and its threading
+    # layer must be driven from a single thread
+    if use_numba:
+        for top in tops:
+            box, band = process(top)
+            image.paste(Image.fromarray(band, mode='RGB'), box)
+        return image
+
+    # Submit at most ``workers`` bands at a time so only that many band
+    # copies are alive at once
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for start in range(0, len(tops), workers):
+            for box, band in executor.map(process, tops[start:start + workers]):
+                image.paste(Image.fromarray(band, mode='RGB'), box)
+
+    return image
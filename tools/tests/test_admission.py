@@ -0,0 +1,145 @@
+"""Tests for pixel-budget admission control."""
+
+import io
+import os
+import tempfile
+import zipfile
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import StreamingHttpResponse
+from django.test import RequestFactory, TestCase
+from PIL import Image
+
+from tools import admission
+from tools.admission import PixelBudget
+
+
+def make_upload(size=(100, 100)):
+    """Create an uploaded PNG."""
+    buffer = io.BytesIO()
+    Image.new('RGB', size).save(buffer, format='PNG')
+    return SimpleUploadedFile('image.png', buffer.getvalue())
+
+
+class PixelBudgetTestCase(TestCase):
+    """Test cases for PixelBudget."""
+
+    def setUp(self):
+        self.state_file = os.path.join(tempfile.mkdtemp(), 'budget')
+
+    def test_reserve_until_exhausted(self):
+        """Test that reservations are refused once the budget is used up."""
+        budget = PixelBudget(100, self.state_file)
+        first = budget.try_reserve(60)
+        second = budget.try_reserve(60)
+
+        self.assertIsNotNone(first)
+        self.assertIsNone(second)
+
+        budget.release(first)
+        self.assertIsNotNone(budget.try_reserve(60))
+
+    def test_budget_is_shared_through_state_file(self):
+        """Test that two budget objects see each other's reservations."""
+        PixelBudget(100, self.state_file).try_reserve(80)
+        self.assertIsNone(PixelBudget(100, self.state_file).try_reserve(30))
+
+    def test_dead_process_reservations_are_dropped(self):
+        """Test that reservations of exited workers don't leak."""
+        budget = PixelBudget(100, self.state_file)
+        with open(self.state_file, 'w') as f:
+            f.write('stale 999999999 100\n')
+
+        with mock.patch.object(admission, '_pid_alive', side_effect=lambda pid: pid == os.getpid()):
+            self.assertIsNotNone(budget.try_reserve(50))
+
+    def test_oversized_request_is_capped(self):
+        """Test that a request larger than the budget can run when idle."""
+        budget = PixelBudget(100, self.state_file)
+        self.assertIsNotNone(budget.try_reserve(500))
+        self.assertEqual(budget.in_use(), 100)
+
+
+class PixelBudgetAdmissionTestCase(TestCase):
+    """Test cases for the view decorator."""
+
+    def setUp(self):
+        admission._budget = PixelBudget(1000, os.path.join(tempfile.mkdtemp(), 'budget'))
+
+    def tearDown(self):
+        admission._budget = None
+
+    def test_rejects_when_budget_is_full(self):
+        """Test that a full budget returns 503 with Retry-After."""
+        admission._budget.try_reserve(1000)
+
+        with self.settings(PIXEL_BUDGET={'enabled': True, 'wait_seconds': 0, 'retry_after': 7}):
+            response = self.client.post('/id-photo-resizer/', {'image': make_upload()})
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '7')
+
+    def test_releases_after_response(self):
+        """Test that the reservation is returned after the view runs."""
+        with self.settings(PIXEL_BUDGET={'enabled': True, 'wait_seconds': 0}):
+            response = self.client.post('/id-photo-resizer/', {'image': make_upload((10, 10))})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(admission._budget.in_use(), 0)
+
+    def test_streaming_response_releases_on_close(self):
+        """Test that a streaming response holds its reservation until closed."""
+        @admission.pixel_budget_admission
+        def view(request):
+            return StreamingHttpResponse(iter([b'a', b'b']))
+
+        request = RequestFactory().post('/stream/', {'image': make_upload((10, 10))})
+        with self.settings(PIXEL_BUDGET={'enabled': True, 'wait_seconds': 0}):
+            response = view(request)
+            self.assertEqual(admission._budget.in_use(), 400)
+            self.assertEqual(b''.join(response.streaming_content), b'ab')
+            response.close()
+
+        self.assertEqual(admission._budget.in_use(), 0)
+
+    def test_pdf_reserves_one_page_at_a_time(self):
+        """Test that a PDF bigger than the free budget is admitted page by page."""
+        # Each page decodes to 400 bytes; 1200 in all, but only 400 free
+        admission._budget.try_reserve(600)
+        files = [make_upload((10, 10)) for _ in range(3)]
+
+        with self.settings(PIXEL_BUDGET={'enabled': True, 'wait_seconds': 0}, PDF_EXPORT={'workers': 1}):
+            response = self.client.post('/image-to-pdf/', {'images': files, 'page_size': 'a4'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(admission._budget.in_use(), 600)
+
+    def test_pdf_page_without_room_is_busy(self):
+        """Test that a page that can't get budget turns the request away."""
+        admission._budget.try_reserve(1000)
+
+        with self.settings(PIXEL_BUDGET={'enabled': True, 'wait_seconds': 0}, PDF_EXPORT={'workers': 1}):
+            response = self.client.post('/image-to-pdf/', {'images': [make_upload((10, 10))], 'page_size': 'a4'})
+
+        self.assertEqual(response.status_code, 503)
+
+    def test_batch_admitted_while_budget_is_partly_used(self):
+        """Test that a batch converts one image at a time within the free budget."""
+        admission._budget.try_reserve(600)
+        files = [make_upload((10, 10)) for _ in range(5)]
+
+        with self.settings(
+            PIXEL_BUDGET={'enabled': True, 'wait_seconds': 0, 'stream_wait_seconds': 5},
+            BATCH_CONVERT={'workers': 2},
+        ):
+            response = self.client.post('/format-converter/', {
+                'conversion_type': 'batch_format', 'output_format': 'PNG', 'images': files,
+            })
+            self.assertEqual(response.status_code, 200)
+            archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+
+        self.assertEqual(len(archive.namelist()), 5)
+        self.assertNotIn('errors.txt', archive.namelist())
+        self.assertEqual(admission._budget.in_use(), 600)
@@ -0,0 +1,131 @@
+"""Tests for frame-by-frame animation conversion."""
+
+import io
+import numpy as np
+from django.test import TestCase
+from PIL import Image, ImageDraw
+
+from tools.services.animation import convert_animation, is_animated
+
+
+def make_frames(count=6, size=(120, 90)):
+    """Frames of a ball moving over a transparent background."""
+    frames = []
+    for i in range(count):
+        frame = Image.new('RGBA', size, (0, 0, 0, 0))
+        draw = ImageDraw.Draw(frame)
+        draw.ellipse((i * 10, 20, i * 10 + 30, 50), fill=(255, 128, 0, 255))
+        draw.rectangle((100, 0, 119, 10), fill=(0, 200, 0, 255))
+        frames.append(frame)
+    return frames
+
+
+def save_animation(frames, format, durations):
+    buffer = io.BytesIO()
+    frames[0].save(buffer, format=format, save_all=True, append_images=frames[1:], duration=durations, loop=0)
+    buffer.seek(0)
+    return Image.open(buffer)
+
+
+def read_frames(data):
+    """Composited RGBA frames and their durations."""
+    image = Image.open(io.BytesIO(data))
+    frames = []
+    for index in range(image.n_frames):
+        image.seek(index)
+        frame = np.asarray(image.convert('RGBA'))
+        frames.append((frame, image.info.get('duration')))
+    return frames
+
+
+class ConvertAnimationTestCase(TestCase):
+    """Test cases for convert_animation."""
+
+    def setUp(self):
+        self.durations = [30, 40, 50, 60, 70, 80]
+        self.source = save_animation(make_frames(), 'PNG', self.durations)
+
+    def assertFramesEqual(self, data):
+        expected = make_frames()
+        frames = read_frames(data)
+        self.assertEqual(len(frames), len(expected))
+        for (frame, duration), source, source_duration in zip(frames, expected, self.durations):
+            source = np.asarray(source)
+            self.assertEqual(duration, source_duration)
+            np.testing.assert_array_equal(frame[..., 3], source[..., 3])
+            np.testing.assert_array_equal(frame[source[..., 3] > 0], source[source[..., 3] > 0])
+
+    def test_gif_is_lossless_for_few_colours(self):
+        """Test that GIF output reproduces every frame and duration."""
+        output = io.BytesIO()
+        self.assertEqual(convert_animation(self.source, 'GIF', output), 6)
+        self.assertFramesEqual(output.getvalue())
+
+    def test_apng_is_lossless(self):
+        """Test that APNG output reproduces every frame and duration."""
+        output = io.BytesIO()
+        self.assertEqual(convert_animation(self.source, 'PNG', output), 6)
+        self.assertFramesEqual(output.getvalue())
+
+    def test_webp_keeps_frames_and_durations(self):
+        """Test that animated WebP output keeps every frame."""
+        output = io.BytesIO()
+        convert_animation(self.source, 'WEBP', output)
+
+        image = Image.open(io.BytesIO(output.getvalue()))
+        self.assertEqual(image.format, 'WEBP')
+        self.assertEqual(image.n_frames, 6)
+        durations = []
+        for index in range(image.n_frames):
+            image.seek(index)
+            image.load()
+            durations.append(image.info['duration'])
+        self.assertEqual(durations, self.durations)
+
+    def test_webp_from_gif(self):
+        """Test that palette GIF frames convert to animated WebP."""
+        source = save_animation([frame.convert('RGB') for frame in make_frames()], 'GIF', self.durations)
+        output = io.BytesIO()
+        self.assertEqual(convert_animation(source, 'WEBP', output), 6)
+
+        image = Image.open(io.BytesIO(output.getvalue()))
+        self.assertEqual(image.n_frames, 6)
+        image.seek(5)
+        image.load()
+        self.assertEqual(image.info['duration'], 80)
+
+    def test_identical_frames_are_merged(self):
+        """Test that repeated frames become one frame with the summed duration."""
+        frames = make_frames(2)
+        source = save_animation([frames[0], frames[1], frames[1].copy()], 'PNG', [100, 200, 300])
+
+        output = io.BytesIO()
+        self.assertEqual(convert_animation(source, 'GIF', output), 2)
+        self.assertEqual([duration for _, duration in read_frames(output.getvalue())], [100, 500])
+
+    def test_unchanged_regions_are_not_reencoded(self):
+        """Test that only the changed part of a frame is stored."""
+        background = Image.effect_noise((400, 300), 64).convert('RGB')
+        frames = []
+        for i in range(5):
+            frame = background.copy()
+            ImageDraw.Draw(frame).rectangle((i * 20, 10, i * 20 + 15, 25), fill='red')
+            frames.append(frame)
+        source = save_animation(frames, 'PNG', [100] * 5)
+
+        output = io.BytesIO()
+        convert_animation(source, 'PNG', output)
+        single = io.BytesIO()
+        background.save(single, format='PNG', compress_level=9)
+        # Four more frames add far less than four more full images
+        self.assertLess(output.tell(), single.tell() * 1.5)
+
+    def test_rejects_format_without_animation(self):
+        """Test that formats that can't store frames are refused."""
+        with self.assertRaises(ValueError):
+            convert_animation(self.source, 'JPEG', io.BytesIO())
+
+    def test_is_animated(self):
+        """Test detection of multi-frame images."""
+        self.assertTrue(is_animated(self.source))
+        self.assertFalse(is_animated(Image.new('RGB', (10, 10))))
@@ -0,0 +1,198 @@
+"""Tests for the content-deduplicated upload store."""
+
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from tools import blob_store, reaper, renditions
+from tools.models import ImageBlob, ImageLink
+
+
+def png_bytes(color=(10, 120, 200)):
+    buffer = io.BytesIO()
+    Image.new('RGB', (600, 400), color).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class BlobStoreTestCase(TestCase):
+    """Test cases for storing and releasing blobs."""
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            BLOB_STORE={'key': 'test-key'},
+            RENDITIONS={'widths': (320,), 'quality': 80, 'lock_timeout': 5},
+            REAPER={'lock_file': os.path.join(self.media_root, 'reaper.lock')},
+        )
+        self.settings_override.enable()
+        self.storage = ImageLink._meta.get_field('image').storage
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def make_link(self, content, expires_in=timedelta(hours=1)):
+        return ImageLink.objects.create(
+            image=blob_store.store(SimpleUploadedFile('photo.PNG', content)),
+            original_filename='photo.png',
+            expires_at=timezone.now() + expires_in,
+        )
+
+    def test_name_is_keyed_hash(self):
+        """Test that the name doesn't reveal the plain content hash."""
+        content = png_bytes()
+        link = self.make_link(content)
+
+        self.assertTrue(link.image.name.startswith('temp_images/'))
+        self.assertTrue(link.image.name.endswith('.png'))
+        self.assertNotIn(hashlib.sha256(content).hexdigest(), link.image.name)
+        with override_settings(BLOB_STORE={'key': 'other-key'}):
+            other = blob_store.content_key(SimpleUploadedFile('x.png', content))
+        self.assertNotIn(other, link.image.name)
+
+    def test_duplicates_share_one_file(self):
+        content = png_bytes()
+        first = self.make_link(content)
+
+        with mock.patch.object(blob_store, '_write', wraps=blob_store._write) as write:
+            second = self.make_link(content)
+
+        self.assertEqual(first.image.name, second.image.name)
+        write.assert_not_called()
+        self.assertEqual(ImageBlob.objects.get().refcount, 2)
+        self.assertEqual(len(os.listdir(os.path.join(self.media_root, 'temp_images'))), 1)
+
+    def test_different_content_gets_different_files(self):
+        first = self.make_link(png_bytes())
+        second = self.make_link(png_bytes((1, 2, 3)))
+
+        self.assertNotEqual(first.image.name, second.image.name)
+        self.assertEqual(ImageBlob.objects.count(), 2)
+
+    def test_file_deleted_with_last_reference(self):
+        """Test that the file and its renditions go with the last link only."""
+        content = png_bytes()
+        first = self.make_link(content)
+        second = self.make_link(content)
+        path = first.image.path
+        rendition = self.storage.path(renditions.ensure_rendition(self.storage, first.image.name, 320, 'webp'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(ImageBlob.objects.get().refcount, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(rendition))
+        self.assertFalse(ImageBlob.objects.exists())
+
+    def test_missing_file_is_rewritten(self):
+        content = png_bytes()
+        link = self.make_link(content)
+        os.remove(link.image.path)
+
+        self.make_link(content)
+        self.assertTrue(os.path.exists(link.image.path))
+
+    def test_legacy_file_without_blob_is_deleted(self):
+        link = ImageLink.objects.create(
+            image=SimpleUploadedFile('old.png', png_bytes()),
+            original_filename='old.png',
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        path = link.image.path
+
+        with self.captureOnCommitCallbacks(execute=True):
+            link.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_double_delete_releases_once(self):
+        """Test that two requests deleting the same link release it once."""
+        content = png_bytes()
+        link = self.make_link(content)
+        live = self.make_link(content)
+        first_copy = ImageLink.objects.get(pk=link.pk)
+        second_copy = ImageLink.objects.get(pk=link.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first_copy.delete()
+            second_copy.delete()
+
+        self.assertEqual(ImageBlob.objects.get().refcount, 1)
+        self.assertTrue(os.path.exists(live.image.path))
+
+    def test_queryset_delete_releases(self):
+        """Test that bulk and admin deletes release their references."""
+        content = png_bytes()
+        links = [self.make_link(content) for _ in range(3)]
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ImageLink.objects.filter(pk__in=[link.pk for link in links[:2]]).delete()
+        self.assertEqual(ImageBlob.objects.get().refcount, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ImageLink.objects.all().delete()
+        self.assertFalse(ImageBlob.objects.exists())
+        self.assertFalse(os.path.exists(links[0].image.path))
+
+    def test_file_kept_when_delete_rolls_back(self):
+        link = self.make_link(png_bytes())
+
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                link.delete()
+                raise RuntimeError
+
+        self.assertTrue(os.path.exists(link.image.path))
+        self.assertEqual(ImageBlob.objects.get().refcount, 1)
+
+    def test_reaper_skips_rows_deleted_meanwhile(self):
+        """Test that a row a view deleted after the reaper selected it isn't released again."""
+        content = png_bytes()
+        expired = self.make_link(content, expires_in=timedelta(hours=-1))
+        live = self.make_link(content)
+        manual_release = blob_store.manual_release
+
+        @contextmanager
+        def view_deletes_first():
+            # Runs between the reaper's select and its locked re-read
+            ImageLink.objects.get(pk=expired.pk).delete()
+            with manual_release():
+                yield
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with mock.patch.object(blob_store, 'manual_release', view_deletes_first):
+                stats = reaper.reap_expired()
+
+        self.assertEqual(stats.rows, 0)
+        self.assertEqual(ImageBlob.objects.get().refcount, 1)
+        self.assertTrue(os.path.exists(live.image.path))
+
+    def test_upload_view_deduplicates(self):
+        content = png_bytes()
+        names = []
+        for _ in range(3):
+            response = self.client.post('/image-link-generator/', {
+                'image': SimpleUploadedFile('photo.png', content, content_type='image/png'),
+                'expiry_duration': '1h',
+            })
+            self.assertEqual(response.status_code, 200)
+            names.append(ImageLink.objects.get(link_id=response.json()['link_id']).image.name)
+
+        self.assertEqual(len(set(names)), 1)
+        self.assertEqual(ImageBlob.objects.get().refcount, 3)
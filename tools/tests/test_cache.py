@@ -0,0 +1,72 @@
+"""Tests for the byte-size bounded caches."""
+
+import os
+import tempfile
+import time
+from django.test import TestCase
+
+from tools.services.cache import DiskCache, MemoryCache, TieredCache
+
+
+class MemoryCacheTestCase(TestCase):
+    """Test cases for MemoryCache."""
+
+    def test_evicts_least_recently_used(self):
+        """Test that the oldest untouched entry is dropped first."""
+        cache = MemoryCache(max_bytes=10)
+        cache.set('a', b'1234')
+        cache.set('b', b'1234')
+        cache.get('a')
+        cache.set('c', b'1234')
+
+        self.assertEqual(cache.get('a'), b'1234')
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.size, 8)
+
+    def test_oversized_values_are_skipped(self):
+        """Test that a value larger than the cache is not stored."""
+        cache = MemoryCache(max_bytes=4)
+        cache.set('a', b'12345')
+        self.assertIsNone(cache.get('a'))
+
+
+class DiskCacheTestCase(TestCase):
+    """Test cases for DiskCache."""
+
+    def test_evict_removes_oldest_files(self):
+        """Test that eviction keeps the directory under its byte limit."""
+        directory = tempfile.mkdtemp()
+        cache = DiskCache(directory, max_bytes=10)
+        cache.set('old', b'123456')
+        past = time.time() - 60
+        os.utime(os.path.join(directory, 'old'), (past, past))
+        cache.set('new', b'123456')
+        cache.evict()
+
+        self.assertIsNone(cache.get('old'))
+        self.assertEqual(cache.get('new'), b'123456')
+
+    def test_expired_files_are_removed(self):
+        """Test that files unused for longer than max_age are dropped."""
+        directory = tempfile.mkdtemp()
+        cache = DiskCache(directory, max_bytes=1024, max_age=30)
+        cache.set('stale', b'123')
+        past = time.time() - 60
+        os.utime(os.path.join(directory, 'stale'), (past, past))
+
+        self.assertIsNone(cache.get('stale'))
+        cache.evict()
+        self.assertFalse(os.path.exists(os.path.join(directory, 'stale')))
+
+
+class TieredCacheTestCase(TestCase):
+    """Test cases for TieredCache."""
+
+    def test_disk_hits_are_promoted(self):
+        """Test that a value found on disk is copied into memory."""
+        directory = tempfile.mkdtemp()
+        DiskCache(directory, 1024).set('key', b'value')
+
+        cache = TieredCache(1024, disk_dir=directory, disk_bytes=1024)
+        self.assertEqual(cache.get('key'), b'value')
+        self.assertEqual(cache.memory.get('key'), b'value')
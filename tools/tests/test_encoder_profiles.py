@@ -0,0 +1,49 @@
+"""Tests for the encoder profiles."""
+
+import io
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+from PIL import Image
+
+from tools.services.encoder_profiles import (
+    ENCODER_PROFILES, PROFILES, encoder_options, recommend_profiles,
+)
+from tools.services.image_processor import ImageProcessor
+
+
+class EncoderProfilesTestCase(TestCase):
+    """Test cases for encoder profile selection."""
+
+    def test_every_supported_format_has_every_profile(self):
+        """Test that each supported format resolves under each profile."""
+        for output_format in ImageProcessor.SUPPORTED_FORMATS:
+            for profile in PROFILES:
+                self.assertIsInstance(encoder_options(output_format, profile), dict)
+        self.assertEqual(encoder_options('JPG', 'fast'), ENCODER_PROFILES['fast']['JPEG'])
+
+    def test_unknown_profile(self):
+        """Test that an unknown profile name is rejected."""
+        with self.assertRaises(ValueError):
+            encoder_options('PNG', 'tiny')
+        with self.assertRaises(ValidationError):
+            ImageProcessor.convert_format(Image.new('RGB', (8, 8)), 'PNG', profile='tiny')
+
+    def test_smallest_png_is_not_larger(self):
+        """Test that the smallest PNG profile beats the fast one."""
+        img = Image.linear_gradient('L').convert('RGB')
+        fast = ImageProcessor.convert_format(img, 'PNG', profile='fast')
+        smallest = ImageProcessor.convert_format(img, 'PNG', profile='smallest')
+
+        self.assertLessEqual(len(smallest), len(fast))
+        self.assertEqual(Image.open(io.BytesIO(smallest)).tobytes(), img.tobytes())
+
+    def test_recommend_prefers_lowest_effort(self):
+        """Test that ties go to the cheaper profile."""
+        results = {
+            'PNG': {
+                'fast': {'seconds': 0.3, 'bytes': 200},
+                'balanced': {'seconds': 0.2, 'bytes': 101},
+                'smallest': {'seconds': 0.5, 'bytes': 100},
+            },
+        }
+        self.assertEqual(recommend_profiles(results), {'PNG': 'balanced'})
@@ -0,0 +1,131 @@
+"""Tests for serving shared image files."""
+
+import hashlib
+import shutil
+import tempfile
+from datetime import timedelta
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from django.utils.http import http_date
+
+from tools.file_serving import parse_range
+from tools.models import ImageLink
+
+
+CONTENT = bytes(range(256)) * 40
+
+
+class ParseRangeTestCase(TestCase):
+    """Test cases for Range header parsing."""
+
+    def test_ranges(self):
+        """Test closed, open, suffix, multiple and unsatisfiable ranges."""
+        self.assertEqual(parse_range('bytes=0-99', 1000), (0, 99))
+        self.assertEqual(parse_range('bytes=900-', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=900-5000', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-100', 1000), (900, 999))
+        self.assertEqual(parse_range('bytes=-5000', 1000), (0, 999))
+        self.assertIsNone(parse_range(None, 1000))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 1000))
+        self.assertIsNone(parse_range('items=0-1', 1000))
+        self.assertIs(parse_range('bytes=1000-', 1000), False)
+        self.assertIs(parse_range('bytes=5-1', 1000), False)
+        self.assertIs(parse_range('bytes=-0', 1000), False)
+
+
+class SharedImageFileTestCase(TestCase):
+    """Test cases for the shared_image_file view."""
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_SERVING={})
+        self.settings_override.enable()
+        self.link = ImageLink.objects.create(
+            image=SimpleUploadedFile('photo.png', CONTENT),
+            original_filename='photo.png',
+            expires_at=timezone.now() + timedelta(hours=1),
+        )
+        self.url = f'/shared-image/{self.link.link_id}/'
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def test_full_response_with_validators(self):
+        """Test that the file is served with a content-hash ETag and cache lifetime."""
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(response['ETag'], f'"{hashlib.sha256(CONTENT).hexdigest()}"')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('Last-Modified', response)
+        max_age = int(response['Cache-Control'].split('max-age=')[1])
+        self.assertTrue(3500 < max_age <= 3600)
+        self.assertTrue(response['Content-Disposition'].startswith('inline'))
+
+    def test_download_is_attachment(self):
+        response = self.client.get(self.url + '?download=1')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="photo.png"')
+
+    def test_if_none_match_returns_304(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+
+    def test_if_modified_since_returns_304(self):
+        last_modified = self.client.get(self.url)['Last-Modified']
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        stale = http_date(timezone.now().timestamp() - 86400)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=stale).status_code, 200)
+
+    def test_byte_range(self):
+        """Test that a single range is answered with 206 and only those bytes."""
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(b''.join(response.streaming_content), CONTENT[100:200])
+        self.assertEqual(response['Content-Length'], '100')
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(CONTENT)}')
+
+    def test_if_range_mismatch_sends_whole_file(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), CONTENT)
+
+    def test_unsatisfiable_range(self):
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(CONTENT)}-')
+
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(CONTENT)}')
+
+    def test_x_accel_redirect(self):
+        """Test that the transfer is handed to nginx when configured."""
+        with override_settings(MEDIA_SERVING={'offload': 'x-accel-redirect', 'accel_prefix': '/protected/'}):
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected/{self.link.image.name}')
+        self.assertIn('ETag', response)
+
+    def test_expired_link_is_gone(self):
+        ImageLink.objects.filter(pk=self.link.pk).update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.client.get(self.url).status_code, 410)
+
+    def test_unknown_link_is_404(self):
+        self.assertEqual(self.client.get('/shared-image/missing/').status_code, 404)
+
+    def test_share_page_uses_serving_view(self):
+        response = self.client.get(f'/view-image/{self.link.link_id}/')
+        self.assertContains(response, f'src="{self.url}"')
@@ -4,6 +4,8 @@ from django.test import TestCase
 from PIL import Image
 import io
 
+from tools.services.image_processor import ImageProcessor
+
 
 class ImageProcessorTestCase(TestCase):
     """Test cases for ImageProcessor service."""
@@ -36,3 +38,27 @@ class ImageProcessorTestCase(TestCase):
         """Test image format conversion."""
         # Test implementation here
         pass
+    
+    def test_open_for_target_size_jpeg_draft(self):
+        """Test that JPEGs are DCT-scaled close to the target size."""
+        img = ImageProcessor.open_for_target_size(
+            self.create_test_image(4000, 3000, format='JPEG'), (300, 200)
+        )
+        
+        self.assertEqual(img.size, (1000, 750))
+    
+    def test_open_for_target_size_png_reduce(self):
+        """Test that non-JPEG images are reduced but stay above the target."""
+        img = ImageProcessor.open_for_target_size(
+            self.create_test_image(3000, 2000, format='PNG'), (300, 200)
+        )
+        
+        self.assertLess(img.width, 3000)
+        self.assertGreaterEqual(img.width, 600)
+        self.assertGreaterEqual(img.height, 400)
+    
+    def test_open_for_target_size_small_source(self):
+        """Test that images already near the target are left alone."""
+        img = ImageProcessor.open_for_target_size(self.create_test_image(500, 400), (300, 200))
+        
+        self.assertEqual(img.size, (500, 400))
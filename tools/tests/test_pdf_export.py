@@ -0,0 +1,78 @@
+"""Tests for the page-at-a-time PDF writer."""
+
+import io
+from django.test import TestCase, override_settings
+from PIL import Image, PdfParser
+
+from tools.security import ValidatedImage
+from tools.services.pdf_export import PdfWriter, render_page, render_pages
+
+
+def make_upload(size=(400, 300), format='JPEG', mode='RGB'):
+    """Create a validated upload backed by an in-memory file."""
+    buffer = io.BytesIO()
+    Image.new(mode, size, color=128 if mode == 'L' else 'blue').save(buffer, format=format)
+    buffer.seek(0)
+    return ValidatedImage(buffer, Image.open(buffer))
+
+
+class PdfWriterTestCase(TestCase):
+    """Test cases for PdfWriter."""
+
+    def test_pages_are_readable(self):
+        """Test that the written file has a valid page tree and xref table."""
+        output = io.BytesIO()
+        writer = PdfWriter(output)
+        writer.add_page(render_page(make_upload(), 0, 'a4', (595.27, 841.89)))
+        writer.add_page(render_page(make_upload(format='PNG'), 90, 'letter', (612, 792)))
+        writer.add_page(render_page(make_upload(mode='L'), 0, 'original', (612, 792)))
+        writer.close()
+
+        pdf = PdfParser.PdfParser(buf=output.getvalue())
+        self.assertEqual(len(pdf.pages), 3)
+        self.assertEqual(writer.page_count, 3)
+
+        media_boxes = [pdf.read_indirect(ref)[b'MediaBox'] for ref in pdf.pages]
+        self.assertEqual(media_boxes[2], [0, 0, 400, 300])
+
+
+class RenderPageTestCase(TestCase):
+    """Test cases for render_page."""
+
+    def test_jpeg_passthrough_is_not_decoded(self):
+        """Test that an unrotated JPEG is embedded from its original bytes."""
+        upload = make_upload()
+        page = render_page(upload, 0, 'a4', (595.27, 841.89))
+
+        self.assertEqual(page.data, upload.file.getvalue())
+        self.assertEqual(page.image_size, (400, 300))
+        self.assertIsNone(upload.image._im)
+
+    def test_rotated_page_is_fitted(self):
+        """Test that a rotated page is re-encoded at the fitted size."""
+        page = render_page(make_upload(), 90, 'a4', (595.27, 841.89))
+
+        self.assertEqual(page.mode, 'RGB')
+        self.assertEqual(Image.open(io.BytesIO(page.data)).format, 'JPEG')
+        self.assertEqual(page.image_size, page.draw_size)
+        self.assertLess(page.draw_size[0], page.draw_size[1])
+
+
+class RenderPagesTestCase(TestCase):
+    """Test cases for render_pages."""
+
+    def render(self, workers):
+        uploads = [make_upload(), make_upload(format='PNG'), make_upload((300, 500), 'PNG'), make_upload(mode='L')]
+        rotations = [0, 90, 0, 180]
+        with override_settings(PDF_EXPORT={'workers': workers}):
+            return list(render_pages(uploads, rotations, 'a4', (595.27, 841.89)))
+
+    def test_pool_matches_serial(self):
+        """Test that pages rendered on the pool come back in upload order."""
+        serial = self.render(workers=1)
+        pooled = self.render(workers=2)
+
+        self.assertEqual(len(pooled), 4)
+        for a, b in zip(serial, pooled):
+            self.assertEqual(a.data, b.data)
+            self.assertEqual(a.draw_size, b.draw_size)
@@ -0,0 +1,95 @@
+"""Tests for the PNG optimiser."""
+
+import io
+import numpy as np
+from django.test import TestCase
+from PIL import Image, ImageDraw, PngImagePlugin
+
+from tools.services import ImageProcessor
+from tools.services.png_optimizer import optimize_png, reduce_losslessly
+
+
+def make_graphic(mode='RGBA'):
+    """A flat graphic with text on a transparent background."""
+    image = Image.new(mode, (400, 300), (0, 0, 0, 0) if mode == 'RGBA' else 'white')
+    draw = ImageDraw.Draw(image)
+    draw.rounded_rectangle((20, 20, 380, 280), 20, fill=(240, 240, 250, 255))
+    for row in range(8):
+        draw.text((40, 40 + row * 28), f'Settings item {row}', fill=(20, 20, 90, 255))
+    return image
+
+
+def pixels(data):
+    return np.asarray(Image.open(io.BytesIO(data)).convert('RGBA'))
+
+
+class OptimizePngTestCase(TestCase):
+    """Test cases for optimize_png."""
+
+    def test_lossless_keeps_pixels_and_alpha(self):
+        """Test that the lossless path changes no pixel, transparency included."""
+        image = make_graphic()
+        data = optimize_png(image)
+
+        np.testing.assert_array_equal(pixels(data), np.asarray(image))
+
+    def test_smaller_than_plain_save(self):
+        """Test that the optimised file is smaller than Pillow's default save."""
+        image = make_graphic()
+        plain = io.BytesIO()
+        image.save(plain, format='PNG')
+
+        self.assertLess(len(optimize_png(image)), plain.tell() * 0.5)
+
+    def test_metadata_is_stripped(self):
+        """Test that text chunks are dropped."""
+        info = PngImagePlugin.PngInfo()
+        info.add_text('Comment', 'x' * 5000)
+        buffer = io.BytesIO()
+        make_graphic().save(buffer, format='PNG', pnginfo=info)
+        buffer.seek(0)
+
+        self.assertNotIn('Comment', Image.open(io.BytesIO(optimize_png(Image.open(buffer)))).info)
+
+    def test_palette_keeps_alpha(self):
+        """Test that quantising keeps transparent pixels transparent."""
+        image = make_graphic()
+        # Enough colours that an exact palette isn't possible
+        noise = Image.effect_noise(image.size, 30).convert('RGB')
+        image = Image.composite(Image.merge('RGBA', (*noise.split(), image.getchannel('A'))), image, image.getchannel('A'))
+
+        data = optimize_png(image, palette=True, colors=64, method='median_cut', dither=False)
+        result = pixels(data)
+
+        self.assertEqual(Image.open(io.BytesIO(data)).mode, 'P')
+        np.testing.assert_array_equal(result[..., 3] == 0, np.asarray(image)[..., 3] == 0)
+
+
+class ReduceLosslesslyTestCase(TestCase):
+    """Test cases for reduce_losslessly."""
+
+    def test_opaque_rgba_few_colours_becomes_palette(self):
+        """Test that a few-colour opaque image becomes a palette without tRNS."""
+        image, options = reduce_losslessly(make_graphic('RGB').convert('RGBA'))
+
+        self.assertEqual(image.mode, 'P')
+        self.assertNotIn('transparency', options)
+
+    def test_grey_rgb_becomes_greyscale(self):
+        """Test that grey pixels stored as RGB are reduced to L."""
+        grey = Image.linear_gradient('L').resize((256, 64)).convert('RGB')
+        self.assertEqual(reduce_losslessly(grey)[0].mode, 'L')
+
+    def test_photo_is_left_alone(self):
+        """Test that an image with many colours keeps its colour type."""
+        photo = Image.merge('RGB', [Image.effect_noise((64, 64), 60) for _ in range(3)])
+        self.assertEqual(reduce_losslessly(photo)[0].mode, 'RGB')
+
+    def test_compress_image_keeps_png(self):
+        """Test that compress_image no longer turns PNGs into JPEGs."""
+        image = make_graphic()
+        image.format = 'PNG'
+        data = ImageProcessor.compress_image(image, 50)
+
+        self.assertEqual(Image.open(io.BytesIO(data)).format, 'PNG')
+        np.testing.assert_array_equal(pixels(data), np.asarray(make_graphic()))
@@ -0,0 +1,90 @@
+"""Tests for bulk QR code generation."""
+
+import csv
+import io
+import zipfile
+from django.test import TestCase
+from PIL import Image
+
+from tools.services import qr_bulk
+from tools.services.qr_bulk import parse_rows, stream_zip
+
+
+def read_zip(chunks):
+    archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+    manifest = list(csv.DictReader(io.StringIO(archive.read('manifest.csv').decode())))
+    return archive, manifest
+
+
+class ParseRowsTestCase(TestCase):
+    """Test cases for parse_rows."""
+
+    def test_plain_lines(self):
+        """Test that each non-empty line is a payload, commas included."""
+        rows = parse_rows('https://a.example/?x=1,2\n\nhttps://b.example\n', 250, 'M')
+
+        self.assertEqual([row.data for row in rows], ['https://a.example/?x=1,2', 'https://b.example'])
+        self.assertEqual([row.row_id for row in rows], ['1', '2'])
+        self.assertEqual({(row.size, row.error_correction) for row in rows}, {(250, 'M')})
+
+    def test_csv_with_overrides(self):
+        """Test per-row size and error correction and row validation."""
+        rows = parse_rows(
+            'id,data,size,error_correction\n'
+            'promo-1,https://a.example,400,l\n'
+            'promo-2,https://b.example,,\n'
+            'promo-3,,300,H\n'
+            'promo-4,https://c.example,5000,H\n'
+            'promo-5,https://d.example,300,Z\n'
+        )
+
+        self.assertEqual((rows[0].row_id, rows[0].size, rows[0].error_correction), ('promo-1', 400, 'L'))
+        self.assertEqual((rows[1].size, rows[1].error_correction), (300, 'H'))
+        self.assertIsNone(rows[0].error)
+        self.assertIsNone(rows[1].error)
+        self.assertEqual([bool(row.error) for row in rows[2:]], [True, True, True])
+
+
+    def test_stops_after_max_rows(self):
+        """Test that parsing stops one row past max_rows, in both formats."""
+        lines = '\n'.join(f'https://{n}.example' for n in range(100))
+        self.assertEqual(len(parse_rows(lines, max_rows=5)), 6)
+        self.assertEqual(len(parse_rows('data\n' + lines, max_rows=5)), 6)
+        self.assertEqual(len(parse_rows(lines, max_rows=500)), 100)
+
+
+class StreamZipTestCase(TestCase):
+    """Test cases for stream_zip."""
+
+    def test_codes_named_by_row_id_with_manifest(self):
+        """Test that codes are named by id and bad rows only show up in the manifest."""
+        rows = parse_rows('id,data,size\nfirst,https://a.example,200\nbad,,200\nthird,https://c.example,\n')
+        archive, manifest = read_zip(stream_zip(rows, workers=1))
+
+        self.assertEqual(sorted(archive.namelist()), ['first.png', 'manifest.csv', 'third.png'])
+        self.assertEqual(Image.open(archive.open('first.png')).size, (200, 200))
+        self.assertEqual([entry['status'] for entry in manifest], ['ok', 'error', 'ok'])
+        self.assertEqual(manifest[1]['id'], 'bad')
+
+    def test_process_pool_keeps_order(self):
+        """Test rendering in worker processes across several batches."""
+        rows = parse_rows('\n'.join(f'https://example.com/{n}' for n in range(25)))
+        # Too much data for a QR code fails in the worker, not the batch
+        rows[3].data = 'x' * 1999
+
+        archive, manifest = read_zip(stream_zip(rows, workers=2, batch_size=4))
+
+        self.assertEqual([entry['row'] for entry in manifest], [str(n) for n in range(1, 26)])
+        self.assertEqual(manifest[3]['status'], 'error')
+        self.assertEqual(len(archive.namelist()), 25)
+
+    def test_pool_does_not_fork(self):
+        """Test that pool workers are not forked from the threaded server process."""
+        executor = qr_bulk._pool.get(1)
+        self.assertNotEqual(executor._mp_context.get_start_method(), 'fork')
+
+    def test_duplicate_ids_get_unique_names(self):
+        """Test that repeated ids don't overwrite each other."""
+        rows = parse_rows('id,data\nsame,a\nsame,b\n')
+        archive, _ = read_zip(stream_zip(rows, workers=1))
+        self.assertEqual(sorted(archive.namelist()), ['manifest.csv', 'same (1).png', 'same.png'])
@@ -0,0 +1,58 @@
+"""Tests for matrix-based QR rendering."""
+
+import io
+import numpy as np
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from tools.services import qr_render
+
+
+class QrRenderTestCase(TestCase):
+    """Test cases for qr_render."""
+
+    def setUp(self):
+        qr_render.reset_qr_cache()
+
+    def tearDown(self):
+        qr_render.reset_qr_cache()
+
+    def test_exact_size_one_bit_png(self):
+        """Test that the PNG is 1-bit and exactly the requested size."""
+        for size in (100, 333, 1000):
+            image = Image.open(io.BytesIO(qr_render.render_qr('https://example.com', size)))
+            self.assertEqual(image.format, 'PNG')
+            self.assertEqual(image.mode, '1')
+            self.assertEqual(image.size, (size, size))
+
+    def test_bitmap_matches_matrix(self):
+        """Test that every module is drawn as a solid block of its colour."""
+        matrix = qr_render.qr_matrix('hello', 'M')
+        modules = matrix.shape[0]
+        bitmap = qr_render.matrix_to_bitmap(matrix, modules * 7)
+
+        np.testing.assert_array_equal(bitmap[::7, ::7], ~matrix)
+        np.testing.assert_array_equal(bitmap[6::7, 6::7], ~matrix)
+
+    def test_error_correction_changes_code(self):
+        """Test that a higher level needs more modules."""
+        low = qr_render.qr_matrix('https://example.com/a/long/path', 'L')
+        high = qr_render.qr_matrix('https://example.com/a/long/path', 'H')
+        self.assertGreater(high.shape[0], low.shape[0])
+
+    def test_repeated_requests_hit_cache(self):
+        """Test that the same (data, size, level) is only rendered once."""
+        first = qr_render.render_qr('popular', 300, 'H')
+        self.assertIs(qr_render.render_qr('popular', 300, 'H'), first)
+        self.assertIsNot(qr_render.render_qr('popular', 300, 'L'), first)
+
+    @override_settings(QR_RENDER={'cache_bytes': 0})
+    def test_cache_can_be_disabled(self):
+        """Test that a zero-sized cache stores nothing."""
+        first = qr_render.render_qr('popular', 300)
+        self.assertIsNot(qr_render.render_qr('popular', 300), first)
+
+    def test_unknown_level(self):
+        """Test that an unknown error correction level is refused."""
+        with self.assertRaises(ValueError):
+            qr_render.render_qr('x', 300, 'Z')
@@ -0,0 +1,124 @@
+"""Tests for the expired link reaper."""
+
+import io
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from tools import reaper
+from tools.models import ImageLink
+
+
+class ReaperTestCase(TestCase):
+    """Test cases for reap_expired and sweep_orphans."""
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            REAPER={'lock_file': os.path.join(self.media_root, 'reaper.lock')},
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def make_link(self, expires_in):
+        return ImageLink.objects.create(
+            image=SimpleUploadedFile('photo.png', b'not really a png'),
+            original_filename='photo.png',
+            expires_at=timezone.now() + expires_in,
+        )
+
+    def test_reaps_expired_rows_and_files_in_chunks(self):
+        """Test that only expired links are deleted, files included."""
+        expired = [self.make_link(timedelta(hours=-1)) for _ in range(5)]
+        live = self.make_link(timedelta(hours=1))
+        chunks = []
+
+        with self.captureOnCommitCallbacks(execute=True):
+            stats = reaper.reap_expired(chunk_size=2, workers=2, progress=lambda s: chunks.append(s.rows))
+
+        self.assertEqual(stats.rows, 5)
+        self.assertEqual(stats.files, 5)
+        self.assertEqual(chunks, [2, 4, 5])
+        self.assertEqual(list(ImageLink.objects.all()), [live])
+        for link in expired:
+            self.assertFalse(os.path.exists(link.image.path))
+        self.assertTrue(os.path.exists(live.image.path))
+
+    def test_sweeps_old_orphans_only(self):
+        """Test that unreferenced files are removed once they're old enough."""
+        live = self.make_link(timedelta(hours=1))
+        directory = os.path.dirname(live.image.path)
+        old_orphan = os.path.join(directory, 'old.png')
+        new_orphan = os.path.join(directory, 'new.png')
+        for path in (old_orphan, new_orphan):
+            with open(path, 'wb') as f:
+                f.write(b'x')
+        past = time.time() - 7200
+        os.utime(old_orphan, (past, past))
+        os.utime(live.image.path, (past, past))
+
+        stats = reaper.sweep_orphans(min_age=3600)
+
+        self.assertEqual(stats.orphans, 1)
+        self.assertFalse(os.path.exists(old_orphan))
+        self.assertTrue(os.path.exists(new_orphan))
+        self.assertTrue(os.path.exists(live.image.path))
+
+    def test_missing_file_does_not_stop_reaping(self):
+        """Test that a row whose file is already gone is still deleted."""
+        link = self.make_link(timedelta(hours=-1))
+        os.remove(link.image.path)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reaper.reap_expired().rows, 1)
+        self.assertFalse(ImageLink.objects.exists())
+
+    def test_management_command(self):
+        """Test the command end to end and its summary line."""
+        link = self.make_link(timedelta(hours=-1))
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('reap_expired_links', stdout=out)
+
+        # Files are deleted on commit, which a TestCase holds back until
+        # after the command has printed its summary
+        self.assertIn('Deleted 1 expired links', out.getvalue())
+        self.assertFalse(os.path.exists(link.image.path))
+        self.assertFalse(ImageLink.objects.exists())
+
+    def test_files_kept_when_transaction_rolls_back(self):
+        """Test that files are only deleted once the row deletes commit."""
+        link = self.make_link(timedelta(hours=-1))
+
+        with self.captureOnCommitCallbacks(execute=True), self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                reaper.reap_expired()
+                raise RuntimeError
+
+        self.assertTrue(ImageLink.objects.exists())
+        self.assertTrue(os.path.exists(link.image.path))
+
+    def test_background_thread_needs_opt_in(self):
+        with override_settings(REAPER={'interval': 60}):
+            self.assertFalse(reaper.start_periodic())
+
+    def test_one_reaper_at_a_time(self):
+        """Test that a second run is skipped while the lock is held."""
+        handle = reaper._lock_file()
+        try:
+            self.assertIsNone(reaper.run())
+        finally:
+            if handle is not True:
+                reaper.fcntl.flock(handle, reaper.fcntl.LOCK_UN)
+                handle.close()
@@ -0,0 +1,229 @@
+"""Tests for shared image renditions."""
+
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from PIL import Image
+
+from tools import reaper, renditions
+from tools.admission import PixelBudget
+from tools.locks import file_lock, lock_path
+from tools.models import ImageLink
+from tools.services import ImageProcessor
+
+
+def image_bytes(size=(2000, 1000), format='JPEG', exif=None, **kwargs):
+    buffer = io.BytesIO()
+    img = Image.new('RGB', size, (200, 40, 40))
+    if exif:
+        kwargs['exif'] = exif
+    img.save(buffer, format=format, **kwargs)
+    return buffer.getvalue()
+
+
+@override_settings(RENDITIONS={'widths': (320, 800, 1600), 'quality': 80, 'lock_timeout': 5})
+class RenderTestCase(TestCase):
+    """Test cases for rendering a single rendition."""
+
+    def test_render_webp_and_jpeg(self):
+        for fmt in ('WEBP', 'JPEG'):
+            img = Image.open(io.BytesIO(renditions.render(io.BytesIO(image_bytes()), 320, fmt)))
+            self.assertEqual(img.format, fmt)
+            self.assertEqual(img.size, (320, 160))
+
+    def test_jpeg_source_is_draft_decoded(self):
+        """Test that a large JPEG is decoded at reduced size."""
+        decoded = []
+        original = ImageProcessor.open_for_target_size
+
+        def open_for_target_size(source, size):
+            img = original(source, size)
+            decoded.append(img.size)
+            return img
+
+        with mock.patch.object(ImageProcessor, 'open_for_target_size', open_for_target_size):
+            renditions.render(io.BytesIO(image_bytes((4000, 3000))), 320, 'JPEG')
+
+        self.assertEqual(decoded, [(1000, 750)])
+
+    def test_exif_rotation_is_applied(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6
+        data = image_bytes((1000, 2000), exif=exif)
+
+        img = Image.open(io.BytesIO(renditions.render(io.BytesIO(data), 320, 'WEBP')))
+        self.assertEqual(img.size, (320, 160))
+
+    def test_transparent_png_flattened_for_jpeg(self):
+        buffer = io.BytesIO()
+        Image.new('RGBA', (1000, 500), (0, 0, 0, 0)).save(buffer, format='PNG')
+
+        img = Image.open(io.BytesIO(renditions.render(io.BytesIO(buffer.getvalue()), 320, 'JPEG')))
+        self.assertEqual(img.mode, 'RGB')
+        self.assertGreater(img.getpixel((10, 10))[0], 240)
+
+    def test_source_stem(self):
+        self.assertEqual(renditions.source_stem('temp_images/abc.w320.webp'), 'temp_images/abc')
+        self.assertIsNone(renditions.source_stem('temp_images/abc.png'))
+
+
+@override_settings(RENDITIONS={'widths': (320, 800, 1600), 'quality': 80, 'lock_timeout': 5})
+class RenditionStorageTestCase(TestCase):
+    """Test cases for lazily stored renditions."""
+
+    def setUp(self):
+        cache.clear()
+        self.media_root = tempfile.mkdtemp()
+        self.settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            MEDIA_SERVING={},
+            RENDITIONS={
+                'widths': (320, 800, 1600), 'quality': 80, 'lock_timeout': 5,
+                'lock_dir': os.path.join(self.media_root, 'locks'),
+            },
+            REAPER={'lock_file': os.path.join(self.media_root, 'reaper.lock')},
+        )
+        self.settings_override.enable()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        shutil.rmtree(self.media_root, ignore_errors=True)
+
+    def make_link(self, content=None, name='photo.jpg', expires_in=timedelta(hours=1)):
+        return ImageLink.objects.create(
+            image=SimpleUploadedFile(name, content or image_bytes()),
+            original_filename=name,
+            expires_at=timezone.now() + expires_in,
+        )
+
+    def test_only_smaller_widths_are_offered(self):
+        link = self.make_link(image_bytes((1000, 500)))
+        self.assertEqual(renditions.available_widths(link.image.storage, link.image.name), (320, 800))
+
+    def test_animated_images_get_no_renditions(self):
+        buffer = io.BytesIO()
+        frames = [Image.new('RGB', (1000, 500), color) for color in ('red', 'blue')]
+        frames[0].save(buffer, format='GIF', save_all=True, append_images=frames[1:])
+        link = self.make_link(buffer.getvalue(), name='anim.gif')
+
+        self.assertEqual(renditions.available_widths(link.image.storage, link.image.name), ())
+
+    def test_rendition_is_made_once_under_concurrency(self):
+        """Test that concurrent requests share one encode."""
+        link = self.make_link()
+        storage = link.image.storage
+        original_render = renditions.render
+        calls = []
+
+        def slow_render(*args):
+            calls.append(args[1:])
+            time.sleep(0.2)
+            return original_render(*args)
+
+        names = []
+        with mock.patch.object(renditions, 'render', slow_render):
+            threads = [
+                threading.Thread(target=lambda: names.append(
+                    renditions.ensure_rendition(storage, link.image.name, 800, 'webp')))
+                for _ in range(4)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(set(names)), 1)
+        self.assertEqual(Image.open(storage.path(names[0])).size, (800, 400))
+
+    def test_lock_is_host_wide_and_cleaned_up(self):
+        """Test that a lock held through another open file blocks, and is removed after."""
+        link = self.make_link()
+        target = renditions.rendition_name(link.image.name, 320, 'jpg')
+        path = lock_path(os.path.join(self.media_root, 'locks'), target)
+
+        # A separate open file description, as another process would have
+        with file_lock(path, 1):
+            with override_settings(RENDITIONS={'widths': (320,), 'lock_timeout': 0.2,
+                                               'lock_dir': os.path.dirname(path)}):
+                with mock.patch.object(renditions, 'render', wraps=renditions.render) as render:
+                    renditions.ensure_rendition(link.image.storage, link.image.name, 320, 'jpg')
+            # Timed out waiting, then rendered anyway
+            render.assert_called_once()
+
+        self.assertFalse(os.path.exists(path))
+
+    def test_rendition_needs_pixel_budget(self):
+        """Test that making a rendition is turned away when the budget is full."""
+        link = self.make_link()
+        url = f'/shared-image/{link.link_id}/w320.webp'
+        budget = PixelBudget(1000, os.path.join(self.media_root, 'budget'))
+        token = budget.try_reserve(1000)
+
+        with override_settings(PIXEL_BUDGET={'enabled': True, 'wait_seconds': 0, 'retry_after': 7}), \
+                mock.patch('tools.admission.get_pixel_budget', return_value=budget):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '7')
+
+            budget.release(token)
+            self.assertEqual(self.client.get(url).status_code, 200)
+            self.assertEqual(budget.in_use(), 0)
+
+    def test_unknown_width_is_rejected(self):
+        link = self.make_link()
+        with self.assertRaises(ValueError):
+            renditions.ensure_rendition(link.image.storage, link.image.name, 500, 'webp')
+
+    def test_share_page_srcset_and_rendition_view(self):
+        link = self.make_link()
+
+        response = self.client.get(f'/view-image/{link.link_id}/')
+        self.assertContains(response, f'/shared-image/{link.link_id}/w320.webp 320w')
+        self.assertContains(response, f'/shared-image/{link.link_id}/w1600.jpg 1600w')
+        self.assertContains(response, f'/shared-image/{link.link_id}/ 2000w')
+
+        response = self.client.get(f'/shared-image/{link.link_id}/w320.webp')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        self.assertEqual(Image.open(io.BytesIO(b''.join(response.streaming_content))).size, (320, 160))
+
+        self.assertEqual(self.client.get(f'/shared-image/{link.link_id}/w321.webp').status_code, 404)
+        self.assertEqual(self.client.get(f'/shared-image/{link.link_id}/w320.png').status_code, 404)
+
+    def test_renditions_deleted_with_original(self):
+        link = self.make_link()
+        storage = link.image.storage
+        name = renditions.ensure_rendition(storage, link.image.name, 320, 'jpg')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            link.delete()
+
+        self.assertFalse(os.path.exists(link.image.path))
+        self.assertFalse(os.path.exists(storage.path(name)))
+
+    def test_reaper_removes_renditions(self):
+        expired = self.make_link(expires_in=timedelta(hours=-1))
+        live = self.make_link()
+        storage = live.image.storage
+        expired_rendition = renditions.ensure_rendition(storage, expired.image.name, 320, 'jpg')
+        live_rendition = renditions.ensure_rendition(storage, live.image.name, 320, 'jpg')
+        orphan_rendition = storage.path('temp_images/gone.w320.webp')
+        with open(orphan_rendition, 'wb') as f:
+            f.write(b'x')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            reaper.run(orphan_min_age=0)
+
+        self.assertFalse(os.path.exists(storage.path(expired_rendition)))
+        self.assertFalse(os.path.exists(orphan_rendition))
+        self.assertTrue(os.path.exists(storage.path(live_rendition)))
@@ -0,0 +1,201 @@
+"""Tests for the tool result cache."""
+
+import io
+import os
+import tempfile
+import threading
+import time
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from PIL import Image
+
+from tools import result_cache
+from tools.locks import file_lock, lock_path
+
+
+def make_upload(name='photo.png', color='red'):
+    """Create an uploaded PNG file."""
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color=color).save(buffer, format='PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+class ResultCacheTestCase(TestCase):
+    """Test cases for the cached_result decorator."""
+
+    def setUp(self):
+        result_cache.reset_result_cache()
+
+    def tearDown(self):
+        result_cache.reset_result_cache()
+
+    def convert(self, **kwargs):
+        return self.client.post('/format-converter/', {
+            'conversion_type': 'image_format',
+            'output_format': 'JPEG',
+            'image': make_upload(**kwargs),
+        })
+
+    def test_repeated_request_is_served_from_cache(self):
+        """Test that an identical upload and form gets the cached response."""
+        first = self.convert()
+        second = self.convert(name='renamed.png')
+
+        self.assertEqual(first['X-Cache'], 'MISS')
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(first['Content-Disposition'], second['Content-Disposition'])
+        self.assertEqual(result_cache.stats(), {'format_converter': {'hits': 1, 'misses': 1, 'coalesced': 0}})
+
+    def test_different_input_misses(self):
+        """Test that different upload bytes get a different key."""
+        self.convert()
+        response = self.convert(color='blue')
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    def test_streamed_pdf_is_cached(self):
+        """Test that image_to_pdf's streamed output is stored and still sent."""
+        def post():
+            return self.client.post('/image-to-pdf/', {'page_size': 'a4', 'images': [make_upload()]})
+
+        first = post()
+        first_body = b''.join(first)
+        second = post()
+
+        self.assertTrue(first_body.startswith(b'%PDF'))
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(second.content, first_body)
+
+    @override_settings(RESULT_CACHE={'max_streamed_bytes': 100})
+    def test_large_streamed_response_is_not_read_back(self):
+        """Test that streamed output over the limit keeps streaming and isn't cached."""
+        def post():
+            return self.client.post('/image-to-pdf/', {'page_size': 'a4', 'images': [make_upload()]})
+
+        first = post()
+        self.assertTrue(first.streaming)
+        self.assertTrue(b''.join(first).startswith(b'%PDF'))
+        self.assertEqual(post()['X-Cache'], 'MISS')
+
+    def test_errors_are_not_cached(self):
+        """Test that only successful responses are stored."""
+        self.client.post('/qr-generator/', {'data': '', 'size': '300'})
+        response = self.client.post('/qr-generator/', {'data': '', 'size': '300'})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['X-Cache'], 'MISS')
+
+    @override_settings(RESULT_CACHE={'tools': {'qr_generator': False}})
+    def test_tool_switch(self):
+        """Test that a disabled tool bypasses the cache."""
+        self.client.post('/qr-generator/', {'data': 'hello', 'size': '300'})
+        response = self.client.post('/qr-generator/', {'data': 'hello', 'size': '300'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('X-Cache'))
+
+
+class SingleFlightTestCase(TestCase):
+    """Test cases for coalescing concurrent identical requests."""
+
+    def setUp(self):
+        result_cache.reset_result_cache()
+
+    def tearDown(self):
+        result_cache.reset_result_cache()
+
+    def test_concurrent_duplicates_compute_once(self):
+        """Test that concurrent identical requests run the view once."""
+        calls = []
+
+        @result_cache.cached_result('slow_tool')
+        def view(request):
+            calls.append(1)
+            time.sleep(0.2)
+            return HttpResponse(b'result', content_type='text/plain')
+
+        factory = RequestFactory()
+        responses = []
+
+        def post():
+            responses.append(view(factory.post('/slow/', {'data': 'same'})))
+
+        threads = [threading.Thread(target=post) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual([r.content for r in responses], [b'result'] * 4)
+        self.assertEqual(result_cache.stats()['slow_tool'], {'hits': 3, 'misses': 1, 'coalesced': 3})
+
+    def test_other_keys_do_not_wait(self):
+        """Test that a key held by another process doesn't block different keys."""
+        lock_dir = tempfile.mkdtemp()
+        held = lock_path(lock_dir, 'result-aaa')
+
+        with override_settings(RESULT_CACHE={'lock_dir': lock_dir}):
+            # Opened separately, as another worker process would
+            with file_lock(held, 1):
+                started = time.monotonic()
+                with result_cache.single_flight('result-bbb', 5, shared=True):
+                    pass
+                self.assertLess(time.monotonic() - started, 1)
+
+                with result_cache.single_flight('result-aaa', 0.2, shared=True):
+                    pass
+                self.assertGreaterEqual(time.monotonic() - started, 0.2)
+
+        self.assertEqual(os.listdir(lock_dir), [])
+        os.rmdir(lock_dir)
+
+    def test_no_disk_tier_does_not_wait_for_other_processes(self):
+        """Test that without disk_dir a key held by another process doesn't block."""
+        lock_dir = tempfile.mkdtemp()
+        factory = RequestFactory()
+
+        @result_cache.cached_result('slow_tool')
+        def view(request):
+            return HttpResponse(b'result', content_type='text/plain')
+
+        request = factory.post('/slow/', {'data': 'same'})
+        key = f"result-{result_cache.request_key('slow_tool', request)}"
+
+        with override_settings(RESULT_CACHE={'lock_dir': lock_dir, 'disk_dir': '', 'coalesce_timeout': 5}):
+            result_cache.reset_result_cache()
+            # Held as another worker process computing the same request would
+            with file_lock(lock_path(lock_dir, key), 1):
+                started = time.monotonic()
+                response = view(request)
+                self.assertLess(time.monotonic() - started, 1)
+
+        self.assertEqual(response['X-Cache'], 'MISS')
+        os.rmdir(lock_dir)
+
+    def test_uncacheable_response_releases_waiters(self):
+        """Test that waiters for an error response compute side by side, not in turn."""
+        calls = []
+
+        @result_cache.cached_result('slow_tool')
+        def view(request):
+            calls.append(1)
+            time.sleep(0.3)
+            return HttpResponse(b'busy', status=503)
+
+        factory = RequestFactory()
+        threads = [
+            threading.Thread(target=view, args=(factory.post('/slow/', {'data': 'same'}),))
+            for _ in range(4)
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(calls), 4)
+        # One run for the first request, then the other three together
+        self.assertLess(time.monotonic() - started, 0.9)
@@ -0,0 +1,51 @@
+"""Tests for upload validation."""
+
+import io
+from django.core.exceptions import ValidationError
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from tools.security import ValidatedImage, validate_upload
+
+
+def make_upload(size=(120, 80), format='PNG', name='image.png'):
+    """Create an uploaded image file."""
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'white').save(buffer, format=format)
+    return SimpleUploadedFile(name, buffer.getvalue())
+
+
+class ValidateUploadTestCase(TestCase):
+    """Test cases for validate_upload."""
+
+    def test_returns_parsed_header(self):
+        """Test that validation hands back the opened image."""
+        upload = validate_upload(make_upload(format='JPEG', name='a.jpg'))
+
+        self.assertIsInstance(upload, ValidatedImage)
+        self.assertEqual(upload.format, 'JPEG')
+        self.assertEqual(upload.size, (120, 80))
+        self.assertEqual(upload.load().size, (120, 80))
+
+    @override_settings(MAX_IMAGE_PIXELS=5000)
+    def test_rejects_oversized_dimensions(self):
+        """Test that the pixel limit is enforced from the header."""
+        with self.assertRaises(ValidationError):
+            validate_upload(make_upload(size=(100, 100)))
+
+    def test_rejects_non_images(self):
+        """Test that files PIL can't parse are rejected."""
+        with self.assertRaises(ValidationError):
+            validate_upload(SimpleUploadedFile('fake.png', b'not an image'))
+
+
+class DecodedBytesTestCase(TestCase):
+    """Test cases for ValidatedImage.decoded_bytes."""
+
+    def test_bytes_per_pixel_by_mode(self):
+        """Test that wide modes, padded RGB and palettes are counted in full."""
+        expected = {'L': 1, 'I;16': 2, 'I': 4, 'F': 4, 'RGB': 4, 'RGBA': 4, 'LA': 4, 'P': 4}
+        for mode, bytes_per_pixel in expected.items():
+            upload = ValidatedImage(None, Image.new(mode, (10, 20)))
+            self.assertEqual(upload.decoded_bytes, 200 * bytes_per_pixel, mode)
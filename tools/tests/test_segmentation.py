@@ -0,0 +1,306 @@
+"""Tests for the segmentation service."""
+
+import importlib
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+
+import numpy as np
+from django.test import TestCase
+from PIL import Image
+
+from tools.services.segmentation import SegmentationService, refine_mask_edges
+from tools.services.segmentation_pool import (
+    SegmentationPoolError,
+    SegmentationServer,
+    predict_masks,
+    request_mask,
+)
+
+
+class SegmentationServiceTestCase(TestCase):
+    """Test cases for SegmentationService."""
+
+    def setUp(self):
+        SegmentationService._sessions.clear()
+
+    def tearDown(self):
+        SegmentationService._sessions.clear()
+
+    def test_session_created_once_per_model(self):
+        """Test that sessions are reused across calls."""
+        with mock.patch.object(SegmentationService, '_create_session', side_effect=lambda name: object()) as create:
+            first = SegmentationService.get_session('u2net')
+            second = SegmentationService.get_session('u2net')
+            other = SegmentationService.get_session('u2netp')
+
+        self.assertIs(first, second)
+        self.assertIsNot(first, other)
+        self.assertEqual(create.call_count, 2)
+
+    def test_worker_boots_when_prewarm_fails(self):
+        """Test that a model that fails to load doesn't stop the WSGI app from loading."""
+        from image_tools_project import wsgi
+
+        with self.settings(SEGMENTATION={'prewarm': True, 'pool_socket': ''}), \
+                mock.patch.object(SegmentationService, 'prewarm', side_effect=RuntimeError('corrupt model')), \
+                self.assertLogs('image_tools_project.wsgi', 'ERROR'):
+            importlib.reload(wsgi)
+        self.assertIsNotNone(wsgi.application)
+
+    def test_prewarm_loads_requested_models(self):
+        """Test that prewarm creates a session for each model."""
+        with mock.patch.object(SegmentationService, '_create_session', side_effect=lambda name: object()):
+            SegmentationService.prewarm(['u2net', 'silueta'])
+
+        self.assertEqual(set(SegmentationService._sessions), {'u2net', 'silueta'})
+
+
+class ComputeMaskTestCase(TestCase):
+    """Test cases for low-resolution mask inference."""
+
+    def setUp(self):
+        SegmentationService._mask_cache = None
+
+    def tearDown(self):
+        SegmentationService._mask_cache = None
+
+    def test_inference_runs_at_working_size(self):
+        """Test that large images are downscaled before inference."""
+        seen = []
+
+        def fake_predict(image, model_name=None):
+            seen.append(image.size)
+            return Image.new('L', image.size, 128)
+
+        image = Image.new('RGB', (4000, 2000), 'blue')
+        with mock.patch.object(SegmentationService, 'predict_mask', side_effect=fake_predict):
+            with self.settings(SEGMENTATION={'working_size': 1000}):
+                mask = SegmentationService.compute_mask(image)
+
+        self.assertEqual(seen, [(1000, 500)])
+        self.assertEqual(mask.size, (4000, 2000))
+
+    def test_small_images_are_not_resized(self):
+        """Test that images under the working size go straight to inference."""
+        seen = []
+
+        def fake_predict(image, model_name=None):
+            seen.append(image.size)
+            return Image.new('L', image.size)
+
+        with mock.patch.object(SegmentationService, 'predict_mask', side_effect=fake_predict):
+            with self.settings(SEGMENTATION={'working_size': 1000}):
+                SegmentationService.compute_mask(Image.new('RGB', (640, 480)))
+
+        self.assertEqual(seen, [(640, 480)])
+
+    def test_refined_edges_follow_full_resolution_image(self):
+        """Test that guided upsampling puts the mask edge on the image edge."""
+        image = Image.new('RGB', (2000, 1000), 'black')
+        image.paste((255, 255, 255), (1000, 0, 2000, 1000))
+        small = image.resize((200, 100))
+        blurry = small.convert('L').resize((20, 10)).resize((200, 100), Image.BILINEAR)
+
+        mask = np.asarray(refine_mask_edges(blurry, small, image))
+
+        self.assertEqual(mask.shape, (1000, 2000))
+        self.assertGreater(int(mask[500, 1000]) - int(mask[500, 999]), 100)
+
+
+class FakeInput:
+    name = 'input'
+    shape = ['batch', 3, 320, 320]
+
+
+class FakeInnerSession:
+    """Mimics an ONNX session with a dynamic batch dimension."""
+
+    def __init__(self):
+        self.batch_sizes = []
+
+    def get_inputs(self):
+        return [FakeInput()]
+
+    def run(self, outputs, feed):
+        batch = feed['input']
+        self.batch_sizes.append(batch.shape[0])
+        return [batch[:, :1, :, :]]
+
+
+class FakeSession:
+    """Mimics the parts of a rembg session used by the pool."""
+
+    def __init__(self):
+        self.inner_session = FakeInnerSession()
+
+    def normalize(self, img, mean, std, size):
+        arr = np.array(img.convert('RGB').resize(size), dtype=np.float32) / 255
+        return {'input': arr.transpose((2, 0, 1))[np.newaxis]}
+
+    def predict(self, img):
+        return [Image.new('L', img.size, 255)]
+
+
+class PredictMasksTestCase(TestCase):
+    """Test cases for batched mask prediction."""
+
+    def test_batch_runs_single_inference(self):
+        """Test that same-model images share one ONNX run."""
+        session = FakeSession()
+        images = [Image.new('RGB', (64, 48), 'white'), Image.new('RGB', (30, 90), 'black')]
+
+        masks = predict_masks(session, 'u2net', images)
+
+        self.assertEqual(session.inner_session.batch_sizes, [2])
+        self.assertEqual([m.size for m in masks], [(64, 48), (30, 90)])
+        self.assertEqual([m.mode for m in masks], ['L', 'L'])
+
+    def test_unknown_model_uses_predict(self):
+        """Test that models without a batch profile run one at a time."""
+        session = FakeSession()
+        masks = predict_masks(session, 'isnet-anime', [Image.new('RGB', (10, 10))] * 2)
+
+        self.assertEqual(session.inner_session.batch_sizes, [])
+        self.assertEqual(len(masks), 2)
+
+
+# Forked workers inherit the test's mock sessions
+FORK = multiprocessing.get_context('fork')
+
+
+class SegmentationServerTestCase(TestCase):
+    """End-to-end test of the Unix socket inference service."""
+
+    def test_request_mask_roundtrip(self):
+        """Test that a mask comes back at the size of the request image."""
+        socket_path = os.path.join(tempfile.mkdtemp(), 'seg.sock')
+        server = SegmentationServer(socket_path, b'secret', workers=1, batch_size=2, context=FORK)
+
+        SegmentationService._sessions.clear()
+        with mock.patch.object(SegmentationService, '_create_session', side_effect=lambda name: FakeSession()):
+            server.start_workers()
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                for _ in range(50):
+                    if os.path.exists(socket_path):
+                        break
+                    time.sleep(0.05)
+                mask = request_mask(socket_path, b'secret', Image.new('RGB', (100, 80), 'red'), 'u2net', timeout=10)
+            finally:
+                server.stop()
+        SegmentationService._sessions.clear()
+
+        self.assertEqual(mask.mode, 'L')
+        self.assertEqual(mask.size, (100, 80))
+
+    def run_server(self, session, **kwargs):
+        """Start a one-worker server whose sessions are ``session``; returns it and its socket."""
+        socket_path = os.path.join(tempfile.mkdtemp(), 'seg.sock')
+        server = SegmentationServer(socket_path, b'secret', workers=1, context=FORK, **kwargs)
+        SegmentationService._sessions.clear()
+        patcher = mock.patch.object(SegmentationService, '_create_session', side_effect=lambda name: session)
+        patcher.start()
+        self.addCleanup(SegmentationService._sessions.clear)
+        self.addCleanup(patcher.stop)
+        self.addCleanup(server.stop)
+
+        server.start_workers()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        for _ in range(50):
+            if os.path.exists(socket_path):
+                break
+            time.sleep(0.05)
+        return server, socket_path
+
+    def test_dead_worker_fails_request_and_is_replaced(self):
+        """Test that a crashed worker's request gets an error and a new worker starts."""
+        session = FakeSession()
+        session.predict = lambda img: os._exit(1)
+        server, socket_path = self.run_server(session)
+        pid = server._processes[0].pid
+
+        started = time.monotonic()
+        with self.assertRaisesRegex(SegmentationPoolError, 'died'):
+            request_mask(socket_path, b'secret', Image.new('RGB', (10, 10)), 'isnet-general-use', timeout=10)
+        self.assertLess(time.monotonic() - started, 5)
+
+        self.assertTrue(server._processes[0].is_alive())
+        self.assertNotEqual(server._processes[0].pid, pid)
+
+    def test_slow_request_times_out(self):
+        """Test that the server answers with an error once request_timeout passes."""
+        session = FakeSession()
+        session.predict = lambda img: time.sleep(1.5) or [Image.new('L', img.size)]
+        server, socket_path = self.run_server(session, request_timeout=0.3)
+
+        with self.assertRaisesRegex(SegmentationPoolError, 'timed out'):
+            request_mask(socket_path, b'secret', Image.new('RGB', (10, 10)), 'isnet-general-use', timeout=10)
+        self.assertFalse(server._pending)
+
+    def test_workers_are_not_forked_by_default(self):
+        """Test that the server starts workers with forkserver or spawn."""
+        server = SegmentationServer('/nonexistent/seg.sock', b'secret')
+        self.assertNotEqual(server._context.get_start_method(), 'fork')
+
+    def test_stop_is_not_undone_by_the_monitor(self):
+        """Test that workers that exit on stop() are not restarted."""
+        server, _ = self.run_server(FakeSession())
+        with mock.patch.object(server, '_spawn', wraps=server._spawn) as spawn:
+            server.stop()
+            time.sleep(1.5)
+
+        spawn.assert_not_called()
+        self.assertEqual(server._processes, [])
+
+    def test_unreachable_service_raises(self):
+        """Test that a missing socket surfaces as SegmentationPoolError."""
+        with self.assertRaises(SegmentationPoolError):
+            request_mask('/nonexistent/seg.sock', b'secret', Image.new('RGB', (10, 10)), 'u2net')
+
+
+class MaskCacheTestCase(TestCase):
+    """Test cases for the alpha mask cache."""
+
+    def setUp(self):
+        SegmentationService._mask_cache = None
+
+    def tearDown(self):
+        SegmentationService._mask_cache = None
+
+    def test_colour_changes_reuse_mask(self):
+        """Test that the same image only runs inference once."""
+        image = Image.new('RGB', (300, 200), 'green')
+        calls = []
+
+        def fake_predict(image, model_name=None):
+            calls.append(image.size)
+            return Image.new('L', image.size, 255)
+
+        with self.settings(MASK_CACHE={'enabled': True, 'memory_bytes': 1024 * 1024}):
+            with mock.patch.object(SegmentationService, 'predict_mask', side_effect=fake_predict):
+                red = SegmentationService.replace_background(image, (255, 0, 0))
+                blue = SegmentationService.replace_background(image.copy(), (0, 0, 255))
+                other = SegmentationService.replace_background(Image.new('RGB', (300, 200), 'red'), (0, 0, 255))
+
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(red.size, blue.size)
+        self.assertEqual(other.mode, 'RGB')
+
+    def test_disabled_cache_always_predicts(self):
+        """Test that inference runs every time with the cache off."""
+        calls = []
+
+        def fake_predict(image, model_name=None):
+            calls.append(image.size)
+            return Image.new('L', image.size)
+
+        with self.settings(MASK_CACHE={'enabled': False}):
+            with mock.patch.object(SegmentationService, 'predict_mask', side_effect=fake_predict):
+                for _ in range(2):
+                    SegmentationService.compute_mask(Image.new('RGB', (50, 50)))
+
+        self.assertEqual(len(calls), 2)
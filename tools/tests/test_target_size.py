@@ -0,0 +1,89 @@
+"""Tests for target-size compression."""
+
+import io
+from unittest import mock
+
+from django.core.exceptions import ValidationError
+from django.test import TestCase
+from PIL import Image
+
+from tools.services.image_processor import ImageProcessor
+from tools.services.target_size import compress_to_size
+
+
+def make_photo(size=(1600, 1200)):
+    """A noisy RGB image that doesn't compress well."""
+    return Image.merge('RGB', [Image.effect_noise(size, 40 + 10 * band) for band in range(3)])
+
+
+def make_photo_like(size=(3000, 2000)):
+    """Smooth shapes with grain, compressing roughly like a photo."""
+    bands = []
+    for band in range(3):
+        shapes = Image.effect_noise((size[0] // 40, size[1] // 40), 80).resize(size, Image.Resampling.BICUBIC)
+        bands.append(Image.blend(shapes, Image.effect_noise(size, 12 + 4 * band), 0.25))
+    return Image.merge('RGB', bands)
+
+
+class CompressToSizeTestCase(TestCase):
+    """Test cases for compress_to_size."""
+
+    def test_fits_budget_by_lowering_quality(self):
+        """Test that a moderate budget is met without downscaling."""
+        image = make_photo()
+        result = compress_to_size(image, 400 * 1024)
+
+        self.assertLessEqual(len(result.data), 400 * 1024)
+        self.assertLess(result.quality, 95)
+        self.assertEqual(result.size, image.size)
+        self.assertGreater(result.probes, 1)
+
+    def test_downscales_when_quality_is_not_enough(self):
+        """Test that a tight budget shrinks the image once quality bottoms out."""
+        result = compress_to_size(make_photo(), 20 * 1024, min_quality=30)
+
+        self.assertLessEqual(len(result.data), 20 * 1024)
+        self.assertEqual(result.quality, 30)
+        self.assertLess(result.scale, 1)
+        self.assertEqual(Image.open(io.BytesIO(result.data)).size, result.size)
+
+    def test_fills_budget(self):
+        """Test that the result uses at least ``fill`` of the budget."""
+        image = make_photo_like()
+        for budget in (200 * 1024, 400 * 1024):
+            result = compress_to_size(image, budget, fill=0.9)
+
+            self.assertLessEqual(len(result.data), budget)
+            self.assertGreaterEqual(len(result.data), 0.9 * budget)
+
+    def test_probes_include_full_size_encodes(self):
+        """Test that the reported probe count includes the full-size encodes."""
+        with mock.patch.object(ImageProcessor, 'compress_image', wraps=ImageProcessor.compress_image) as encode:
+            result = compress_to_size(make_photo(), 400 * 1024)
+
+        self.assertEqual(result.probes, encode.call_count)
+
+    def test_generous_budget_keeps_top_quality(self):
+        """Test that a budget larger than the best encode needs one probe."""
+        result = compress_to_size(make_photo((200, 150)), 10 * 1024 * 1024)
+
+        self.assertEqual(result.quality, 95)
+        self.assertEqual(result.probes, 1)
+
+    def test_small_image_probes_are_exact(self):
+        """Test that an image smaller than the proxy is not encoded again."""
+        result = compress_to_size(make_photo((300, 200)), 30 * 1024, proxy_pixels=500_000)
+
+        self.assertLessEqual(len(result.data), 30 * 1024)
+        self.assertGreaterEqual(len(result.data), 27 * 1024)
+
+    def test_webp_source_stays_webp(self):
+        """Test that WebP uploads are compressed as WebP."""
+        image = make_photo((400, 300))
+        image.format = 'WEBP'
+        self.assertEqual(compress_to_size(image, 20 * 1024).output_format, 'WEBP')
+
+    def test_unreachable_budget(self):
+        """Test that an impossible budget is reported."""
+        with self.assertRaises(ValidationError):
+            compress_to_size(make_photo((400, 300)), 100, min_scale=0.5)
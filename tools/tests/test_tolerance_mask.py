@@ -0,0 +1,51 @@
+"""Tests for the colour-tolerance background replacement."""
+
+import numpy as np
+from django.test import TestCase
+from PIL import Image
+
+from tools.services import tolerance_mask
+from tools.services.tolerance_mask import replace_background_color
+
+
+def reference_replace(img, new_color, tolerance):
+    """The original full-frame float implementation."""
+    img_array = np.array(img)
+    h, w = img_array.shape[:2]
+    corners = [img_array[0, 0], img_array[0, w - 1], img_array[h - 1, 0], img_array[h - 1, w - 1]]
+    avg_bg_color = np.mean(corners, axis=0).astype(int)
+    distance = np.sqrt(np.sum((img_array.astype(int) - avg_bg_color) ** 2, axis=2))
+    result = img_array.copy()
+    result[distance <= tolerance] = new_color
+    return result
+
+
+class ReplaceBackgroundColorTestCase(TestCase):
+    """Test cases for replace_background_color."""
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.image = Image.fromarray(rng.integers(0, 256, (203, 157, 3), dtype=np.uint8))
+
+    def check_matches_reference(self, use_numba):
+        for tolerance in (0, 30, 120, 442):
+            expected = reference_replace(self.image, (1, 2, 3), tolerance)
+            with self.settings(TOLERANCE_MASK={'band_rows': 16, 'workers': 3, 'use_numba': use_numba}):
+                result = replace_background_color(self.image.copy(), (1, 2, 3), tolerance)
+            np.testing.assert_array_equal(np.array(result), expected)
+
+    def test_numpy_matches_original_algorithm(self):
+        """Test that the banded integer kernel matches the float version."""
+        self.check_matches_reference(use_numba=False)
+
+    def test_numba_matches_original_algorithm(self):
+        """Test the numba kernel when numba is installed."""
+        if tolerance_mask.numba is None:
+            self.skipTest('numba not installed')
+        self.check_matches_reference(use_numba=True)
+
+    def test_negative_tolerance_changes_nothing(self):
+        """Test that a negative tolerance leaves the image untouched."""
+        original = np.array(self.image)
+        result = replace_background_color(self.image.copy(), (0, 0, 0), -5)
+        np.testing.assert_array_equal(np.array(result), original)
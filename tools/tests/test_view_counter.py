@@ -0,0 +1,166 @@
+"""Tests for buffered view counting."""
+
+import io
+import threading
+import time
+from datetime import timedelta
+from unittest import mock
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from tools import view_counter
+from tools.models import ImageLink
+
+
+def make_link(link_id='abc'):
+    return ImageLink.objects.create(
+        link_id=link_id,
+        image='temp_images/test.png',
+        original_filename='test.png',
+        expires_at=timezone.now() + timedelta(days=1),
+    )
+
+
+def stored_views(link_id='abc'):
+    return ImageLink.objects.get(link_id=link_id).view_count
+
+
+class BufferedViewCounterTestCase(TestCase):
+    """Test cases for the per-process buffer."""
+
+    def setUp(self):
+        view_counter.reset()
+        make_link()
+        make_link('def')
+
+    def tearDown(self):
+        view_counter.reset()
+
+    @override_settings(VIEW_COUNTER={'mode': 'buffered', 'flush_interval': 3600, 'max_pending': 100_000})
+    def test_views_are_written_on_flush(self):
+        """Test that views cost no writes until the flush adds them all."""
+        with CaptureQueriesContext(connection) as queries:
+            for _ in range(50):
+                view_counter.record_view('abc')
+            view_counter.record_view('def')
+        self.assertEqual(len(queries), 0)
+        self.assertEqual(view_counter.pending_views('abc'), 50)
+
+        self.assertEqual(view_counter.flush(), 51)
+        self.assertEqual(stored_views('abc'), 50)
+        self.assertEqual(stored_views('def'), 1)
+        self.assertEqual(view_counter.pending_views('abc'), 0)
+
+    @override_settings(VIEW_COUNTER={'mode': 'buffered', 'flush_interval': 3600, 'max_pending': 10})
+    def test_flushes_when_buffer_is_full(self):
+        """Test that max_pending triggers a flush."""
+        for _ in range(10):
+            view_counter.record_view('abc')
+        self.assertEqual(stored_views('abc'), 10)
+
+    @override_settings(VIEW_COUNTER={'mode': 'direct'})
+    def test_direct_mode(self):
+        """Test that direct mode increments atomically on every view."""
+        view_counter.record_view('abc')
+        view_counter.record_view('abc')
+        self.assertEqual(stored_views('abc'), 2)
+
+    @override_settings(VIEW_COUNTER={'mode': 'buffered', 'flush_interval': 3600, 'max_pending': 100_000})
+    def test_page_shows_pending_views(self):
+        """Test that the page count includes views not flushed yet."""
+        view_counter.record_view('abc')
+        response = self.client.get('/view-image/abc/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '<strong>Views:</strong> 2')
+        self.assertEqual(stored_views('abc'), 0)
+
+
+@override_settings(VIEW_COUNTER={'mode': 'cache', 'flush_interval': 3600, 'max_pending': 1000})
+class CacheViewCounterTestCase(TestCase):
+    """Test cases for counting in the shared cache."""
+
+    def setUp(self):
+        view_counter.reset()
+        cache.clear()
+        make_link()
+
+    def tearDown(self):
+        view_counter.reset()
+        cache.clear()
+
+    def test_flush_subtracts_written_views(self):
+        """Test that a flush writes the cached count and leaves nothing behind."""
+        for _ in range(7):
+            view_counter.record_view('abc')
+        self.assertEqual(view_counter.pending_views('abc'), 7)
+
+        self.assertEqual(view_counter.flush(), 7)
+        self.assertEqual(stored_views('abc'), 7)
+        self.assertEqual(view_counter.pending_views('abc'), 0)
+
+    def test_failed_write_keeps_links_dirty(self):
+        """Test that views survive a failed write and go out with the next flush."""
+        for _ in range(3):
+            view_counter.record_view('abc')
+
+        with mock.patch.object(view_counter, '_write', side_effect=RuntimeError('database down')):
+            with self.assertRaises(RuntimeError):
+                view_counter.flush()
+
+        self.assertEqual(view_counter.flush(), 3)
+        self.assertEqual(stored_views('abc'), 3)
+
+    def test_flushed_keys_expire(self):
+        """Test that a link's cache key goes away once it has been flushed and left idle."""
+        with override_settings(VIEW_COUNTER={'mode': 'cache', 'flush_interval': 3600, 'key_timeout': 1}):
+            view_counter.record_view('abc')
+            view_counter.flush()
+            self.assertTrue(cache.has_key('view-count:abc'))
+
+            time.sleep(1.1)
+            self.assertFalse(cache.has_key('view-count:abc'))
+            self.assertEqual(stored_views('abc'), 1)
+
+    def test_check_rejects_per_process_cache(self):
+        """Test that cache mode with LocMemCache fails the system check."""
+        errors = view_counter.check_shared_cache(None)
+        self.assertEqual([error.id for error in errors], ['tools.E001'])
+
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            self.assertEqual(view_counter.check_shared_cache(None), [])
+
+    def test_management_command_flushes_every_link(self):
+        """Test that the cron command flushes links this process didn't count."""
+        view_counter.record_view('abc')
+        view_counter.reset()  # as if counted by another worker
+
+        call_command('flush_view_counts', stdout=io.StringIO())
+        self.assertEqual(stored_views('abc'), 1)
+
+
+@override_settings(VIEW_COUNTER={'mode': 'buffered', 'flush_interval': 3600, 'max_pending': 100_000})
+class ConcurrentViewCounterTestCase(TestCase):
+    """Test that concurrent views are not lost."""
+
+    def setUp(self):
+        view_counter.reset()
+        make_link()
+
+    def test_concurrent_views_are_exact(self):
+        def view():
+            for _ in range(250):
+                view_counter.record_view('abc')
+
+        threads = [threading.Thread(target=view) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        view_counter.flush()
+
+        self.assertEqual(stored_views('abc'), 1000)
@@ -0,0 +1,237 @@
+"""Tests for the image tool views."""
+
+import io
+import zipfile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from PIL import Image
+
+
+def make_upload(name='photo.jpg', size=(1600, 1200), format='JPEG', color='red'):
+    """Create an uploaded image file."""
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color=color).save(buffer, format=format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{format.lower()}')
+
+
+class ImageToPdfViewTestCase(TestCase):
+    """Test cases for the image_to_pdf view."""
+
+    def test_a4_with_rotation(self):
+        """Test that rotated pages are fitted to A4."""
+        response = self.client.post('/image-to-pdf/', {
+            'page_size': 'a4',
+            'images': [make_upload(), make_upload('b.png', (800, 2000), 'PNG')],
+            'rotate_0': '90',
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(b''.join(response).startswith(b'%PDF'))
+
+    def test_original_size(self):
+        """Test that original size mode produces a PDF through PdfWriter."""
+        response = self.client.post('/image-to-pdf/', {
+            'page_size': 'original',
+            'images': [make_upload(size=(300, 200))],
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(b''.join(response).startswith(b'%PDF'))
+
+    def test_jpeg_embedded_unchanged(self):
+        """Test that an unrotated JPEG is embedded without re-encoding."""
+        upload = make_upload(size=(640, 480))
+        jpeg_data = upload.read()
+        upload.seek(0)
+
+        response = self.client.post('/image-to-pdf/', {
+            'page_size': 'a4',
+            'images': [upload],
+        })
+
+        pdf = b''.join(response)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'/DCTDecode', pdf)
+        self.assertIn(jpeg_data, pdf)
+
+    def test_resampled_page_encoded_as_jpeg(self):
+        """Test that rotated pages are re-encoded as JPEG rather than PNG."""
+        response = self.client.post('/image-to-pdf/', {
+            'page_size': 'letter',
+            'images': [make_upload('b.png', (800, 600), 'PNG')],
+            'rotate_0': '90',
+        })
+
+        pdf = b''.join(response)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'/DCTDecode', pdf)
+
+
+class FormatConverterViewTestCase(TestCase):
+    """Test cases for the format_converter view."""
+
+    def test_animated_gif_to_webp_keeps_frames(self):
+        """Test that converting an animated GIF keeps the animation."""
+        frames = [Image.new('RGB', (64, 48), color) for color in ('red', 'green', 'blue')]
+        buffer = io.BytesIO()
+        frames[0].save(buffer, format='GIF', save_all=True, append_images=frames[1:], duration=80, loop=0)
+        response = self.client.post('/format-converter/', {
+            'conversion_type': 'image_format',
+            'output_format': 'WEBP',
+            'image': SimpleUploadedFile('anim.gif', buffer.getvalue(), content_type='image/gif'),
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/webp')
+        image = Image.open(io.BytesIO(b''.join(response)))
+        self.assertEqual(image.format, 'WEBP')
+        self.assertEqual(image.n_frames, 3)
+
+    def test_batch_streams_zip(self):
+        """Test that batch mode returns every converted file in a ZIP."""
+        response = self.client.post('/format-converter/', {
+            'conversion_type': 'batch_format',
+            'output_format': 'WEBP',
+            'images': [make_upload('a.jpg'), make_upload('a.png', (300, 200), 'PNG'), make_upload('b.gif', format='GIF')],
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(sorted(archive.namelist()), ['a (1).webp', 'a.webp', 'b.webp'])
+        for name in archive.namelist():
+            self.assertEqual(Image.open(archive.open(name)).format, 'WEBP')
+
+    def test_batch_rejects_unknown_format(self):
+        """Test that an unsupported target format fails before streaming."""
+        response = self.client.post('/format-converter/', {
+            'conversion_type': 'batch_format',
+            'output_format': 'XYZ',
+            'images': [make_upload()],
+        })
+
+        self.assertEqual(response.status_code, 400)
+
+
+class ImageCompressorViewTestCase(TestCase):
+    """Test cases for the image_compressor view."""
+
+    def make_noisy_upload(self, size=(1200, 900)):
+        image = Image.merge('RGB', [Image.effect_noise(size, 50) for _ in range(3)])
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        return SimpleUploadedFile('noise.png', buffer.getvalue(), content_type='image/png')
+
+    def test_target_size(self):
+        """Test that the output fits the requested size and reports the search."""
+        response = self.client.post('/image-compressor/', {
+            'image': self.make_noisy_upload(),
+            'target_kb': '100',
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertLessEqual(len(response.content), 100 * 1024)
+        self.assertEqual(response['X-Compressed-Size'], str(len(response.content)))
+        self.assertGreater(int(response['X-Compress-Probes']), 1)
+        self.assertIn('X-Compress-Time-Ms', response)
+
+    def test_fixed_quality(self):
+        """Test the quality slider mode."""
+        response = self.client.post('/image-compressor/', {
+            'image': make_upload(size=(300, 200)),
+            'quality': '40',
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(io.BytesIO(response.content)).format, 'JPEG')
+        self.assertNotIn('X-Compress-Probes', response)
+
+    def test_png_stays_png_with_alpha(self):
+        """Test that PNG uploads are optimised as PNG and keep transparency."""
+        image = Image.new('RGBA', (300, 200), (0, 0, 0, 0))
+        image.paste((255, 0, 0, 255), (50, 50, 150, 150))
+        buffer = io.BytesIO()
+        image.save(buffer, format='PNG')
+        response = self.client.post('/image-compressor/', {
+            'image': SimpleUploadedFile('logo.png', buffer.getvalue(), content_type='image/png'),
+            'png_palette': 'on',
+            'png_colors': '16',
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        result = Image.open(io.BytesIO(response.content)).convert('RGBA')
+        self.assertEqual(result.getpixel((0, 0))[3], 0)
+        self.assertEqual(result.getpixel((100, 100)), (255, 0, 0, 255))
+
+    def test_invalid_target(self):
+        """Test that a non-numeric target size is rejected."""
+        response = self.client.post('/image-compressor/', {
+            'image': self.make_noisy_upload((30, 20)),
+            'target_kb': 'lots',
+        })
+
+        self.assertEqual(response.status_code, 400)
+
+
+class QrGeneratorViewTestCase(TestCase):
+    """Test cases for the qr_generator view."""
+
+    def test_png_at_requested_size(self):
+        """Test that the QR code is a PNG of exactly the requested size."""
+        response = self.client.post('/qr-generator/', {'data': 'https://example.com', 'size': '350', 'error_correction': 'M'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertEqual(Image.open(io.BytesIO(response.content)).size, (350, 350))
+
+    def test_bulk_from_csv(self):
+        """Test that bulk mode streams a ZIP of codes plus a manifest."""
+        csv_file = SimpleUploadedFile('codes.csv', b'id,data\nspring,https://a.example\nsummer,https://b.example\n')
+        response = self.client.post('/qr-generator/', {'mode': 'bulk', 'file': csv_file})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(sorted(archive.namelist()), ['manifest.csv', 'spring.png', 'summer.png'])
+
+    def test_bulk_without_rows(self):
+        """Test that an empty bulk request is rejected."""
+        response = self.client.post('/qr-generator/', {'mode': 'bulk', 'payloads': '  '})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(QR_BULK={'max_bytes': 1024})
+    def test_bulk_file_too_large(self):
+        """Test that an oversized upload is rejected before it is read."""
+        csv_file = SimpleUploadedFile('codes.csv', b'https://a.example\n' * 100)
+        response = self.client.post('/qr-generator/', {'mode': 'bulk', 'file': csv_file})
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('too large', response.json()['error'])
+
+    @override_settings(QR_BULK={'max_rows': 2})
+    def test_bulk_too_many_rows(self):
+        """Test that more than max_rows rows are rejected."""
+        response = self.client.post('/qr-generator/', {'mode': 'bulk', 'payloads': 'a\nb\nc\nd'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_error_correction(self):
+        """Test that an unknown error correction level is rejected."""
+        response = self.client.post('/qr-generator/', {'data': 'hi', 'size': '300', 'error_correction': 'X'})
+        self.assertEqual(response.status_code, 400)
+
+
+class IdPhotoResizerViewTestCase(TestCase):
+    """Test cases for the id_photo_resizer view."""
+
+    def test_output_has_target_size(self):
+        """Test that the photo is placed on a canvas of the chosen size."""
+        response = self.client.post('/id-photo-resizer/', {
+            'size_option': '2x2',
+            'image': make_upload(size=(4000, 3000)),
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Image.open(io.BytesIO(response.content)).size, (600, 600))
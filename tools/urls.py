@@ -1,7 +1,6 @@
 from django.urls import path
 from . import views
-from django.conf import settings
-from django.conf.urls.static import static
+
 app_name = 'tools'
 
 urlpatterns = [
@@ -12,12 +11,11 @@ urlpatterns = [
     path('qr-generator/', views.qr_generator, name='qr_generator'),
     path('image-link-generator/', views.image_link_generator, name='image_link_generator'),
     path('view-image/<str:link_id>/', views.view_shared_image, name='view_shared_image'),
+    path('shared-image/<str:link_id>/', views.shared_image_file, name='shared_image_file'),
+    path('shared-image/<str:link_id>/w<int:width>.<str:ext>', views.shared_image_file, name='shared_image_rendition'),
     path('background-remover/', views.background_remover, name='background_remover'),
     path('id-photo-resizer/', views.id_photo_resizer, name='id_photo_resizer'),
     path('background-changer/', views.background_changer, name='background_changer'),
     path('contact/', views.contact, name='contact'),
     path('privacy/', views.privacy_policy, name='privacy_policy'), # NEW: Privacy Policy
 ]
-# Serve media files in production
-if settings.DEBUG or True:  # Always serve on Railway
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
\ No newline at end of file
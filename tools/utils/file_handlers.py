@@ -2,7 +2,7 @@
 
 import os
 from django.core.exceptions import ValidationError
-from PIL import Image
+from tools.security import validate_image_file
 
 
 def validate_upload(file, max_size_mb=10, image_only=True):
@@ -14,6 +14,9 @@ def validate_upload(file, max_size_mb=10, image_only=True):
         max_size_mb: Maximum file size in MB
         image_only: If True, only accept image files
     
+    Returns:
+        ValidatedImage if image_only, otherwise None
+    
     Raises:
         ValidationError: If file is invalid
     """
@@ -29,11 +32,9 @@ def validate_upload(file, max_size_mb=10, image_only=True):
         if file_ext not in valid_extensions:
             raise ValidationError(f'Invalid file type. Allowed: {", ".join(valid_extensions)}')
         
-        try:
-            img = Image.open(file)
-            img.verify()
-        except Exception:
-            raise ValidationError('Invalid image file or corrupted image')
+        # Parse the header once and hand it back, rather than verify(),
+        # which consumes the file and forces callers to open it again
+        return validate_image_file(file)
 
 
 def sanitize_filename(filename):
@@ -0,0 +1,243 @@
+"""
+View counting for shared image links.
+
+Writing ``view_count += 1; save()`` on every page view turns each view
+into a full-row UPDATE and loses increments when two views race. Views
+are instead recorded in a counter and written to the database in
+batches with ``F()`` expressions, so a flush adds exactly the views that
+were counted and nothing is lost to concurrent updates.
+
+``settings.VIEW_COUNTER['mode']`` picks where views are collected:
+
+    buffered  - in this process; flushed when ``flush_interval`` seconds
+                have passed or ``max_pending`` views are waiting, and when
+                the process exits
+    cache     - in the shared Django cache (atomic ``incr``), so views from
+                every worker add up in one place before they're flushed;
+                ``manage.py flush_view_counts`` flushes from cron as well.
+                The default cache must be shared by all processes
+                (Redis, Memcached, database); with LocMemCache each
+                worker would count and flush on its own, and the cron
+                flush would see nothing. The ``tools.E001`` system check
+                refuses to start with a per-process backend. Keys expire
+                ``key_timeout`` seconds after they were created or last
+                flushed
+    direct    - no buffering: one atomic ``F()`` UPDATE per view
+
+Pages show ``view_count + pending_views()`` so the number a visitor
+sees still includes views that haven't been flushed.
+"""
+
+import atexit
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core import checks
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+
+from .models import ImageLink
+
+
+CACHE_PREFIX = 'view-count:'
+FLUSH_LOCK_KEY = 'view-count-flush-lock'
+
+# Largest IN (...) list per UPDATE
+FLUSH_CHUNK = 500
+
+# Default for VIEW_COUNTER['key_timeout']: seconds a link's cache key
+# lives after it was created or last flushed. Its views must be flushed
+# within that time
+KEY_TIMEOUT = 24 * 3600
+
+# Cache backends whose contents other processes can't see
+PER_PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+_pending = Counter()
+_dirty = set()
+_lock = threading.Lock()
+_last_flush = time.monotonic()
+
+
+def _config():
+    return getattr(settings, 'VIEW_COUNTER', {})
+
+
+def _cache_key(link_id):
+    return f'{CACHE_PREFIX}{link_id}'
+
+
+def record_view(link_id):
+    """Count one view of a link, flushing if a flush is due."""
+    config = _config()
+    mode = config.get('mode', 'buffered')
+
+    if mode == 'direct':
+        ImageLink.objects.filter(link_id=link_id).update(view_count=F('view_count') + 1)
+        return
+
+    if mode == 'cache':
+        key = _cache_key(link_id)
+        timeout = config.get('key_timeout', KEY_TIMEOUT)
+        # add() is a no-op when the key exists, so concurrent first views
+        # don't reset each other
+        if not cache.add(key, 1, timeout=timeout):
+            try:
+                cache.incr(key)
+            except ValueError:
+                # Expired between add() and incr()
+                cache.add(key, 1, timeout=timeout)
+
+    with _lock:
+        if mode == 'cache':
+            _dirty.add(link_id)
+            waiting = len(_dirty)
+        else:
+            _pending[link_id] += 1
+            waiting = sum(_pending.values())
+        due = (time.monotonic() - _last_flush >= config.get('flush_interval', 10)
+               or waiting >= config.get('max_pending', 1000))
+
+    if due:
+        flush()
+
+
+def pending_views(link_id):
+    """Views of a link counted but not yet written to the database."""
+    if _config().get('mode', 'buffered') == 'cache':
+        return cache.get(_cache_key(link_id)) or 0
+    with _lock:
+        return _pending.get(link_id, 0)
+
+
+def _write(counts):
+    """Add ``counts`` (link_id -> views) to the database, one UPDATE per distinct count."""
+    by_count = defaultdict(list)
+    for link_id, views in counts.items():
+        if views:
+            by_count[views].append(link_id)
+    if not by_count:
+        return
+
+    with transaction.atomic():
+        for views, link_ids in by_count.items():
+            for start in range(0, len(link_ids), FLUSH_CHUNK):
+                ImageLink.objects.filter(link_id__in=link_ids[start:start + FLUSH_CHUNK]).update(
+                    view_count=F('view_count') + views,
+                )
+
+
+def _flush_buffer():
+    global _last_flush
+
+    with _lock:
+        counts = dict(_pending)
+        _pending.clear()
+        _last_flush = time.monotonic()
+
+    try:
+        _write(counts)
+    except Exception:
+        # Put the views back so the next flush retries them
+        with _lock:
+            _pending.update(counts)
+        raise
+    return sum(counts.values())
+
+
+def _flush_cache(link_ids=None):
+    global _last_flush
+
+    with _lock:
+        if link_ids is None:
+            link_ids = set(_dirty)
+        _dirty.difference_update(link_ids)
+        _last_flush = time.monotonic()
+
+    # Only one flusher at a time, or two could write the same views
+    if not cache.add(FLUSH_LOCK_KEY, 1, timeout=60):
+        with _lock:
+            _dirty.update(link_ids)
+        return 0
+
+    try:
+        keys = {_cache_key(link_id): link_id for link_id in link_ids}
+        try:
+            counts = {keys[key]: views for key, views in cache.get_many(list(keys)).items()}
+            _write(counts)
+        except Exception:
+            # The views are still in the cache; keep the links dirty so
+            # the next flush retries them
+            with _lock:
+                _dirty.update(link_ids)
+            raise
+        # Subtract what was written; views counted meanwhile stay behind.
+        # Restart the key's timeout so links that stop getting views
+        # don't leave their keys in the cache for good
+        timeout = _config().get('key_timeout', KEY_TIMEOUT)
+        for link_id, views in counts.items():
+            if views:
+                key = _cache_key(link_id)
+                cache.decr(key, views)
+                cache.touch(key, timeout)
+        return sum(counts.values())
+    finally:
+        cache.delete(FLUSH_LOCK_KEY)
+
+
+def flush(link_ids=None):
+    """
+    Write the buffered views to the database.
+
+    Args:
+        link_ids: In cache mode, links to flush besides the ones this
+            process has counted (e.g. every link, from a cron job)
+
+    Returns:
+        Number of views written
+    """
+    if _config().get('mode', 'buffered') == 'cache':
+        if link_ids is not None:
+            with _lock:
+                link_ids = set(link_ids) | _dirty
+        return _flush_cache(link_ids)
+    return _flush_buffer()
+
+
+@checks.register(checks.Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """Cache mode needs a default cache that every process shares."""
+    if _config().get('mode', 'buffered') != 'cache':
+        return []
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend not in PER_PROCESS_CACHES:
+        return []
+    return [checks.Error(
+        f"VIEW_COUNTER['mode'] is 'cache' but the default cache ({backend}) is per process.",
+        hint="Configure a shared cache (Redis, Memcached, database) or use the 'buffered' mode.",
+        id='tools.E001',
+    )]
+
+
+def reset():
+    """Forget buffered views (used in tests)."""
+    global _last_flush
+
+    with _lock:
+        _pending.clear()
+        _dirty.clear()
+        _last_flush = time.monotonic()
+
+
+@atexit.register
+def _flush_at_exit():
+    try:
+        flush()
+    except Exception:
+        pass
@@ -1,19 +1,28 @@
 import io
 import os
-import numpy as np
+import tempfile
 from django.shortcuts import render, get_object_or_404
-from django.http import HttpResponse, JsonResponse
+from django.urls import reverse
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.core.exceptions import ValidationError
+from django.db import transaction
 from PIL import Image
-import qrcode
-from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.utils import ImageReader
 from django.utils import timezone
 from datetime import timedelta
 from .models import ImageLink
 from django_ratelimit.decorators import ratelimit
 from .security import validate_upload, sanitize_filename
+from .admission import (
+    PixelBudgetExceeded, busy_response, estimate_decoded_bytes, pixel_budget_admission, reserved,
+)
+from .result_cache import cached_result
+from . import blob_store, renditions, view_counter
+from .file_serving import serve_file
+from .services import ImageProcessor, SegmentationService, replace_background_color
+from .services import animation, batch_convert, pdf_export, qr_bulk, qr_render, target_size
+from .services.encoder_profiles import encoder_options
 
 
 def home(request):
@@ -21,6 +30,8 @@ def home(request):
 
 
 @ratelimit(key='ip', rate='100/h', method='POST')
+@cached_result('image_to_pdf')
+@pixel_budget_admission(per_file=('images',))
 def image_to_pdf(request):
     if request.method == 'POST':
         # CHECK RATE LIMIT FIRST
@@ -36,131 +47,57 @@ def image_to_pdf(request):
             page_size = letter  # 8.5" x 11"
         else:
             page_size = A4  # 210mm x 297mm (default)
-        
-        page_width, page_height = page_size
 
         # Get uploaded images
         files = request.FILES.getlist("images")
         if not files:
             return JsonResponse({'error': 'No images uploaded'}, status=400)
 
-        pil_images = []
+        # Pages are written one at a time to a temp file that only spills
+        # to disk once it gets large, then streamed back
+        config = getattr(settings, 'PDF_EXPORT', {})
+        pdf_file = tempfile.SpooledTemporaryFile(max_size=config.get('spool_bytes', 8 * 1024 * 1024))
+        writer = pdf_export.PdfWriter(pdf_file)
 
         try:
-            for i, file in enumerate(files):
-                # Validate file
-                validate_upload(file, max_size_mb=10, image_only=True)
-                
-                img = Image.open(file)
-
-                # Get rotation value
-                rotate_val = int(request.POST.get(f"rotate_{i}", 0))
-                if rotate_val != 0:
-                    img = img.rotate(-rotate_val, expand=True)
-
-                # Convert to RGB for PDF
-                if img.mode != "RGB":
-                    img = img.convert("RGB")
-
-                # Handle different size options
-                if page_size_option == 'original':
-                    # Keep original size - no resizing
-                    pil_images.append(img)
-                
-                elif page_size_option == 'fit-width':
-                    # Fit to page width, maintain aspect ratio
-                    img_width, img_height = img.size
-                    aspect_ratio = img_height / img_width
-                    
-                    # Use 90% of page width (leave margins)
-                    new_width = int(page_width * 0.9)
-                    new_height = int(new_width * aspect_ratio)
-                    
-                    # If height exceeds page, scale down
-                    if new_height > page_height * 0.9:
-                        new_height = int(page_height * 0.9)
-                        new_width = int(new_height / aspect_ratio)
-                    
-                    img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                    pil_images.append(img)
-                
-                else:
-                    # A4 or Letter - fit to page, maintain aspect ratio
-                    img_width, img_height = img.size
-                    aspect_ratio = img_width / img_height
-                    
-                    # Calculate dimensions to fit page (with margins)
-                    max_width = page_width * 0.9
-                    max_height = page_height * 0.9
-                    
-                    if aspect_ratio > 1:
-                        # Landscape image - fit to width
-                        new_width = int(max_width)
-                        new_height = int(new_width / aspect_ratio)
-                    else:
-                        # Portrait image - fit to height
-                        new_height = int(max_height)
-                        new_width = int(new_height * aspect_ratio)
-                    
-                    # Make sure it doesn't exceed page
-                    if new_width > max_width:
-                        new_width = int(max_width)
-                        new_height = int(new_width / aspect_ratio)
-                    
-                    if new_height > max_height:
-                        new_height = int(max_height)
-                        new_width = int(new_height * aspect_ratio)
-                    
-                    img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                    pil_images.append(img)
-
-            # Create PDF based on size option
-            if page_size_option == 'original':
-                # Original size - use PIL method (no reportlab)
-                pdf_buffer = io.BytesIO()
-                pil_images[0].save(
-                    pdf_buffer,
-                    format="PDF",
-                    save_all=True,
-                    append_images=pil_images[1:] if len(pil_images) > 1 else None
-                )
-            else:
-                # A4, Letter, or Fit-width - use reportlab for consistent page sizes
-                pdf_buffer = io.BytesIO()
-                c = canvas.Canvas(pdf_buffer, pagesize=page_size)
-                
-                for img in pil_images:
-                    # Convert PIL image to reportlab ImageReader
-                    img_buffer = io.BytesIO()
-                    img.save(img_buffer, format='PNG')
-                    img_buffer.seek(0)
-                    
-                    img_reader = ImageReader(img_buffer)
-                    img_width, img_height = img.size
-                    
-                    # Center image on page
-                    x = (page_width - img_width) / 2
-                    y = (page_height - img_height) / 2
-                    
-                    c.drawImage(img_reader, x, y, width=img_width, height=img_height)
-                    c.showPage()
-                
-                c.save()
-
-            pdf_buffer.seek(0)
-            response = HttpResponse(pdf_buffer, content_type='application/pdf')
-            response['Content-Disposition'] = 'attachment; filename="converted.pdf"'
-            return response
+            # Validate every file (headers only) before rendering anything
+            uploads = [validate_upload(file, max_size_mb=10, image_only=True) for file in files]
+
+            # Get rotation values
+            rotations = [int(request.POST.get(f"rotate_{i}", 0)) for i in range(len(uploads))]
+
+            pages = pdf_export.render_pages(uploads, rotations, page_size_option, page_size)
+            for upload, page in zip(uploads, pages):
+                writer.add_page(page)
+
+                # Drop the decoded pixels before moving on to the next page
+                upload.image.close()
+
+            writer.close()
+            pdf_file.seek(0)
+            return FileResponse(
+                pdf_file,
+                as_attachment=True,
+                filename='converted.pdf',
+                content_type='application/pdf',
+            )
 
         except ValidationError as e:
+            pdf_file.close()
             return JsonResponse({'error': str(e)}, status=400)
+        except PixelBudgetExceeded:
+            pdf_file.close()
+            return busy_response()
         except Exception as e:
+            pdf_file.close()
             return JsonResponse({'error': 'Processing error'}, status=500)
 
     return render(request, 'tools/image_to_pdf.html')
 
 
 @ratelimit(key='ip', rate='100/h', method='POST')
+@cached_result('format_converter')
+@pixel_budget_admission(per_file=('images',))
 def format_converter(request):
     """Image Format Converter - Convert between PNG, JPG, WEBP, BMP, TIFF, GIF, ICO"""
     
@@ -176,71 +113,213 @@ def format_converter(request):
             try:
                 image_file = request.FILES.get('image')
                 output_format = request.POST.get('output_format', 'PNG').upper()
+                profile = request.POST.get('profile') or None
                 
                 if not image_file:
                     return JsonResponse({'error': 'No image uploaded'}, status=400)
                 
                 # Validate file
-                validate_upload(image_file, max_size_mb=10, image_only=True)
-                
-                # Open and convert image
-                img = Image.open(image_file)
-                
-                # Handle transparency for JPG
-                if output_format in ['JPEG', 'JPG'] and img.mode in ('RGBA', 'LA', 'P'):
-                    background = Image.new('RGB', img.size, (255, 255, 255))
-                    if img.mode == 'P':
-                        img = img.convert('RGBA')
-                    background.paste(img, mask=img.split()[-1] if img.mode == 'RGBA' else None)
-                    img = background
-                elif img.mode != 'RGB' and output_format not in ['PNG', 'WEBP']:
-                    img = img.convert('RGB')
-                
-                # Save to buffer
-                img_buffer = io.BytesIO()
+                upload = validate_upload(image_file, max_size_mb=10, image_only=True)
                 
+                # Convert image
                 if output_format == 'JPG':
                     output_format = 'JPEG'
                 
-                img.save(img_buffer, format=output_format, quality=95)
-                img_buffer.seek(0)
+                content_type = ImageProcessor.CONTENT_TYPES.get(output_format, 'image/png')
+                filename = f'converted.{output_format.lower()}'
                 
-                content_types = {
-                    'PNG': 'image/png',
-                    'JPEG': 'image/jpeg',
-                    'WEBP': 'image/webp',
-                    'BMP': 'image/bmp',
-                    'TIFF': 'image/tiff',
-                    'GIF': 'image/gif',
-                    'ICO': 'image/x-icon'
-                }
+                # Animated images keep their frames when the target can
+                # store them; they're written to a spooled temp file frame
+                # by frame instead of being decoded all at once
+                config = getattr(settings, 'ANIMATION', {})
+                if (config.get('enabled', True) and output_format in animation.ANIMATED_FORMATS
+                        and animation.is_animated(upload.image)):
+                    output = tempfile.SpooledTemporaryFile(max_size=config.get('spool_bytes', 8 * 1024 * 1024))
+                    try:
+                        animation.convert_animation(upload.image, output_format, output, profile)
+                    except Exception:
+                        output.close()
+                        raise
+                    output.seek(0)
+                    return FileResponse(output, as_attachment=True, filename=filename, content_type=content_type)
                 
-                response = HttpResponse(img_buffer.getvalue(), 
-                                      content_type=content_types.get(output_format, 'image/png'))
-                response['Content-Disposition'] = f'attachment; filename="converted.{output_format.lower()}"'
+                data = ImageProcessor.convert_format(upload.image, output_format, profile)
+                
+                response = HttpResponse(data, content_type=content_type)
+                response['Content-Disposition'] = f'attachment; filename="{filename}"'
                 return response
             
-            except ValidationError as e:
+            except (ValidationError, ValueError) as e:
                 return JsonResponse({'error': str(e)}, status=400)
             except Exception as e:
                 return JsonResponse({'error': 'Conversion error'}, status=500)
         
+        elif conversion_type == 'batch_format':
+            files = request.FILES.getlist('images')
+            output_format = request.POST.get('output_format', 'PNG').upper()
+            profile = request.POST.get('profile') or None
+            config = getattr(settings, 'BATCH_CONVERT', {})
+            
+            if not files:
+                return JsonResponse({'error': 'No images uploaded'}, status=400)
+            
+            max_files = config.get('max_files', 50)
+            if len(files) > max_files:
+                return JsonResponse({'error': f'Too many files (max {max_files})'}, status=400)
+            
+            if output_format == 'JPG':
+                output_format = 'JPEG'
+            
+            if output_format not in ImageProcessor.SUPPORTED_FORMATS:
+                return JsonResponse({'error': f'Unsupported format: {output_format}'}, status=400)
+            
+            try:
+                encoder_options(output_format, profile)
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+            
+            try:
+                # Validate every file (headers only) before streaming starts
+                uploads = [validate_upload(file, max_size_mb=10, image_only=True) for file in files]
+            except ValidationError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+            
+            workers = config.get('workers') or min(4, os.cpu_count() or 1)
+            response = StreamingHttpResponse(
+                batch_convert.stream_zip(
+                    uploads, output_format, profile, workers,
+                    keep_animation=getattr(settings, 'ANIMATION', {}).get('enabled', True),
+                ),
+                content_type='application/zip',
+            )
+            response['Content-Disposition'] = 'attachment; filename="converted.zip"'
+            return response
+        
         else:
             return JsonResponse({'error': 'Invalid conversion type'}, status=400)
     
     return render(request, 'tools/format_converter.html')
 
 
+@ratelimit(key='ip', rate='100/h', method='POST')
+@cached_result('image_compressor')
+@pixel_budget_admission
 def image_compressor(request):
+    if request.method == 'POST':
+        was_limited = getattr(request, 'limited', False)
+        if was_limited:
+            return JsonResponse({'error': 'Too many requests. Please try again later.'}, status=429)
+        
+        image_file = request.FILES.get('image')
+        if not image_file:
+            return JsonResponse({'error': 'No image uploaded'}, status=400)
+        
+        try:
+            quality = int(request.POST.get('quality', 75))
+            target_kb = float(request.POST.get('target_kb') or 0)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid quality or target size'}, status=400)
+        
+        try:
+            upload = validate_upload(image_file, max_size_mb=10, image_only=True)
+            
+            if target_kb > 0:
+                # Search for the best quality (and scale) under the budget
+                config = getattr(settings, 'COMPRESSOR', {})
+                result = target_size.compress_to_size(
+                    upload.image,
+                    int(target_kb * 1024),
+                    proxy_pixels=config.get('proxy_pixels', 500_000),
+                    min_quality=config.get('min_quality', 30),
+                    max_quality=config.get('max_quality', 95),
+                    attempts=config.get('attempts', 8),
+                )
+                data = result.data
+                output_format = result.output_format
+            elif upload.image.format == 'PNG':
+                # PNGs stay PNGs; a palette is only used when asked for
+                result = None
+                output_format = 'PNG'
+                try:
+                    colors = int(request.POST.get('png_colors', 256))
+                except ValueError:
+                    return JsonResponse({'error': 'Invalid number of colours'}, status=400)
+                data = ImageProcessor.compress_image(upload.image, quality, output_format, png_options={
+                    'palette': request.POST.get('png_palette') == 'on',
+                    'colors': colors,
+                    'method': request.POST.get('png_method', 'fast_octree'),
+                    'dither': request.POST.get('png_dither', 'on') == 'on',
+                })
+            else:
+                result = None
+                output_format = upload.image.format if upload.image.format in target_size.LOSSY_FORMATS else 'JPEG'
+                image = ImageProcessor.prepare_for_format(upload.image, output_format)
+                data = ImageProcessor.compress_image(image, quality, output_format)
+            
+            extension = 'jpg' if output_format == 'JPEG' else output_format.lower()
+            response = HttpResponse(data, content_type=ImageProcessor.CONTENT_TYPES[output_format])
+            response['Content-Disposition'] = f'attachment; filename="compressed.{extension}"'
+            response['X-Original-Size'] = str(image_file.size)
+            response['X-Compressed-Size'] = str(len(data))
+            if result is not None:
+                response['X-Compress-Quality'] = str(result.quality)
+                response['X-Compress-Scale'] = f'{result.scale:.3f}'
+                response['X-Compress-Probes'] = str(result.probes)
+                response['X-Compress-Time-Ms'] = str(round(result.seconds * 1000))
+            return response
+        
+        except ValidationError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        except Exception as e:
+            return JsonResponse({'error': 'Compression error'}, status=500)
+    
     return render(request, 'tools/image_compressor.html')
 
 
 @ratelimit(key='ip', rate='100/h', method='POST')
+@cached_result('qr_generator')
 def qr_generator(request):
     if request.method == 'POST':
         was_limited = getattr(request, 'limited', False)
         if was_limited:
             return JsonResponse({'error': 'Too many requests. Please try again later.'}, status=429)
+        
+        if request.POST.get('mode') == 'bulk':
+            # Many codes from a CSV or a list of lines, streamed as a ZIP
+            config = getattr(settings, 'QR_BULK', {})
+            max_bytes = config.get('max_bytes', 2 * 1024 * 1024)
+            upload = request.FILES.get('file')
+            # Checked before anything is read or parsed
+            if (upload.size if upload else len(request.POST.get('payloads', ''))) > max_bytes:
+                return JsonResponse({'error': f'Input too large (max {max_bytes // 1024} KB)'}, status=400)
+            try:
+                text = upload.read().decode('utf-8-sig') if upload else request.POST.get('payloads', '')
+            except UnicodeDecodeError:
+                return JsonResponse({'error': 'The file must be UTF-8 text'}, status=400)
+            
+            error_correction = request.POST.get('error_correction', 'H').upper()
+            if error_correction not in qr_render.ERROR_CORRECTION_LEVELS:
+                return JsonResponse({'error': 'Invalid error correction level (L, M, Q or H)'}, status=400)
+            try:
+                size = int(request.POST.get('size', 300))
+            except ValueError:
+                return JsonResponse({'error': 'Invalid size (100-1000 pixels)'}, status=400)
+            
+            max_rows = config.get('max_rows', 5000)
+            rows = qr_bulk.parse_rows(text, size, error_correction, max_rows=max_rows)
+            if not rows:
+                return JsonResponse({'error': 'No links or text provided'}, status=400)
+            
+            if len(rows) > max_rows:
+                return JsonResponse({'error': f'Too many rows (max {max_rows})'}, status=400)
+            
+            workers = config.get('workers') or min(4, os.cpu_count() or 1)
+            response = StreamingHttpResponse(
+                qr_bulk.stream_zip(rows, workers, config.get('batch_size', 32)),
+                content_type='application/zip',
+            )
+            response['Content-Disposition'] = 'attachment; filename="qr-codes.zip"'
+            return response
             
         link = request.POST.get('data', '').strip()
         if not link:
@@ -256,24 +335,13 @@ def qr_generator(request):
         if size > 1000 or size < 100:
             return JsonResponse({'error': 'Invalid size (100-1000 pixels)'}, status=400)
 
-        try:
-            qr = qrcode.QRCode(
-                version=1,
-                error_correction=qrcode.constants.ERROR_CORRECT_H,
-                box_size=10,
-                border=4
-            )
-            qr.add_data(link)
-            qr.make(fit=True)
-
-            img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
-            img = img.resize((size, size), Image.NEAREST)
-
-            img_buffer = io.BytesIO()
-            img.save(img_buffer, format='PNG')
-            img_buffer.seek(0)
+        error_correction = request.POST.get('error_correction', 'H').upper()
+        if error_correction not in qr_render.ERROR_CORRECTION_LEVELS:
+            return JsonResponse({'error': 'Invalid error correction level (L, M, Q or H)'}, status=400)
 
-            return HttpResponse(img_buffer.getvalue(), content_type='image/png')
+        try:
+            png = qr_render.render_qr(link, size, error_correction)
+            return HttpResponse(png, content_type='image/png')
         except Exception as e:
             return JsonResponse({'error': 'QR generation error'}, status=500)
 
@@ -310,13 +378,14 @@ def image_link_generator(request):
             
             expires_at = now + expiry_times.get(expiry_duration, timedelta(days=1))
             
-            # Create ImageLink object
-            image_link = ImageLink.objects.create(
-                image=image_file,
-                original_filename=sanitize_filename(image_file.name),
-                expiry_duration=expiry_duration,
-                expires_at=expires_at
-            )
+            # Create ImageLink object; identical uploads share one stored file
+            with transaction.atomic():
+                image_link = ImageLink.objects.create(
+                    image=blob_store.store(image_file),
+                    original_filename=sanitize_filename(image_file.name),
+                    expiry_duration=expiry_duration,
+                    expires_at=expires_at
+                )
             
             # Generate shareable URL
             share_url = request.build_absolute_uri(f'/view-image/{image_link.link_id}/')
@@ -343,22 +412,72 @@ def view_shared_image(request, link_id):
     image_link = get_object_or_404(ImageLink, link_id=link_id)
     
     if image_link.is_expired():
-        image_link.delete_image_file()
+        # Releases the image too (blob_store's delete hooks)
         image_link.delete()
         return render(request, 'tools/link_expired.html')
     
-    image_link.view_count += 1
-    image_link.save()
+    # Views are buffered and written in batches rather than saved here;
+    # show the stored count plus the views still waiting, this one included
+    image_link.view_count += view_counter.pending_views(image_link.link_id) + 1
+    view_counter.record_view(image_link.link_id)
     
+    image_url = reverse('tools:shared_image_file', args=[image_link.link_id])
     context = {
         'image_link': image_link,
+        'image_url': image_url,
+        'srcsets': renditions.srcsets(
+            image_link.image.storage,
+            image_link.image.name,
+            image_url,
+            lambda width, ext: reverse('tools:shared_image_rendition', args=[image_link.link_id, width, ext]),
+        ),
         'time_remaining': image_link.expires_at - timezone.now()
     }
     
     return render(request, 'tools/view_shared_image.html', context)
 
 
+def shared_image_file(request, link_id, width=None, ext=None):
+    """Serve the file behind a shared link, or a rendition of it, cacheable until the link expires"""
+
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponse(status=405, headers={'Allow': 'GET, HEAD'})
+
+    image_link = get_object_or_404(ImageLink, link_id=link_id)
+
+    if image_link.is_expired():
+        # The reaper or the next page view removes the link and its file
+        return HttpResponse(status=410)
+
+    storage = image_link.image.storage
+    name = image_link.image.name
+    try:
+        if width is not None:
+            # Made on first request; later ones find the stored file
+            if renditions.rendition_exists(storage, name, width, ext):
+                name = renditions.rendition_name(name, width, ext)
+            else:
+                with storage.open(name, 'rb') as f:
+                    nbytes = estimate_decoded_bytes([f])
+                with reserved(nbytes) as admitted:
+                    if not admitted:
+                        return busy_response()
+                    name = renditions.ensure_rendition(storage, name, width, ext)
+        return serve_file(
+            request,
+            name,
+            storage.path(name),
+            expires_at=image_link.expires_at,
+            filename=image_link.original_filename,
+            as_attachment=request.GET.get('download') == '1',
+        )
+    except (FileNotFoundError, ValueError):
+        raise Http404('Image not found')
+
+
 @ratelimit(key='ip', rate='50/h', method='POST')
+@cached_result('background_remover')
+@pixel_budget_admission
 def background_remover(request):
     """Remove background from images - FREE premium feature!"""
     
@@ -374,13 +493,10 @@ def background_remover(request):
         
         try:
             # Validate file
-            validate_upload(image_file, max_size_mb=10, image_only=True)
-            
-            from rembg import remove
-            from PIL import Image
+            upload = validate_upload(image_file, max_size_mb=10, image_only=True)
             
-            img = Image.open(image_file)
-            output = remove(img)
+            img = upload.image
+            output = SegmentationService.remove_background(img)
             
             img_buffer = io.BytesIO()
             output.save(img_buffer, format='PNG')
@@ -401,6 +517,8 @@ def background_remover(request):
 
 
 @ratelimit(key='ip', rate='100/h', method='POST')
+@cached_result('id_photo_resizer')
+@pixel_budget_admission
 def id_photo_resizer(request):
     if request.method == 'POST':
         was_limited = getattr(request, 'limited', False)
@@ -415,7 +533,7 @@ def id_photo_resizer(request):
         
         try:
             # Validate file
-            validate_upload(image_file, max_size_mb=10, image_only=True)
+            upload = validate_upload(image_file, max_size_mb=10, image_only=True)
             
             from PIL import Image
             
@@ -431,10 +549,7 @@ def id_photo_resizer(request):
             
             target_size = sizes.get(size_option, (1200, 1800))
             
-            img = Image.open(image_file)
-            
-            if img.mode != 'RGB':
-                img = img.convert('RGB')
+            img = upload.image
             
             img_ratio = img.width / img.height
             target_ratio = target_size[0] / target_size[1]
@@ -446,6 +561,12 @@ def id_photo_resizer(request):
                 new_width = target_size[0]
                 new_height = int(new_width / img_ratio)
             
+            # Decode only as many pixels as the final resize needs
+            img = ImageProcessor.open_for_target_size(img, (new_width, new_height))
+            
+            if img.mode != 'RGB':
+                img = img.convert('RGB')
+            
             img = img.resize((new_width, new_height), Image.Resampling.LANCZOS)
             
             new_img = Image.new('RGB', target_size, (255, 255, 255))
@@ -471,6 +592,7 @@ def id_photo_resizer(request):
 
 
 @ratelimit(key='ip', rate='50/h', method='POST')
+@pixel_budget_admission
 def background_changer(request):
     if request.method == 'POST':
         was_limited = getattr(request, 'limited', False)
@@ -487,49 +609,21 @@ def background_changer(request):
         
         try:
             # Validate file
-            validate_upload(image_file, max_size_mb=10, image_only=True)
-            
-            from PIL import Image
-            import numpy as np
+            upload = validate_upload(image_file, max_size_mb=10, image_only=True)
             
             bg_color_hex = bg_color_hex.lstrip('#')
             new_bg_color = tuple(int(bg_color_hex[i:i+2], 16) for i in (0, 2, 4))
             
-            img = Image.open(image_file)
+            img = upload.image
             
             if img.mode != 'RGB':
                 img = img.convert('RGB')
             
-            img_array = np.array(img)
-            
             if mode == 'auto':
-                from rembg import remove
-                
-                img_no_bg = remove(img)
-                new_img = Image.new('RGB', img_no_bg.size, new_bg_color)
-                
-                if img_no_bg.mode == 'RGBA':
-                    new_img.paste(img_no_bg, (0, 0), img_no_bg)
-                else:
-                    new_img.paste(img_no_bg, (0, 0))
+                new_img = SegmentationService.replace_background(img, new_bg_color)
             
             else:
-                h, w = img_array.shape[:2]
-                corner_pixels = [
-                    img_array[0, 0],
-                    img_array[0, w-1],
-                    img_array[h-1, 0],
-                    img_array[h-1, w-1]
-                ]
-                avg_bg_color = np.mean(corner_pixels, axis=0).astype(int)
-                
-                color_distance = np.sqrt(np.sum((img_array.astype(int) - avg_bg_color) ** 2, axis=2))
-                mask = color_distance <= tolerance
-                
-                new_img_array = img_array.copy()
-                new_img_array[mask] = new_bg_color
-                
-                new_img = Image.fromarray(new_img_array.astype('uint8'))
+                new_img = replace_background_color(img, new_bg_color, tolerance)
             
             img_buffer = io.BytesIO()
             new_img.save(img_buffer, format='PNG')